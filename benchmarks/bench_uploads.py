@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks for the upload hot path.
+
+Runs against sqlite and the local filesystem in a temporary directory, and
+writes machine-readable JSON results so runs can be compared:
+
+    python benchmarks/bench_uploads.py --output before.json
+    python benchmarks/bench_uploads.py --output after.json --compare before.json
+
+Benchmarks:
+
+- `put_chunk`: MB/s, per-request latency and DB queries per chunk of
+  `ChunkedUploadView` PUTs, for multipart and raw chunk bodies across chunk
+  sizes, plus the latency of the completion POST.
+- `checksum`: seconds per GB of `AbstractChunkedUpload.checksum` when the file
+  has to be hashed in full, for each checksum type.
+- `durability`: MB/s and per-request latency of raw chunk PUTs (and the
+  completion POST) for each `DRF_CHUNKED_UPLOAD_DURABILITY` mode.
+- `delete_expired_uploads`: rows per second deleted by the command.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+KB = 1024
+MB = 1024 * KB
+
+DEFAULT_CHUNK_SIZES = [64 * KB, 1 * MB, 8 * MB, 64 * MB]
+DEFAULT_CHECKSUM_TYPES = ['md5', 'sha1', 'sha256']
+DEFAULT_DURABILITY_MODES = ['none', 'completion', 'interval']
+
+urlpatterns = []
+
+
+def configure(workdir):
+    from django.conf import settings
+
+    settings.configure(
+        DEBUG=False,
+        ALLOWED_HOSTS=['testserver'],
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(workdir, 'bench.sqlite3'),
+            },
+        },
+        SECRET_KEY='benchmark key',
+        ROOT_URLCONF=__name__,
+        MEDIA_ROOT=os.path.join(workdir, 'media'),
+        INSTALLED_APPS=(
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'rest_framework',
+            'drf_chunked_upload',
+        ),
+        DRF_CHUNKED_UPLOAD_ABSTRACT_MODEL=False,
+        DRF_CHUNKED_UPLOAD_PATH='',
+    )
+
+    import django
+    django.setup()
+
+    from django.urls import re_path
+    from drf_chunked_upload.views import ChunkedUploadView
+    urlpatterns[:] = [
+        re_path(r'^$', ChunkedUploadView.as_view(), name='chunkedupload-list'),
+        re_path(r'^(?P<pk>[0-9a-f-]+)/$', ChunkedUploadView.as_view(),
+                name='chunkedupload-detail'),
+    ]
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'mean': statistics.mean(latencies) * 1000,
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        'max': latencies[-1] * 1000,
+    }
+
+
+def build_put(factory, data, start, total, mode):
+    content_range = 'bytes {}-{}/{}'.format(start, start + len(data) - 1, total)
+    if mode == 'raw':
+        return factory.put(
+            '/',
+            data,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=content_range,
+            HTTP_CONTENT_DISPOSITION='attachment; filename="bench"',
+        )
+    return factory.put(
+        '/',
+        {'filename': 'bench', 'file': io.BytesIO(data)},
+        format='multipart',
+        HTTP_CONTENT_RANGE=content_range,
+    )
+
+
+def bench_put_chunk(user, chunk_size, total, mode):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIRequestFactory
+    from drf_chunked_upload.views import ChunkedUploadView
+
+    factory = APIRequestFactory()
+    view = ChunkedUploadView.as_view()
+    count = max(total // chunk_size, 1)
+    total = count * chunk_size
+    data = os.urandom(chunk_size)
+    checksum = hashlib.md5()
+
+    latencies = []
+    queries = 0
+    pk = None
+    started = time.perf_counter()
+    for index in range(count):
+        request = build_put(factory, data, index * chunk_size, total, mode)
+        request.user = user
+        with CaptureQueriesContext(connection) as context:
+            request_started = time.perf_counter()
+            response = view(request, pk=pk)
+            latencies.append(time.perf_counter() - request_started)
+        if response.status_code != 200:
+            raise RuntimeError('PUT failed: {}'.format(response.data))
+        if index:
+            queries += len(context.captured_queries)
+        pk = response.data['id']
+        checksum.update(data)
+    elapsed = time.perf_counter() - started
+
+    request = factory.post('/', {'md5': checksum.hexdigest()}, format='multipart')
+    request.user = user
+    post_started = time.perf_counter()
+    response = view(request, pk=pk)
+    post_latency = time.perf_counter() - post_started
+    if response.status_code != 200:
+        raise RuntimeError('POST failed: {}'.format(response.data))
+
+    return {
+        'benchmark': 'put_chunk',
+        'params': {'mode': mode, 'chunk_size': chunk_size, 'total': total},
+        'mb_per_s': total / MB / elapsed,
+        'latency_ms': summarize(latencies),
+        'queries_per_chunk': queries / (count - 1) if count > 1 else None,
+        'post_latency_ms': post_latency * 1000,
+    }
+
+
+def bench_checksum(user, checksum_type, size):
+    from django.core.files.uploadedfile import UploadedFile
+    from drf_chunked_upload import settings as _settings
+    from drf_chunked_upload.checksums import hash_states
+    from drf_chunked_upload.models import ChunkedUpload
+
+    chunked_upload = ChunkedUpload(
+        user=user,
+        filename='bench',
+        file=UploadedFile(io.BytesIO(os.urandom(size)), name='bench'),
+        offset=size,
+    )
+    chunked_upload.save()
+
+    original_type = _settings.CHECKSUM_TYPE
+    _settings.CHECKSUM_TYPE = checksum_type
+    try:
+        hash_states.discard(chunked_upload.id)
+        started = time.perf_counter()
+        chunked_upload.checksum
+        elapsed = time.perf_counter() - started
+    finally:
+        _settings.CHECKSUM_TYPE = original_type
+        chunked_upload.delete()
+
+    return {
+        'benchmark': 'checksum',
+        'params': {'checksum_type': checksum_type, 'size': size},
+        'seconds_per_gb': elapsed * (1024 * MB) / size,
+    }
+
+
+def bench_durability(user, mode, chunk_size, total, interval_bytes):
+    from drf_chunked_upload import settings as _settings
+
+    original = _settings.DURABILITY, _settings.DURABILITY_INTERVAL_BYTES
+    _settings.DURABILITY, _settings.DURABILITY_INTERVAL_BYTES = mode, interval_bytes
+    try:
+        result = bench_put_chunk(user, chunk_size, total, 'raw')
+    finally:
+        _settings.DURABILITY, _settings.DURABILITY_INTERVAL_BYTES = original
+
+    result['benchmark'] = 'durability'
+    result['params'] = {
+        'mode': mode,
+        'chunk_size': chunk_size,
+        'total': result['params']['total'],
+        'interval_bytes': interval_bytes,
+    }
+    return result
+
+
+def bench_delete_expired(user, rows):
+    from django.core.files.uploadedfile import UploadedFile
+    from django.core.management import call_command
+    from drf_chunked_upload import settings as _settings
+    from drf_chunked_upload.models import ChunkedUpload
+
+    for _ in range(rows):
+        ChunkedUpload(
+            user=user,
+            filename='bench',
+            file=UploadedFile(io.BytesIO(b'x' * KB), name='bench'),
+        ).save()
+
+    original_delta = _settings.EXPIRATION_DELTA
+    _settings.EXPIRATION_DELTA = timedelta(0)
+    try:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_command('delete_expired_uploads')
+        elapsed = time.perf_counter() - started
+    finally:
+        _settings.EXPIRATION_DELTA = original_delta
+
+    return {
+        'benchmark': 'delete_expired_uploads',
+        'params': {'rows': rows},
+        'rows_per_s': rows / elapsed,
+    }
+
+
+def result_key(result):
+    return json.dumps([result['benchmark'], result['params']], sort_keys=True)
+
+
+def compare(results, baseline):
+    """
+    Print the ratio of each metric to the matching baseline result.
+    """
+    previous = {result_key(result): result for result in baseline['results']}
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for metric in ('mb_per_s', 'seconds_per_gb', 'rows_per_s', 'queries_per_chunk'):
+            if result.get(metric) is not None and old.get(metric):
+                print('{} {} {}: {:.3g} -> {:.3g} ({:+.1%})'.format(
+                    result['benchmark'],
+                    json.dumps(result['params'], sort_keys=True),
+                    metric,
+                    old[metric],
+                    result[metric],
+                    result[metric] / old[metric] - 1,
+                ))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=DEFAULT_CHUNK_SIZES,
+                        help='Chunk sizes in bytes to benchmark PUTs with.')
+    parser.add_argument('--upload-size', type=int, default=128 * MB,
+                        help='Bytes uploaded per chunk size (at least one chunk).')
+    parser.add_argument('--modes', nargs='+', default=['multipart', 'raw'],
+                        choices=['multipart', 'raw'])
+    parser.add_argument('--checksum-types', nargs='+', default=DEFAULT_CHECKSUM_TYPES)
+    parser.add_argument('--checksum-size', type=int, default=256 * MB,
+                        help='Size of the file hashed by the checksum benchmark.')
+    parser.add_argument('--durability-modes', nargs='+', default=DEFAULT_DURABILITY_MODES,
+                        choices=DEFAULT_DURABILITY_MODES)
+    parser.add_argument('--durability-chunk-size', type=int, default=1 * MB,
+                        help='Chunk size in bytes of the durability benchmark.')
+    parser.add_argument('--durability-interval-bytes', type=int, nargs='+',
+                        default=[64 * MB],
+                        help="Intervals in bytes to benchmark the 'interval' mode with.")
+    parser.add_argument('--expired-rows', type=int, default=2000,
+                        help='Number of expired uploads deleted by the cleanup benchmark.')
+    parser.add_argument('--output', help='Write JSON results to this file.')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='drf_chunked_upload_bench') as workdir:
+        configure(workdir)
+
+        import django
+        import rest_framework
+        from django.contrib.auth.models import User
+
+        user = User.objects.create_user(username='bench', password='bench')
+        results = []
+        for mode in args.modes:
+            for chunk_size in args.chunk_sizes:
+                results.append(bench_put_chunk(user, chunk_size, args.upload_size, mode))
+        for checksum_type in args.checksum_types:
+            results.append(bench_checksum(user, checksum_type, args.checksum_size))
+        for mode in args.durability_modes:
+            intervals = args.durability_interval_bytes if mode == 'interval' else [None]
+            for interval_bytes in intervals:
+                results.append(bench_durability(user, mode, args.durability_chunk_size,
+                                                args.upload_size, interval_bytes))
+        results.append(bench_delete_expired(user, args.expired_rows))
+
+    output = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'djangorestframework': rest_framework.VERSION,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
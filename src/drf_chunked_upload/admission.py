@@ -0,0 +1,151 @@
+"""
+Admission control for chunk requests.
+
+Chunks are admitted from their headers, before the request body is read, or
+rejected with a 429 and a `Retry-After` header when over one of the limits:
+
+- `DRF_CHUNKED_UPLOAD_MAX_USER_CHUNKS`: chunks a user (or, for anonymous
+  users, a client address) can have in flight at once.
+- `DRF_CHUNKED_UPLOAD_MAX_NODE_BYTES_PER_SECOND`: bytes of chunks admitted per
+  second on a node (host), a budget refilled every second. A chunk larger
+  than the budget is admitted alone.
+- `DRF_CHUNKED_UPLOAD_MAX_ACTIVE_UPLOADS`: incomplete, unexpired uploads,
+  counted in the database when an upload is created.
+
+The counters live in the cache named by `DRF_CHUNKED_UPLOAD_ADMISSION_CACHE`
+and are updated with `incr`/`decr`, so the limits hold across the workers
+sharing it as long as the backend's `incr` is atomic (memcached, redis). A
+process-local cache such as locmem limits each worker on its own.
+"""
+import socket
+import time
+
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework.throttling import BaseThrottle
+
+from drf_chunked_upload import settings as _settings
+from drf_chunked_upload.exceptions import AdmissionError
+
+
+class Admission:
+    """
+    An admitted chunk, holding an in-flight slot of its user until
+    released.
+    """
+
+    def __init__(self, controller=None, key=None):
+        self.controller = controller
+        self.key = key
+
+    def release(self):
+        if self.key is not None:
+            self.controller.decr(self.key)
+            self.key = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    key_prefix = 'drf_chunked_upload:admission'
+    # seconds clients are told to wait when there are too many active uploads
+    upload_retry_after = 30
+
+    def __init__(self, alias, node=None):
+        self.alias = alias
+        self.node = node or socket.gethostname()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def incr(self, key, delta, timeout):
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            if self.cache.add(key, delta, timeout):
+                return delta
+            return self.cache.incr(key, delta)
+
+    def decr(self, key, delta=1):
+        try:
+            self.cache.decr(key, delta)
+        except ValueError:
+            # expired; nothing left to release
+            pass
+
+    def admit(self, ident, size, model=None):
+        """
+        Admit a chunk of `size` bytes from the client `ident`, creating a
+        new upload of `model` if given. Raises `AdmissionError` if over a
+        limit; otherwise returns an `Admission` to release once the chunk
+        is written.
+        """
+        key = self.admit_user(ident)
+        try:
+            self.admit_bytes(size)
+            if model is not None:
+                self.admit_upload(model)
+        except AdmissionError:
+            if key is not None:
+                self.decr(key)
+            raise
+        return Admission(self, key)
+
+    def admit_user(self, ident):
+        limit = _settings.MAX_USER_CHUNKS
+        if not limit:
+            return None
+        key = '{}:user:{}'.format(self.key_prefix, ident)
+        if self.incr(key, 1, _settings.ADMISSION_TIMEOUT.total_seconds()) > limit:
+            self.decr(key)
+            raise AdmissionError(retry_after=1, detail='Too many chunks in flight')
+        return key
+
+    def admit_bytes(self, size):
+        rate = _settings.MAX_NODE_BYTES_PER_SECOND
+        if not rate or not size:
+            return
+        key = '{}:node:{}:{}'.format(self.key_prefix, self.node, int(time.time()))
+        used = self.incr(key, size, 2)
+        if used > rate and used != size:
+            self.decr(key, size)
+            raise AdmissionError(retry_after=1, detail='Upload bandwidth exceeded')
+
+    def admit_upload(self, model):
+        limit = _settings.MAX_ACTIVE_UPLOADS
+        if not limit:
+            return
+        active = model.objects.filter(
+            status=model.UPLOADING,
+            created_at__gt=timezone.now() - _settings.EXPIRATION_DELTA,
+        ).count()
+        if active >= limit:
+            raise AdmissionError(retry_after=self.upload_retry_after,
+                                 detail='Too many active uploads')
+
+
+def get_client_ident(request):
+    """
+    Identify the client of `request` for per-user limits: the user id, or
+    the client address (as DRF throttling does) for anonymous users.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return 'user-{}'.format(user.pk)
+    return 'anon-{}'.format(BaseThrottle().get_ident(request))
+
+
+def get_admission_controller():
+    """
+    Get an `AdmissionController`, or `None` if no limit is configured.
+    """
+    if not (_settings.MAX_USER_CHUNKS
+            or _settings.MAX_NODE_BYTES_PER_SECOND
+            or _settings.MAX_ACTIVE_UPLOADS):
+        return None
+    return AdmissionController(_settings.ADMISSION_CACHE)
@@ -0,0 +1,162 @@
+"""
+Async variants of the chunked upload views, for ASGI deployments
+(requires Django 4.1 or later).
+
+Django's ASGI handler receives the request body without holding a thread,
+so a slow client only occupies the event loop while it uploads. The views
+then look uploads up with the async ORM API and run file writes, hashing
+and completion through `sync_to_async`, which under ASGI uses a thread for
+the current request only while that work runs.
+"""
+import inspect
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import Http404
+from rest_framework.response import Response
+
+from drf_chunked_upload import metrics
+from drf_chunked_upload.exceptions import ChunkedUploadError
+from drf_chunked_upload.timing import PhaseTimer, phase, timing
+from drf_chunked_upload.views import ChunkedUploadBaseView, ChunkedUploadView
+
+
+class AsyncChunkedUploadBaseView(ChunkedUploadBaseView):
+    """
+    Base view for async chunked upload views, whose `_put`, `_post` and
+    `_get` must be coroutines. Authentication, permission and throttling
+    checks run through `sync_to_async`.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not self.timing:
+            return await self._dispatch(request, *args, **kwargs)
+        timer = PhaseTimer()
+        with timing(timer), phase('total'):
+            response = await self._dispatch(request, *args, **kwargs)
+        await sync_to_async(self.report_timings)(self.request, response, timer)
+        return response
+
+    async def _dispatch(self, request, *args, **kwargs):
+        # mirrors APIView.dispatch, awaiting the handler
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(),
+                                  self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aget_chunked_upload(self, pk):
+        """
+        Get an upload by id with the async ORM API, or through the state
+        cache if enabled.
+        """
+        if self.get_state_cache() is not None:
+            return await sync_to_async(self.get_chunked_upload)(pk)
+        with phase('lookup'):
+            try:
+                return await self.get_queryset().aget(pk=pk)
+            except self.model.DoesNotExist:
+                raise Http404
+
+    async def put(self, request, pk=None, *args, **kwargs):
+        """
+        Handle PUT requests.
+        """
+        started = time.perf_counter()
+        try:
+            return await self._put(request, pk=pk, *args, **kwargs)
+        except ChunkedUploadError as error:
+            return Response(error.data, status=error.status_code, headers=error.headers)
+        finally:
+            metrics.chunk_seconds.observe(time.perf_counter() - started)
+
+    async def post(self, request, pk=None, *args, **kwargs):
+        """
+        Handle POST requests.
+        """
+        try:
+            return await self._post(request, pk=pk, *args, **kwargs)
+        except ChunkedUploadError as error:
+            metrics.completion_failures.inc(reason=error.code)
+            return Response(error.data, status=error.status_code, headers=error.headers)
+
+    async def get(self, request, pk=None, *args, **kwargs):
+        """
+        Handle GET requests.
+        """
+        try:
+            return await self._get(request, pk=pk, *args, **kwargs)
+        except ChunkedUploadError as error:
+            return Response(error.data, status=error.status_code, headers=error.headers)
+
+
+class AsyncChunkedUploadView(AsyncChunkedUploadBaseView, ChunkedUploadView):
+    """
+    Async variant of `ChunkedUploadView`, with the same options and hooks.
+    Overridden hooks (e.g. `on_completion`) stay synchronous.
+    """
+
+    async def _put_chunk(self, request, pk=None, whole=False, *args, **kwargs):
+        start, chunk_size = self.chunk_headers_check(request, whole)
+        admission = await sync_to_async(self.admit_chunk)(request, pk, chunk_size)
+        try:
+            if not (pk or whole) and self.instant_completion:
+                response = await sync_to_async(self.complete_instantly)(request)
+                if response is not None:
+                    return response
+            chunked_upload = None
+            if pk:
+                chunked_upload = await self.aget_chunked_upload(pk)
+            return await sync_to_async(self.save_chunk)(
+                request, chunked_upload, start, chunk_size,
+            )
+        finally:
+            await sync_to_async(admission.release)()
+
+    async def _put(self, request, pk=None, *args, **kwargs):
+        chunked_upload = await self._put_chunk(request, pk=pk, *args, **kwargs)
+        if isinstance(chunked_upload, Response):
+            # completed instantly
+            return chunked_upload
+        return await sync_to_async(self.put_response)(
+            request, chunked_upload, created=not pk,
+        )
+
+    async def _post(self, request, pk=None, *args, **kwargs):
+        chunked_upload = None
+        if not pk:
+            chunked_upload = await self._put_chunk(request, *args,
+                                                   whole=True, **kwargs)
+
+        checksum, chunk_checksums = await sync_to_async(
+            self.get_completion_checksums,
+        )(request)
+
+        if not chunked_upload:
+            chunked_upload = await self.aget_chunked_upload(pk)
+
+        return await sync_to_async(self.complete)(
+            request, chunked_upload, checksum, chunk_checksums,
+        )
+
+    async def _get(self, request, pk=None, *args, **kwargs):
+        return await sync_to_async(super()._get)(request, pk=pk, *args, **kwargs)
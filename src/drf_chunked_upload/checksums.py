@@ -0,0 +1,117 @@
+"""
+Incremental checksum state for in-progress uploads.
+
+hashlib objects cannot be serialized, so hash state lives in a bounded
+per-process registry keyed by upload id. Each entry remembers how many bytes
+of the upload it has consumed; a worker that did not see some of the chunks
+(e.g. after a restart) catches up by hashing only the bytes it missed.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.core.files.base import File
+
+from drf_chunked_upload import settings as _settings
+
+
+class HashState:
+    """
+    A running hash over the first `offset` bytes of an upload.
+    """
+
+    def __init__(self, checksum_type, offset=0):
+        self.checksum_type = checksum_type
+        self.hasher = hashlib.new(checksum_type)
+        self.offset = offset
+        self.lock = threading.RLock()
+
+    def update(self, data):
+        self.hasher.update(data)
+        self.offset += len(data)
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+class HashStateRegistry:
+    """
+    LRU-bounded mapping of upload id to `HashState`.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, checksum_type):
+        """
+        Return the state for `key` or a fresh one if none is usable.
+        Returns `None` if the registry is disabled (size of 0).
+        """
+        max_entries = self.max_entries
+        if max_entries is None:
+            max_entries = _settings.CHECKSUM_STATE_CACHE_SIZE
+        if not max_entries:
+            return None
+        with self._lock:
+            state = self._states.pop(key, None)
+            if state is None or state.checksum_type != checksum_type:
+                state = HashState(checksum_type)
+            self._states[key] = state
+            while len(self._states) > max_entries:
+                self._states.popitem(last=False)
+            return state
+
+    def put(self, key, state):
+        """
+        Replace the state for `key`, e.g. with one restored from storage.
+        """
+        with self._lock:
+            self._states.pop(key, None)
+            self._states[key] = state
+
+    def discard(self, key):
+        with self._lock:
+            self._states.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+
+hash_states = HashStateRegistry()
+
+
+class DigestingChunk(File):
+    """
+    Wraps a chunk, hashing its data as it is read through `chunks()`.
+    """
+
+    def __init__(self, chunk, checksum_type=None):
+        super().__init__(chunk, name=getattr(chunk, 'name', None))
+        self.size = chunk.size
+        self.hasher = hashlib.new(checksum_type or _settings.CHECKSUM_TYPE)
+
+    def chunks(self, chunk_size=None):
+        for data in self.file.chunks(chunk_size):
+            self.hasher.update(data)
+            yield data
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+def parse_chunk_checksums(value):
+    """
+    Parse stored chunk checksums (`'start-end:digest,...'`) into a dict of
+    `(start, end)` to digest. Later entries for a range replace earlier ones.
+    """
+    checksums = {}
+    for part in (value or '').split(','):
+        if not part:
+            continue
+        byte_range, digest = part.split(':')
+        start, end = byte_range.split('-')
+        checksums[(int(start), int(end))] = digest
+    return checksums
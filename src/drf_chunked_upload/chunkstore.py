@@ -0,0 +1,166 @@
+"""
+Content-addressed store of chunks, for deduplicating uploads.
+
+When `DRF_CHUNKED_UPLOAD_CHUNK_STORE` is set to a directory, every chunk
+received with a verified `X-Chunk-Checksum` is copied into it, named by its
+sha256 digest (whatever `CHECKSUM_TYPE` is, so colliding content cannot
+replace a stored chunk). Chunks are stored per owner: users can only find
+out about and reuse the chunks they uploaded themselves. Clients can ask
+which of their chunks are stored, and send those by reference instead of
+uploading them again. Chunks not used for
+`DRF_CHUNKED_UPLOAD_CHUNK_STORE_EXPIRATION_DELTA` are pruned by
+`delete_expired_uploads`.
+"""
+import hashlib
+import io
+import os
+import time
+import uuid
+
+from django.core.files.base import File
+
+from drf_chunked_upload import settings as _settings
+
+
+def copy_range(src, dst, offset, size):
+    """
+    Copy `size` bytes from `offset` in file `src` to the current position
+    of file `dst`, in the kernel (sharing extents on filesystems that
+    support it) where `os.copy_file_range` is available.
+    """
+    try:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        # not local files
+        src_fd = dst_fd = None
+    if src_fd is not None and hasattr(os, 'copy_file_range'):
+        copied = 0
+        try:
+            while copied < size:
+                count = os.copy_file_range(src_fd, dst_fd, size - copied, offset + copied)
+                if not count:
+                    break
+                copied += count
+            return copied
+        except OSError:
+            if copied:
+                raise
+            # e.g. not supported between these filesystems; fall back to read/write
+    src.seek(offset)
+    copied = 0
+    while copied < size:
+        data = src.read(min(File.DEFAULT_CHUNK_SIZE, size - copied))
+        if not data:
+            break
+        dst.write(data)
+        copied += len(data)
+    return copied
+
+
+def hash_range(f, offset, size):
+    """
+    Get the sha256 digest of `size` bytes from `offset` in file `f`.
+    """
+    hasher = hashlib.sha256()
+    f.seek(offset)
+    remaining = size
+    while remaining:
+        data = f.read(min(File.DEFAULT_CHUNK_SIZE, remaining))
+        if not data:
+            break
+        hasher.update(data)
+        remaining -= len(data)
+    return hasher.hexdigest()
+
+
+def get_owner(user):
+    """
+    Get the name of the directory of the stored chunks of `user`, or `None`
+    for anonymous users, who cannot use the chunk store.
+    """
+    if user is None or not user.is_authenticated:
+        return None
+    return hashlib.sha256(str(user.pk).encode()).hexdigest()[:32]
+
+
+class ChunkStore:
+    # hash type chunks are named by
+    checksum_type = 'sha256'
+
+    def __init__(self, location):
+        self.location = location
+
+    def path(self, owner, digest):
+        return os.path.join(self.location, owner, digest[:2], digest[2:4], digest)
+
+    def exists(self, owner, digest):
+        return os.path.exists(self.path(owner, digest))
+
+    def open(self, owner, digest):
+        """
+        Open a chunk stored by `owner` as a `File`, or return `None` if not
+        stored. Marks the chunk as used, so it is not pruned.
+        """
+        path = self.path(owner, digest)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return File(f, name=digest)
+
+    def add(self, owner, path, start, size, digest=None):
+        """
+        Store the `size` bytes at `start` of the file at `path` as a chunk
+        of `owner`, unless already stored. `digest` is their sha256 digest,
+        if already verified; otherwise it is computed from the file.
+        Returns the digest.
+        """
+        with open(path, 'rb') as src:
+            if digest is None:
+                digest = hash_range(src, start, size)
+            target = self.path(owner, digest)
+            if os.path.exists(target):
+                os.utime(target)
+                return digest
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp = '{}.{}.tmp'.format(target, uuid.uuid4().hex)
+            try:
+                with open(temp, 'wb') as dst:
+                    copy_range(src, dst, start, size)
+                os.replace(temp, target)
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+        return digest
+
+    def prune(self, max_age):
+        """
+        Delete chunks not used for `max_age` seconds. Returns the number of
+        chunks deleted and the bytes reclaimed.
+        """
+        cutoff = time.time() - max_age
+        count = reclaimed = 0
+        for dirpath, _, filenames in os.walk(self.location):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime >= cutoff:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                count += 1
+                reclaimed += stat.st_size
+        return count, reclaimed
+
+
+def get_chunk_store():
+    """
+    Get the configured `ChunkStore`, or `None` if disabled.
+    """
+    if not _settings.CHUNK_STORE:
+        return None
+    return ChunkStore(_settings.CHUNK_STORE)
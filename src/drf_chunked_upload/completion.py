@@ -0,0 +1,68 @@
+"""
+Background completion of uploads.
+
+When a view completes uploads asynchronously, `finalize_upload` is submitted
+to the completion executor: any object with a `submit(fn, *args)` method,
+such as a `concurrent.futures` executor or an adapter for a task queue.
+Its arguments are plain strings, so they can be serialized by a task queue.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from drf_chunked_upload import settings as _settings
+
+
+class CompletionThreadPool(ThreadPoolExecutor):
+    """
+    Thread pool that closes the worker's database connections after each
+    task, as they are not request threads Django would clean up after.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(self._run, fn, *args, **kwargs)
+
+    @staticmethod
+    def _run(fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+
+# resolved executors, keyed by the setting value
+_executors = {}
+
+
+def get_completion_executor():
+    """
+    Get the executor configured in `DRF_CHUNKED_UPLOAD_COMPLETION_EXECUTOR`,
+    or a shared thread pool. Callables and dotted paths are resolved once.
+    """
+    setting = _settings.COMPLETION_EXECUTOR
+    executor = _executors.get(setting)
+    if executor is None:
+        if setting is None:
+            executor = CompletionThreadPool(thread_name_prefix='drf_chunked_upload')
+        else:
+            executor = setting
+            if isinstance(executor, str):
+                executor = import_string(executor)
+            if isinstance(executor, type) or not hasattr(executor, 'submit'):
+                executor = executor()
+        _executors[setting] = executor
+    return executor
+
+
+def finalize_upload(view_path, upload_id, checksum):
+    """
+    Verify and complete an upload marked as finalizing, using the view
+    class at `view_path` (which must be importable).
+    """
+    view = import_string(view_path)()
+    chunked_upload = view.model.objects.get(pk=upload_id)
+    if chunked_upload.status != chunked_upload.FINALIZING:
+        # completed or failed by another task
+        return
+    view.finalize(chunked_upload, checksum)
@@ -0,0 +1,137 @@
+"""
+Durability of upload files.
+
+`DRF_CHUNKED_UPLOAD_DURABILITY` sets when upload files are fsynced:
+
+- `'none'`: never. The OS writes data back on its own schedule, so after a
+  host crash the persisted offset of an upload can be ahead of its data.
+- `'completion'`: once, before an upload is marked complete.
+- `'interval'`: once `DURABILITY_INTERVAL_BYTES` have been written to an
+  upload file or `DURABILITY_INTERVAL` has passed since it was last synced,
+  and on completion. Requests writing to the same upload at the same time
+  share an fsync (group commit).
+
+In the `'interval'` mode, each upload also persists its `synced_offset`: the
+offset its file is known to be on disk up to, saved only after the sync that
+covers it. It is never ahead of the data on disk, unlike `offset`, which can
+be ahead by up to one interval, so clients resume from it after a crash and
+re-send the bytes after it, which are rewritten in place. An interval of 0
+bytes syncs every chunk.
+
+The bytes written since the last sync are counted by each worker process
+for the chunks it writes. An fsync flushes the whole file, whoever wrote
+it, but a worker only syncs once it has written an interval of bytes
+itself, so with chunks of an upload spread over N workers, `offset` can be
+ahead of the disk by up to N times `DURABILITY_INTERVAL_BYTES` (still
+bounded by `DURABILITY_INTERVAL` while chunks keep arriving).
+"""
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from drf_chunked_upload import settings as _settings
+
+
+NONE = 'none'
+COMPLETION = 'completion'
+INTERVAL = 'interval'
+
+
+def fsync(f):
+    """
+    Flush open file `f` and its written data to disk, if it is a local file.
+    """
+    f.flush()
+    try:
+        fd = f.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return
+    os.fsync(fd)
+
+
+def fsync_path(path):
+    """
+    Flush the file or directory at `path` to disk (e.g. after a rename).
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SyncState:
+    """
+    Bytes written to an upload file through this process, and how many of
+    them were written before its last sync. Bytes written by other
+    processes are not counted.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()  # held while syncing
+        self.written = 0
+        self.synced = 0
+        self.synced_at = time.monotonic()
+        # offset the file is written up to, as far as this process knows
+        self.offset = 0
+
+
+class SyncRegistry:
+    """
+    LRU-bounded mapping of upload id to `SyncState`. A forgotten state only
+    makes the next sync of its upload come early.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def written(self, key, f, size, offset):
+        """
+        Record `size` bytes written to open file `f` of upload `key`, after
+        which it is written up to `offset`, syncing it if an interval has
+        been reached. Returns the offset the file is synced up to if this
+        call synced it, to be persisted as the upload's `synced_offset`;
+        otherwise `None`.
+        """
+        if _settings.DURABILITY != INTERVAL:
+            return None
+        # make the bytes visible to a sync through another handle
+        f.flush()
+        interval = _settings.DURABILITY_INTERVAL.total_seconds()
+        with self._lock:
+            state = self._states.pop(key, None) or SyncState()
+            self._states[key] = state
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+            state.written += size
+            state.offset = max(state.offset, offset)
+            target = state.written
+            due = (state.written - state.synced >= _settings.DURABILITY_INTERVAL_BYTES
+                   or time.monotonic() - state.synced_at >= interval)
+        if not due:
+            return None
+        with state.lock:
+            if state.synced >= target:
+                # a concurrent request synced after these bytes were written
+                return None
+            with self._lock:
+                written, offset = state.written, state.offset
+            fsync(f)
+            state.synced = written
+            state.synced_at = time.monotonic()
+        return offset
+
+    def discard(self, key):
+        with self._lock:
+            self._states.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+
+sync_states = SyncRegistry()
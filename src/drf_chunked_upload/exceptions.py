@@ -1,6 +1,7 @@
 """
 Exceptions raised by django-chunked-upload.
 """
+from rest_framework import status
 
 
 class ChunkedUploadError(Exception):
@@ -8,6 +9,104 @@ class ChunkedUploadError(Exception):
     Exception raised if errors in the request/process.
     """
 
-    def __init__(self, status, **data):
+    # extra headers of the error response
+    headers = None
+    # fixed identifier of the kind of error, to label metrics by; `detail`
+    # can hold any text
+    default_code = 'error'
+
+    def __init__(self, status, code=None, **data):
         self.status_code = status
+        self.code = code or self.default_code
         self.data = data
+
+
+class OffsetConflictError(ChunkedUploadError):
+    """
+    Exception raised if another request advanced the upload offset while
+    a chunk was being written.
+    """
+
+    default_code = 'offset_conflict'
+
+    def __init__(self, expected_offset, provided_offset):
+        super().__init__(
+            status=status.HTTP_400_BAD_REQUEST,
+            detail='Offsets do not match',
+            expected_offset=expected_offset,
+            provided_offset=provided_offset,
+        )
+
+
+class ChunkChecksumError(ChunkedUploadError):
+    """
+    Exception raised if a chunk does not match the checksum sent with it.
+    """
+
+    default_code = 'chunk_checksum_mismatch'
+
+    def __init__(self):
+        super().__init__(
+            status=status.HTTP_400_BAD_REQUEST,
+            detail='Chunk checksum does not match',
+        )
+
+
+class ChunkOverlapError(ChunkedUploadError):
+    """
+    Exception raised if a chunk sent out of order overlaps bytes already
+    received, other than as an identical re-send of them.
+    """
+
+    default_code = 'chunk_overlap'
+
+    def __init__(self):
+        super().__init__(
+            status=status.HTTP_400_BAD_REQUEST,
+            detail='Chunk does not match the bytes already received',
+        )
+
+
+class ChunkDecodingError(ChunkedUploadError):
+    """
+    Exception raised if a chunk sent with a Content-Encoding cannot be
+    decompressed to its reported size.
+    """
+
+    default_code = 'chunk_decoding'
+
+    def __init__(self, detail='Chunk could not be decompressed'):
+        super().__init__(
+            status=status.HTTP_400_BAD_REQUEST,
+            detail=detail,
+        )
+
+
+class AdmissionError(ChunkedUploadError):
+    """
+    Exception raised if a chunk is not admitted under the configured
+    concurrency and bandwidth limits.
+    """
+
+    default_code = 'not_admitted'
+
+    def __init__(self, retry_after, detail):
+        super().__init__(
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+        )
+        self.headers = {'Retry-After': str(retry_after)}
+
+
+class TapError(ChunkedUploadError):
+    """
+    Exception raised by a tap to reject an upload, e.g. of an invalid file.
+    """
+
+    default_code = 'rejected'
+
+    def __init__(self, detail='Upload was rejected'):
+        super().__init__(
+            status=status.HTTP_400_BAD_REQUEST,
+            detail=detail,
+        )
@@ -0,0 +1,103 @@
+"""
+Per-process pool of open file handles for in-progress uploads.
+
+Writing a chunk normally opens and closes the upload file. When
+`DRF_CHUNKED_UPLOAD_FILE_HANDLE_POOL_SIZE` is set, handles are kept open
+between chunks, keyed by upload id. The least recently used handles are
+closed once the pool is full, and handles idle for longer than
+`DRF_CHUNKED_UPLOAD_FILE_HANDLE_IDLE_TIMEOUT` are closed when the pool is
+next used. Only storages with local paths can be pooled.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from drf_chunked_upload import settings as _settings
+
+
+class FileHandlePool:
+
+    def __init__(self, max_handles=None, idle_timeout=None):
+        self.max_handles = max_handles
+        self.idle_timeout = idle_timeout
+        # key -> (path, file, last used)
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        if self.max_handles is not None:
+            return self.max_handles
+        return _settings.FILE_HANDLE_POOL_SIZE
+
+    @property
+    def enabled(self):
+        return bool(self.size)
+
+    def acquire(self, key, path):
+        """
+        Take the open handle for `key` out of the pool, or open a new one.
+        The caller has exclusive use of it until it is released.
+        """
+        with self._lock:
+            entry = self._handles.pop(key, None)
+            stale = self._evict_idle()
+        for _, f, _ in stale:
+            f.close()
+        if entry is not None:
+            entry_path, f, _ = entry
+            if entry_path == path:
+                return f
+            f.close()
+        try:
+            return open(path, 'r+b')
+        except FileNotFoundError:
+            return open(path, 'w+b')
+
+    def release(self, key, path, f):
+        """
+        Flush a handle and return it to the pool.
+        """
+        f.flush()
+        with self._lock:
+            existing = self._handles.pop(key, None)
+            self._handles[key] = (path, f, time.monotonic())
+            evicted = []
+            while len(self._handles) > self.size:
+                evicted.append(self._handles.popitem(last=False)[1])
+        if existing is not None:
+            evicted.append(existing)
+        for _, handle, _ in evicted:
+            handle.close()
+
+    def close(self, key):
+        with self._lock:
+            entry = self._handles.pop(key, None)
+        if entry is not None:
+            entry[1].close()
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._handles.values())
+            self._handles.clear()
+        for _, f, _ in entries:
+            f.close()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def _evict_idle(self):
+        idle_timeout = self.idle_timeout
+        if idle_timeout is None:
+            idle_timeout = _settings.FILE_HANDLE_IDLE_TIMEOUT.total_seconds()
+        cutoff = time.monotonic() - idle_timeout
+        stale = []
+        while self._handles:
+            key, entry = next(iter(self._handles.items()))
+            if entry[2] > cutoff:
+                break
+            stale.append(self._handles.pop(key))
+        return stale
+
+
+file_handles = FileHandlePool()
@@ -0,0 +1,52 @@
+import django.apps
+from django.core.management.base import BaseCommand
+
+from drf_chunked_upload.models import AbstractChunkedUpload
+
+
+class ChunkedUploadCommand(BaseCommand):
+    """
+    Base for commands that operate on AbstractChunkedUpload subclasses.
+    """
+
+    # Has to be an AbstractChunkedUpload subclass
+    base_model = AbstractChunkedUpload
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models',
+            metavar='app.model',
+            nargs='*',
+            help='Any app.model classes you want to process. '
+                 'Default is all AbstractChunkedUpload subclasses within a project.',
+        )
+
+    def _get_filter_model(self, model):
+        model_app, model_name = model.split('.')
+        try:
+            model_cls = django.apps.apps.get_app_config(model_app).get_model(model_name)
+        except LookupError as e:
+            print("WARNING: {}", e)
+        else:
+            if issubclass(model_cls, self.base_model):
+                return model_cls
+            print("WARNING: Model {} is not a subclass of AbstractChunkedUpload and will be skipped.".format(model))
+            return None
+
+    def get_models(self, filter_models=None):
+        upload_models = []
+
+        if filter_models:
+            # the models were specified and
+            # we want to process only them
+            for model in filter_models:
+                model = self._get_filter_model(model)
+                if model:
+                    upload_models.append(model)
+        else:
+            # no models were specified and we want
+            # to find all AbstractChunkedUpload classes
+            upload_models = \
+                [m for m in django.apps.apps.get_models() if issubclass(m, self.base_model)]
+
+        return upload_models
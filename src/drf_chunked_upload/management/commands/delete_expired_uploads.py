@@ -1,12 +1,23 @@
+import os
+import time
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-import django.apps
-from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.translation import gettext as _
 
+from drf_chunked_upload import metrics
 from drf_chunked_upload import settings as _settings
+from drf_chunked_upload.checksums import hash_states
+from drf_chunked_upload.chunkstore import get_chunk_store
+from drf_chunked_upload.durability import sync_states
+from drf_chunked_upload.handles import file_handles
+from drf_chunked_upload.management.base import ChunkedUploadCommand
 from drf_chunked_upload.models import AbstractChunkedUpload
+from drf_chunked_upload.state import get_state_cache
+from drf_chunked_upload.taps import tap_states
 
 
 PROMPT_MSG = _(u'Do you want to delete {obj}?')
@@ -19,21 +30,12 @@ VALID_RESP = {
 }
 
 
-class Command(BaseCommand):
+class Command(ChunkedUploadCommand):
 
-    # Has to be an AbstractChunkedUpload subclass
-    base_model = AbstractChunkedUpload
-
-    help = 'Deletes incomplete chunked uploads that have expired.'
+    help = 'Deletes incomplete (or stale finalizing) chunked uploads that have expired.'
 
     def add_arguments(self, parser):
-        parser.add_argument(
-            'models',
-            metavar='app.model',
-            nargs='*',
-            help='Any app.model classes you want to clean up. '
-                 'Default is all AbstractChunkedUpload subclasses within a project.',
-        )
+        super().add_arguments(parser)
         parser.add_argument(
             '-i',
             '--interactive',
@@ -50,83 +52,219 @@ class Command(BaseCommand):
             default=True,
             help="Don't delete upload records, just uploaded files on disk.",
         )
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=1000,
+            help='Number of uploads to delete per batch. Default is 1000.',
+        )
+        parser.add_argument(
+            '-w',
+            '--workers',
+            type=int,
+            dest='workers',
+            default=4,
+            help='Number of threads used to delete files. Default is 4.',
+        )
+        parser.add_argument(
+            '-t',
+            '--max-runtime',
+            type=float,
+            dest='max_runtime',
+            default=None,
+            help='Stop starting new batches after this many seconds.',
+        )
 
     def handle(self, *args, **options):
         filter_models = options.get('models', None)
         interactive = options.get('interactive')
         delete_record = options.get('delete_record')
+        batch_size = options.get('batch_size')
+        workers = options.get('workers')
+        max_runtime = options.get('max_runtime')
+
+        deadline = None
+        if max_runtime is not None:
+            deadline = time.monotonic() + max_runtime
 
         upload_models = self.get_models(filter_models=filter_models)
 
         for model in upload_models:
-            self.process_model(model, interactive=interactive, delete_record=delete_record)
+            self.process_model(
+                model,
+                interactive=interactive,
+                delete_record=delete_record,
+                batch_size=batch_size,
+                workers=workers,
+                deadline=deadline,
+            )
 
-    def _get_filter_model(self, model):
-        model_app, model_name = model.split('.')
-        try:
-            model_cls = django.apps.apps.get_app_config(model_app).get_model(model_name)
-        except LookupError as e:
-            print("WARNING: {}", e)
-        else:
-            if issubclass(model_cls, self.base_model):
-                return model_cls
-            print("WARNING: Model {} is not a subclass of AbstractChunkedUpload and will be skipped.".format(model))
-            return None
-
-    def get_models(self, filter_models=None):
-        upload_models = []
-
-        if filter_models:
-            # the models were specified and
-            # we want to process only them
-            for model in filter_models:
-                model = self._get_filter_model(model)
-                if model:
-                    upload_models.append(model)
-        else:
-            # no models were specified and we want
-            # to find all AbstractChunkedUpload classes
-            upload_models = \
-                [m for m in django.apps.apps.get_models() if issubclass(m, self.base_model)]
+        chunk_store = get_chunk_store()
+        if chunk_store is not None and not interactive:
+            self.prune_chunk_store(chunk_store)
+
+    def prune_chunk_store(self, chunk_store):
+        print('Pruning chunk store {}...'.format(chunk_store.location))
+        count, reclaimed = chunk_store.prune(
+            _settings.CHUNK_STORE_EXPIRATION_DELTA.total_seconds(),
+        )
+        metrics.bytes_reclaimed.inc(reclaimed)
+        print('{} stored chunks were deleted ({} bytes).'.format(count, reclaimed))
+
+    def get_expired_uploads(self, model, delete_record=True):
+        chunked_uploads = model.objects.filter(
+            Q(status=AbstractChunkedUpload.UPLOADING) | model.stale_finalizing_filter(),
+            created_at__lt=(timezone.now() - _settings.EXPIRATION_DELTA),
+        )
+
+        if delete_record == False:
+            chunked_uploads = chunked_uploads.exclude(file__isnull=True)
 
-        return upload_models
+        return chunked_uploads
 
-    def process_model(self, model, interactive=False, delete_record=True):
+    def process_model(self, model, interactive=False, delete_record=True,
+                      batch_size=1000, workers=4, deadline=None):
         print('Processing uploads for model {}.{}...'.format(
             model._meta.app_label,
             model.__name__,
         ))
 
-        count = Counter({state[0]: 0 for state in model.STATUS_CHOICES})
+        started = time.monotonic()
+        if interactive:
+            count, reclaimed = self.process_interactive(model, delete_record)
+        else:
+            count, reclaimed = self.process_batches(
+                model,
+                delete_record=delete_record,
+                batch_size=batch_size,
+                workers=workers,
+                deadline=deadline,
+            )
+        elapsed = time.monotonic() - started
+        metrics.bytes_reclaimed.inc(reclaimed)
 
-        chunked_uploads = model.objects.filter(
-            created_at__lt=(timezone.now() - _settings.EXPIRATION_DELTA),
-            status=AbstractChunkedUpload.UPLOADING,
-        )
+        for state, number in count.items():
+            print(
+                '{} {} upload{}s were deleted.'.format(
+                    number,
+                    dict(model.STATUS_CHOICES)[state].lower(),
+                    (' file' if not delete_record else ''),
+                )
+            )
+        print('{} bytes reclaimed in {:.2f}s ({:.0f} bytes/s).'.format(
+            reclaimed,
+            elapsed,
+            reclaimed / elapsed if elapsed else 0,
+        ))
 
-        if delete_record == False:
-            chunked_uploads = chunked_uploads.exclude(file__isnull=True)
+    def process_interactive(self, model, delete_record=True):
+        count = Counter({state[0]: 0 for state in model.STATUS_CHOICES})
+        reclaimed = 0
 
-        for chunked_upload in chunked_uploads:
-            if interactive and not self.get_confirmation(chunked_upload):
+        for chunked_upload in self.get_expired_uploads(model, delete_record).iterator():
+            if not self.get_confirmation(chunked_upload):
                 continue
 
             count[chunked_upload.status] += 1
+            reclaimed += self.get_file_size(chunked_upload.file.storage, chunked_upload.file.name)
             # Deleting objects individually to call delete method explicitly
             if delete_record:
                 chunked_upload.delete()
             else:
                 chunked_upload.delete_file()
                 chunked_upload.save()
+                self.clear_state(model, [chunked_upload.pk])
 
-        for state, number in count.items():
-            print(
-                '{} {} upload{}s were deleted.'.format(
-                    number,
-                    dict(model.STATUS_CHOICES)[state].lower(),
-                    (' file' if not delete_record else ''),
-                )
-            )
+        return count, reclaimed
+
+    def process_batches(self, model, delete_record=True, batch_size=1000,
+                        workers=4, deadline=None):
+        """
+        Delete expired uploads in batches, keyset-paginated on
+        `(created_at, pk)` to follow the expiry index: the records of each
+        batch are removed (or have their file cleared) with a single query,
+        then the files are deleted from a pool of threads.
+        """
+        count = Counter({state[0]: 0 for state in model.STATUS_CHOICES})
+        reclaimed = 0
+        storage = model._meta.get_field('file').storage
+        chunked_uploads = self.get_expired_uploads(model, delete_record).order_by('created_at', 'pk')
+        last = None
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            while deadline is None or time.monotonic() < deadline:
+                batch = chunked_uploads
+                if last is not None:
+                    batch = batch.filter(
+                        Q(created_at__gt=last[0]) | Q(created_at=last[0], pk__gt=last[1])
+                    )
+                batch = list(batch.values_list('pk', 'file', 'created_at', 'status')[:batch_size])
+                if not batch:
+                    break
+                last = batch[-1][2], batch[-1][0]
+
+                with transaction.atomic():
+                    # an upload may have been resumed or completed since it
+                    # was listed, so only those still expired are deleted
+                    batch = list(
+                        self.get_expired_uploads(model, delete_record)
+                        .filter(pk__in=[pk for pk, _, _, _ in batch])
+                        .select_for_update()
+                        .values_list('pk', 'file', 'created_at', 'status')
+                    )
+                    pks = [pk for pk, _, _, _ in batch]
+                    if delete_record:
+                        model.objects.filter(pk__in=pks).delete()
+                    else:
+                        model.objects.filter(pk__in=pks).update(file=None)
+                self.clear_state(model, pks)
+
+                names = [name for _, name, _, _ in batch if name]
+                reclaimed += sum(executor.map(
+                    lambda name: self.delete_file(storage, name),
+                    names,
+                ))
+                count.update(status for _, _, _, status in batch)
+
+        return count, reclaimed
+
+    def clear_state(self, model, pks):
+        """
+        Discard the state kept in memory and in the state cache for uploads
+        whose records were deleted or had their file cleared in bulk.
+        """
+        for pk in pks:
+            hash_states.discard(pk)
+            tap_states.discard(pk)
+            sync_states.discard(pk)
+            file_handles.close(pk)
+        state_cache = get_state_cache()
+        if state_cache is not None:
+            state_cache.delete_many(model, pks)
+
+    def get_file_size(self, storage, name):
+        if not name:
+            return 0
+        try:
+            return storage.size(name)
+        except OSError:
+            return 0
+
+    def delete_file(self, storage, name):
+        """
+        Delete a file from storage, returning the number of bytes reclaimed.
+        """
+        size = self.get_file_size(storage, name)
+        storage.delete(name)
+        try:
+            checksums_path = storage.path(name) + AbstractChunkedUpload.chunk_checksums_ext
+        except NotImplementedError:
+            checksums_path = None
+        if checksums_path is not None and os.path.exists(checksums_path):
+            os.remove(checksums_path)
+        return size
 
     def get_confirmation(self, chunked_upload):
         prompt = PROMPT_MSG.format(obj=chunked_upload) + ' (y/n): '
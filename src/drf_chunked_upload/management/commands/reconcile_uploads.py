@@ -0,0 +1,275 @@
+import os
+import posixpath
+import time
+import uuid
+import zlib
+from collections import Counter
+
+from drf_chunked_upload import settings as _settings
+from drf_chunked_upload.management.base import ChunkedUploadCommand
+from drf_chunked_upload.models import AbstractChunkedUpload
+from drf_chunked_upload.paths import get_path_strategy
+
+
+SUMMARY = (
+    ('orphaned', 'Orphaned files'),
+    ('misnamed', 'Misnamed files'),
+    ('offset', 'Offset mismatches'),
+    ('missing', 'Records missing their file'),
+    ('unrecognized', 'Unrecognized files'),
+)
+
+
+class Command(ChunkedUploadCommand):
+
+    help = ('Finds upload files without a matching record, records without a '
+            'file, and incomplete uploads whose offset does not match the '
+            'size of their file.')
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '-d',
+            '--delete',
+            action='store_true',
+            dest='delete',
+            default=False,
+            help='Delete orphaned files.',
+        )
+        parser.add_argument(
+            '-f',
+            '--fix',
+            action='store_true',
+            dest='fix',
+            default=False,
+            help='Set the offset of incomplete uploads to the size of their '
+                 'file, and rename files whose extension does not match their record.',
+        )
+        parser.add_argument(
+            '-r',
+            '--check-records',
+            action='store_true',
+            dest='check_records',
+            default=False,
+            help='Also report records whose file is missing.',
+        )
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=1000,
+            help='Number of files to look up per query. Default is 1000.',
+        )
+        parser.add_argument(
+            '-a',
+            '--min-age',
+            type=float,
+            dest='min_age',
+            default=3600,
+            help='Ignore files modified less than this many seconds ago, as '
+                 'their record may not be committed yet. Default is 3600.',
+        )
+        parser.add_argument(
+            '-s',
+            '--shard',
+            dest='shard',
+            default=None,
+            help='Only walk the date (or hash) directories in shard INDEX/COUNT, '
+                 'e.g. 0/4, to split the walk across processes.',
+        )
+
+    def handle(self, *args, **options):
+        filter_models = options.get('models', None)
+        self.delete = options.get('delete')
+        self.fix = options.get('fix')
+        self.batch_size = options.get('batch_size')
+        self.min_age = options.get('min_age')
+        self.shard = self.parse_shard(options.get('shard'))
+        self.count = Counter()
+
+        upload_models = self.get_models(filter_models=filter_models)
+
+        # files are matched against every model storing uploads in a
+        # location, so those of a model left out are not orphaned
+        for location, models in self.get_locations(self.get_models()).items():
+            if not any(model in upload_models for model in models):
+                continue
+            print('Scanning {}...'.format(location))
+            self.scan(location, models, upload_models)
+
+        if options.get('check_records'):
+            for model in upload_models:
+                self.check_records(model)
+
+        for problem, label in SUMMARY:
+            print('{}: {}'.format(label, self.count[problem]))
+
+    def parse_shard(self, shard):
+        if shard is None:
+            return None
+        index, count = (int(part) for part in shard.split('/'))
+        if not 0 <= index < count:
+            raise ValueError('Shard index must be between 0 and COUNT - 1')
+        return index, count
+
+    def get_upload_root(self):
+        """
+        Split UPLOAD_PATH into the fixed directory files are stored under
+        and the number of directory levels below it: date directories
+        (e.g. %Y/%m/%d) and those added by the path strategy.
+        """
+        parts = [part for part in _settings.UPLOAD_PATH.split('/') if part]
+        root = []
+        for part in parts:
+            if '%' in part:
+                break
+            root.append(part)
+        return '/'.join(root), len(parts) - len(root) + get_path_strategy().depth
+
+    def get_locations(self, upload_models):
+        root, _ = self.get_upload_root()
+        locations = {}
+        for model in upload_models:
+            storage = model._meta.get_field('file').storage
+            try:
+                location = storage.path(root)
+            except NotImplementedError:
+                print('WARNING: Storage for {} has no local path and will be skipped.'.format(
+                    model._meta.label,
+                ))
+                continue
+            locations.setdefault(location, []).append(model)
+        return locations
+
+    def in_shard(self, rel_path):
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        return zlib.crc32(rel_path.encode()) % count == index
+
+    def walk(self, location):
+        """
+        Yield `(entry, rel_path)` for files below `location`, streaming
+        directory entries so memory stays bounded by the tree depth.
+        """
+        # files from before a change of path strategy may be at any depth
+        _, shard_depth = self.get_upload_root()
+        stack = [(location, '', 0)]
+        while stack:
+            path, rel_dir, depth = stack.pop()
+            try:
+                entries = os.scandir(path)
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    rel_path = posixpath.join(rel_dir, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        if depth + 1 == shard_depth and not self.in_shard(rel_path):
+                            continue
+                        stack.append((entry.path, rel_path, depth + 1))
+                    elif entry.is_file(follow_symlinks=False):
+                        if depth < shard_depth or shard_depth == 0:
+                            if not self.in_shard(rel_path):
+                                continue
+                        yield entry, rel_path
+
+    def scan(self, location, models, upload_models):
+        root, _ = self.get_upload_root()
+        min_mtime = time.time() - self.min_age
+        extensions = (_settings.INCOMPLETE_EXT, _settings.COMPLETE_EXT)
+        batch = []
+
+        for entry, rel_path in self.walk(location):
+            stem, ext = os.path.splitext(entry.name)
+            try:
+                upload_id = uuid.UUID(stem)
+            except ValueError:
+                upload_id = None
+            if upload_id is None or ext not in extensions:
+                self.count['unrecognized'] += 1
+                continue
+
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > min_mtime:
+                continue
+
+            name = posixpath.join(root, rel_path) if root else rel_path
+            batch.append((upload_id, name, entry.path, stat.st_size))
+            if len(batch) >= self.batch_size:
+                self.process_batch(batch, models, upload_models)
+                batch = []
+
+        if batch:
+            self.process_batch(batch, models, upload_models)
+
+    def process_batch(self, batch, models, upload_models):
+        ids = [upload_id for upload_id, _, _, _ in batch]
+        records = {}
+        for model in models:
+            values = model.objects.filter(pk__in=ids).values_list(
+                'pk', 'file', 'offset', 'status', 'received_ranges',
+            )
+            for pk, *record in values:
+                records[pk] = (model, *record)
+
+        for upload_id, name, path, size in batch:
+            record = records.get(upload_id)
+            if record is None:
+                self.orphaned(path, size)
+                continue
+
+            model, file_name, offset, status, received_ranges = record
+            if model not in upload_models:
+                continue
+            if file_name != name:
+                if (file_name and os.path.splitext(file_name)[0] == os.path.splitext(name)[0]
+                        and not os.path.exists(os.path.splitext(path)[0] + os.path.splitext(file_name)[1])):
+                    self.misnamed(path, file_name)
+                else:
+                    self.orphaned(path, size)
+                continue
+
+            # uploads accepting chunks out of order may legitimately have
+            # a file larger than their contiguous offset
+            if status == AbstractChunkedUpload.UPLOADING and not received_ranges and offset != size:
+                self.offset_mismatch(model, upload_id, path, offset, size)
+
+    def orphaned(self, path, size):
+        self.count['orphaned'] += 1
+        print('ORPHANED {} ({} bytes){}'.format(path, size, ' deleted' if self.delete else ''))
+        if self.delete:
+            os.remove(path)
+
+    def misnamed(self, path, file_name):
+        self.count['misnamed'] += 1
+        target = os.path.splitext(path)[0] + os.path.splitext(file_name)[1]
+        print('MISNAMED {} should be {}{}'.format(path, target, ' renamed' if self.fix else ''))
+        if self.fix:
+            os.rename(path, target)
+
+    def offset_mismatch(self, model, upload_id, path, offset, size):
+        self.count['offset'] += 1
+        print('OFFSET {} is {} bytes but record offset is {}{}'.format(
+            path, size, offset, ' fixed' if self.fix else '',
+        ))
+        if self.fix:
+            model.objects.filter(pk=upload_id, offset=offset).update(offset=size)
+
+    def check_records(self, model):
+        storage = model._meta.get_field('file').storage
+        uploads = model.objects.exclude(file__isnull=True).exclude(file='').order_by('pk')
+        last_pk = None
+        while True:
+            batch = uploads
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch.values_list('pk', 'file')[:self.batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            for pk, name in batch:
+                if not storage.exists(name):
+                    self.count['missing'] += 1
+                    print('MISSING {} {} has no file {}'.format(model._meta.label, pk, name))
@@ -0,0 +1,235 @@
+"""
+In-process metrics for chunked uploads.
+
+The views, models and management commands report into the counters and
+histograms of `registry`, which can be exported in the Prometheus text
+exposition format (e.g. through `ChunkedUploadMetricsView`). Metrics are
+kept per process: rates and percentiles are computed by the scraper, and a
+multi-process server needs each process scraped (or its own aggregation).
+Reporting can be turned off with `DRF_CHUNKED_UPLOAD_METRICS`.
+"""
+import math
+import threading
+
+from rest_framework.renderers import BaseRenderer
+
+from drf_chunked_upload import settings as _settings
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'),
+        )
+        for name, value in pairs
+    ) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """
+        Yield `(suffix, label names, label values, extra labels, value)`.
+        """
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield '', self.labelnames, key, (), value
+
+    def expose(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        for suffix, labelnames, labelvalues, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(
+                self.name,
+                suffix,
+                _format_labels(labelnames, labelvalues, extra),
+                _format_value(value),
+            ))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not _settings.METRICS:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        if not _settings.METRICS:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        if not _settings.METRICS:
+            return
+        key = self._key(labels)
+        # index of the first bucket the value falls in; counts are
+        # made cumulative on export
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def get(self, **labels):
+        """
+        Get `(count, sum)` of the observed values.
+        """
+        entry = self._values.get(self._key(labels))
+        if entry is None:
+            return 0, 0
+        return entry[2], entry[1]
+
+    def samples(self):
+        with self._lock:
+            values = [
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._values.items()
+            ]
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', self.labelnames, key, (('le', _format_value(bound)),), cumulative
+            yield '_sum', self.labelnames, key, (), total
+            yield '_count', self.labelnames, key, (), count
+
+
+class MetricsRegistry:
+
+    def __init__(self, prefix='drf_chunked_upload_'):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, **kwargs):
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, **kwargs)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames=labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames=labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation,
+                              labelnames=labelnames, buckets=buckets)
+
+    def clear(self):
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+    def expose(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        return ''.join(
+            metric.expose() + '\n'
+            for metric in list(self._metrics.values())
+        )
+
+
+class MetricsRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+registry = MetricsRegistry()
+
+bytes_received = registry.counter(
+    'bytes_received_total',
+    'Bytes of chunks written to uploads.',
+)
+chunks_received = registry.counter(
+    'chunks_received_total',
+    'Chunks written to uploads.',
+)
+chunk_seconds = registry.histogram(
+    'chunk_request_seconds',
+    'Time taken to handle chunk PUT requests.',
+)
+checksum_seconds = registry.histogram(
+    'checksum_seconds',
+    'Time taken to compute the checksum of uploads.',
+)
+uploads_completed = registry.counter(
+    'uploads_completed_total',
+    'Uploads marked as complete.',
+)
+completion_failures = registry.counter(
+    'completion_failures_total',
+    'Upload completion requests that failed, by reason.',
+    labelnames=('reason',),
+)
+bytes_reclaimed = registry.counter(
+    'bytes_reclaimed_total',
+    'Bytes of expired upload files deleted by delete_expired_uploads.',
+)
+active_uploads = registry.gauge(
+    'active_uploads',
+    'Incomplete uploads, as of the last metrics export.',
+)
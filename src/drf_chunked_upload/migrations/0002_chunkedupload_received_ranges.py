@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='received_ranges',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
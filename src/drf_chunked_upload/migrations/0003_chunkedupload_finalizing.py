@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0002_chunkedupload_received_ranges'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='completion_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='chunkedupload',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Incomplete'), (2, 'Complete'), (3, 'Finalizing')], default=1),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0003_chunkedupload_finalizing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='chunk_checksums',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0004_chunkedupload_chunk_checksums'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chunkedupload',
+            index=models.Index(fields=['user', 'created_at'], name='chunkedupload_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='chunkedupload',
+            index=models.Index(condition=models.Q(('status', 1)), fields=['created_at', 'id'], name='chunkedupload_expiry'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0005_chunkedupload_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='digest',
+            field=models.CharField(blank=True, default='', max_length=160),
+        ),
+        migrations.AddIndex(
+            model_name='chunkedupload',
+            index=models.Index(condition=models.Q(('status', 2)), fields=['digest', 'offset'], name='chunkedupload_digest'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0006_chunkedupload_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='finalizing_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0007_chunkedupload_finalizing_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='synced_offset',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0008_chunkedupload_synced_offset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='hash_state',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
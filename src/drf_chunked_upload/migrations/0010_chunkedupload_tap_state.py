@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0009_chunkedupload_hash_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='tap_state',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
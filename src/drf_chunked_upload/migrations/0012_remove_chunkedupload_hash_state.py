@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:54
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drf_chunked_upload', '0011_chunkedupload_claim'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chunkedupload',
+            name='hash_state',
+        ),
+    ]
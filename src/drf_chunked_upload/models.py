@@ -1,14 +1,47 @@
 import time
 import os.path
-import hashlib
 import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from tempfile import SpooledTemporaryFile
 
 from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat
 from django.conf import settings
+from django.core.files.base import File
 from django.core.files.uploadedfile import UploadedFile
 from django.utils import timezone
 
+from drf_chunked_upload import durability
+from drf_chunked_upload import metrics
 from drf_chunked_upload import settings as _settings
+from drf_chunked_upload.chunkstore import ChunkStore, copy_range
+from drf_chunked_upload.checksums import (
+    DigestingChunk,
+    HashState,
+    hash_states,
+    parse_chunk_checksums,
+)
+from drf_chunked_upload.durability import fsync_path, sync_states
+from drf_chunked_upload.exceptions import (
+    ChunkChecksumError,
+    ChunkOverlapError,
+    OffsetConflictError,
+)
+from drf_chunked_upload.handles import file_handles
+from drf_chunked_upload.paths import get_path_strategy
+from drf_chunked_upload.preallocation import preallocate
+from drf_chunked_upload.ranges import (
+    contiguous_end,
+    format_ranges,
+    merge_ranges,
+    missing_ranges,
+    parse_ranges,
+)
+from drf_chunked_upload.state import get_state_cache
+from drf_chunked_upload.taps import TapState, get_taps, tap_states
+from drf_chunked_upload.timing import phase
 
 
 AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
@@ -16,17 +49,19 @@ AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
 def generate_filename(instance, filename):
     upload_dir = getattr(instance, 'upload_dir', _settings.UPLOAD_PATH)
-    filename = os.path.join(upload_dir, str(instance.id) + _settings.INCOMPLETE_EXT)
-    return time.strftime(filename)
+    directory = get_path_strategy().get_directory(instance, upload_dir)
+    return os.path.join(directory, str(instance.id) + _settings.INCOMPLETE_EXT)
 
 
 class AbstractChunkedUpload(models.Model):
     '''Inherit from this model if you are implementing your own.'''
     UPLOADING = 1
     COMPLETE = 2
+    FINALIZING = 3
     STATUS_CHOICES = (
         (UPLOADING, 'Incomplete'),
         (COMPLETE, 'Complete'),
+        (FINALIZING, 'Finalizing'),
     )
     id = models.UUIDField(
         primary_key=True,
@@ -41,6 +76,28 @@ class AbstractChunkedUpload(models.Model):
     )
     filename = models.CharField(max_length=255)
     offset = models.BigIntegerField(default=0)
+    # offset the file is known to be on disk up to, in the 'interval'
+    # durability mode (and on completion in the others)
+    synced_offset = models.BigIntegerField(default=0)
+    # token of the request writing the chunk at the offset, and when it
+    # claimed it, if the claim is not kept in the state cache
+    claim = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+    )
+    claimed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+    )
+    received_ranges = models.TextField(
+        blank=True,
+        default='',
+    )
+    chunk_checksums = models.TextField(
+        blank=True,
+        default='',
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         editable=False,
@@ -53,6 +110,33 @@ class AbstractChunkedUpload(models.Model):
         null=True,
         blank=True,
     )
+    completion_error = models.TextField(
+        blank=True,
+        default='',
+    )
+    # when the upload was last marked as finalizing
+    finalizing_at = models.DateTimeField(
+        null=True,
+        blank=True,
+    )
+    # state of the taps over an incomplete upload, as saved by TapState.dump
+    tap_state = models.TextField(
+        blank=True,
+        default='',
+    )
+    # checksum of a complete upload, as '<checksum type>:<hex digest>'
+    digest = models.CharField(
+        max_length=160,
+        blank=True,
+        default='',
+    )
+
+    # how long a claim outlives a request that died holding it
+    claim_timeout = timedelta(minutes=5)
+    # token of the claim this instance holds on the offset, if any
+    _claim = None
+    # appended to the upload file's path to name its chunk checksums file
+    chunk_checksums_ext = '.sums'
 
     @property
     def expires_at(self):
@@ -60,7 +144,30 @@ class AbstractChunkedUpload(models.Model):
 
     @property
     def expired(self):
-        return self.status == self.UPLOADING and self.expires_at <= timezone.now()
+        return ((self.status == self.UPLOADING or self.finalizing_stale)
+                and self.expires_at <= timezone.now())
+
+    @property
+    def finalizing_stale(self):
+        """
+        Whether the upload has been finalizing for longer than
+        `FINALIZING_TIMEOUT`, e.g. as its background completion was lost.
+        It can then be completed again, and expires like an incomplete one.
+        """
+        return self.status == self.FINALIZING and (
+            self.finalizing_at is None
+            or self.finalizing_at + _settings.FINALIZING_TIMEOUT <= timezone.now()
+        )
+
+    @classmethod
+    def stale_finalizing_filter(cls):
+        """
+        A `Q` object matching uploads for which `finalizing_stale` is true.
+        """
+        return Q(status=cls.FINALIZING) & (
+            Q(finalizing_at__isnull=True)
+            | Q(finalizing_at__lte=timezone.now() - _settings.FINALIZING_TIMEOUT)
+        )
 
     @property
     def md5(self, rehash=False):
@@ -70,23 +177,159 @@ class AbstractChunkedUpload(models.Model):
     @property
     def checksum(self, rehash=False):
         if getattr(self, '_checksum', None) is None or rehash is True:
-            h = hashlib.new(_settings.CHECKSUM_TYPE)
-            self.file.close()
-            self.file.open(mode='rb')
-            for chunk in self.file.chunks():
-                h.update(chunk)
-                self._checksum = h.hexdigest()
-            self.file.close()
+            if rehash is True:
+                hash_states.discard(self.id)
+            started = time.perf_counter()
+            with phase('checksum'):
+                state = self._get_hash_state()
+                if state is None:
+                    state = HashState(_settings.CHECKSUM_TYPE)
+                    self._update_hash_state(state)
+                self._checksum = state.hexdigest()
+            metrics.checksum_seconds.observe(time.perf_counter() - started)
         return self._checksum
 
+    def _get_hash_state(self):
+        """
+        Get the incremental hash state for this upload, hashing any bytes
+        up to `offset` that the state has not yet seen. Falls back to a
+        full rehash if the state is ahead of the record.
+        """
+        state = hash_states.get(self.id, _settings.CHECKSUM_TYPE)
+        if state is None:
+            return None
+        if state.offset > self.offset:
+            hash_states.discard(self.id)
+            state = hash_states.get(self.id, _settings.CHECKSUM_TYPE)
+        if state.offset < self.offset:
+            with state.lock:
+                self._update_hash_state(state)
+        return state
+
+    def rehash(self):
+        """
+        Compute the checksum from the whole file, e.g. if the incremental
+        hash state could not be trusted.
+        """
+        hash_states.discard(self.id)
+        with phase('checksum'):
+            state = HashState(_settings.CHECKSUM_TYPE)
+            self._update_hash_state(state)
+            self._checksum = state.hexdigest()
+        return self._checksum
+
+    def _update_hash_state(self, state):
+        # also used to catch up tap states, which may raise TapError
+        if not self.file:
+            return
+        self.file.close()
+        self.file.open(mode='rb')
+        try:
+            self.file.seek(state.offset)
+            while state.offset < self.offset:
+                data = self.file.read(
+                    min(File.DEFAULT_CHUNK_SIZE, self.offset - state.offset)
+                )
+                if not data:
+                    break
+                state.update(data)
+        finally:
+            self.file.close()
+
+    def get_taps(self):
+        """
+        Get the taps that see the data of this upload as it is written.
+        """
+        return get_taps()
+
+    def _get_tap_state(self):
+        """
+        Get the state of the taps for this upload, feeding them any bytes up
+        to `offset` they have not yet seen. Returns `None` if there are no
+        taps or the state registry is disabled.
+        """
+        taps = self.get_taps()
+        if not taps:
+            return None
+        state = tap_states.get(self.id, taps)
+        if state is None:
+            return None
+        if state.offset > self.offset:
+            tap_states.discard(self.id)
+            state = tap_states.get(self.id, taps)
+        if state.offset < self.offset:
+            saved = TapState.load(self.get_saved_tap_state(), taps)
+            if saved is not None and state.offset < saved.offset <= self.offset:
+                state = saved
+                tap_states.put(self.id, state)
+        if state.offset < self.offset:
+            with state.lock:
+                try:
+                    self._update_hash_state(state)
+                except Exception:
+                    tap_states.discard(self.id)
+                    raise
+        return state
+
+    def get_saved_tap_state(self):
+        """
+        Get the tap state saved with the upload, from the state cache if
+        enabled, otherwise from the record.
+        """
+        state_cache = get_state_cache()
+        if state_cache is not None:
+            return state_cache.get_tap_state(self) or self.tap_state
+        return self.tap_state
+
+    def feed_taps(self):
+        """
+        Feed the taps any bytes received that they have not yet seen, e.g.
+        those of the first chunk. Raises `TapError` if a tap rejects the
+        upload.
+        """
+        with phase('taps'):
+            self._get_tap_state()
+
+    @property
+    def tap_results(self):
+        """
+        The results of the taps over the bytes received so far, by tap name.
+        """
+        if getattr(self, '_tap_results', None) is None:
+            state = self._get_tap_state()
+            if state is None:
+                taps = self.get_taps()
+                if not taps:
+                    return {}
+                state = TapState(taps)
+                self._update_hash_state(state)
+            return state.results()
+        return self._tap_results
+
     def delete_file(self):
         if self.file:
+            self.delete_chunk_checksums()
             storage, path = self.file.storage, self.file.path
             storage.delete(path)
         self.file = None
 
+    def delete_chunk_checksums(self):
+        path = self.get_chunk_checksums_path()
+        if path is not None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
     @transaction.atomic
     def delete(self, delete_file=True, *args, **kwargs):
+        hash_states.discard(self.id)
+        tap_states.discard(self.id)
+        sync_states.discard(self.id)
+        file_handles.close(self.id)
+        state_cache = get_state_cache()
+        if state_cache is not None:
+            state_cache.delete(self)
         super().delete(*args, **kwargs)
         if delete_file:
             self.delete_file()
@@ -99,22 +342,500 @@ class AbstractChunkedUpload(models.Model):
             self.status,
         )
 
-    def append_chunk(self, chunk, chunk_size=None, save=True):
-        self.file.close()
-        self.file.open(mode='ab')
-        for subchunk in chunk.chunks():
-            self.file.write(subchunk)
-        if chunk_size is not None:
-            self.offset += chunk_size
-        elif hasattr(chunk, 'size'):
-            self.offset += chunk.size
+    def append_chunk(self, chunk, chunk_size=None, save=True, checksum=None, stored=None):
+        """
+        Append `chunk` at the offset and save the new offset. A chunk of the
+        chunk store is given with its sha256 digest as `stored`: it is read
+        only to verify it against that digest and to hash it, and copied
+        into the upload file with `copy_range`.
+        """
+        start = self.offset
+        state_cache = get_state_cache()
+        source = chunk
+        if stored:
+            chunk = stored_chunk = DigestingChunk(chunk, ChunkStore.checksum_type)
+        if checksum is not None:
+            chunk = DigestingChunk(chunk)
+        # only the request that claims the offset writes to the file
+        with self.claim_offset(start) if save else nullcontext():
+            with phase('checksum'):
+                state = self._get_hash_state()
+            with phase('taps'):
+                taps = self._get_tap_state()
+            with state.lock if state is not None else nullcontext(), \
+                    taps.lock if taps is not None else nullcontext(), phase('write'):
+                if state is not None and state.offset != start:
+                    # a concurrent request got here first; catch up later
+                    state = None
+                if taps is not None and taps.offset != start:
+                    taps = None
+                with self.open_for_write() as f:
+                    f.seek(start)
+                    try:
+                        for subchunk in chunk.chunks():
+                            if not stored:
+                                f.write(subchunk)
+                            if state is not None:
+                                state.update(subchunk)
+                            if taps is not None:
+                                taps.update(subchunk)
+                        if checksum is not None and chunk.hexdigest() != checksum:
+                            raise ChunkChecksumError()
+                        if stored:
+                            if stored_chunk.hexdigest() != stored:
+                                raise ChunkChecksumError()
+                            copy_range(source, f, 0, source.size)
+                        with phase('sync'):
+                            synced = sync_states.written(self.id, f, f.tell() - start, f.tell())
+                    except Exception:
+                        # don't leave a partial chunk past the last good offset
+                        f.truncate(start)
+                        hash_states.discard(self.id)
+                        tap_states.discard(self.id)
+                        raise
+            if synced is not None:
+                self.update_synced_offset(synced)
+                if state_cache is not None and save:
+                    state_cache.set_record(self)
+            if chunk_size is not None:
+                self.offset += chunk_size
+            elif hasattr(chunk, 'size'):
+                self.offset += chunk.size
+            else:
+                self.offset = self.file.size
+            # clear any cached checksum
+            self._checksum = None
+            if save:
+                # saved with the offset, for workers without it in memory
+                tap_state = taps.dump() if taps is not None else None
+                with phase('save'):
+                    if state_cache is None:
+                        fields = {}
+                        if tap_state is not None:
+                            self.tap_state = fields['tap_state'] = tap_state
+                        saved = self.update_offset(start, **fields)
+                    else:
+                        saved = self.update_offset(start)
+                        if saved and tap_state is not None:
+                            state_cache.set_tap_state(self, tap_state)
+                if not saved:
+                    hash_states.discard(self.id)
+                    tap_states.discard(self.id)
+                    self.refresh_offset()
+                    raise OffsetConflictError(self.offset, start)
+        if checksum is not None:
+            self.add_chunk_checksum(start, self.offset - 1, checksum)
+
+    @contextmanager
+    def claim_offset(self, start):
+        """
+        Claim the right to write at `start` until the block exits, so that
+        of several requests sending the chunk at an offset, only one touches
+        the file. Raises `OffsetConflictError` if the offset is no longer
+        `start` or another request holds the claim.
+
+        Without a state cache, the claim is a token set on the record by a
+        short conditional UPDATE, before the chunk body is read, and
+        cleared by the UPDATE saving the new offset. No transaction or row
+        lock is held while the body is received, so a slow client does not
+        block others. A claim older than `claim_timeout` is presumed
+        abandoned.
+        """
+        state_cache = get_state_cache()
+        if state_cache is not None:
+            if not state_cache.claim(self):
+                self.refresh_offset()
+                raise OffsetConflictError(self.offset, start)
+            try:
+                offset = state_cache.get_offset(self)
+                if offset is not None and offset != start:
+                    self.offset = offset
+                    raise OffsetConflictError(offset, start)
+                yield
+            finally:
+                state_cache.release(self)
+            return
+
+        token = uuid.uuid4().hex
+        now = timezone.now()
+        claimed = self._meta.model.objects.filter(
+            Q(claim='') | Q(claimed_at__lte=now - self.claim_timeout),
+            pk=self.pk,
+            offset=start,
+        ).update(claim=token, claimed_at=now)
+        if not claimed:
+            self.refresh_offset()
+            raise OffsetConflictError(self.offset, start)
+        self._claim = token
+        try:
+            yield
+        finally:
+            if self._claim is not None:
+                # not released by saving the new offset
+                self._claim = None
+                self._meta.model.objects.filter(
+                    pk=self.pk,
+                    claim=token,
+                ).update(claim='')
+
+    @contextmanager
+    def open_for_write(self):
+        """
+        Open the upload file for positioned writes, using a pooled handle
+        if the file handle pool is enabled and the storage has local paths.
+        """
+        path = None
+        if file_handles.enabled:
+            try:
+                path = self.file.path
+            except NotImplementedError:
+                pass
+
+        if path is None:
+            self.file.close()
+            try:
+                self.file.open(mode='r+b')
+            except FileNotFoundError:
+                self.file.open(mode='wb')
+            try:
+                yield self.file
+            finally:
+                self.file.close()
+            return
+
+        f = file_handles.acquire(self.id, path)
+        try:
+            yield f
+        except BaseException:
+            f.close()
+            raise
+        file_handles.release(self.id, path, f)
+
+    def preallocate(self, size):
+        """
+        Reserve space for the upload file to grow to `size` bytes, if the
+        storage has local paths. Raises `OSError` (e.g. ENOSPC) if there is
+        not enough space.
+        """
+        try:
+            path = self.file.path
+        except NotImplementedError:
+            return
+        with open(path, 'r+b') as f:
+            preallocate(f, size)
+
+    def update_offset(self, expected_offset, **fields):
+        """
+        Persist `offset` (and any extra `fields`) with a single conditional
+        UPDATE that only applies if the stored offset is still
+        `expected_offset`. Returns `False` if another request moved it first.
+        """
+        state_cache = get_state_cache()
+        if state_cache is not None and not fields:
+            advanced = state_cache.advance(self, expected_offset)
+            if advanced is None:
+                # the cached state was lost; re-seed it so the compare still
+                # applies
+                state_cache.seed(self, self.lost_offset(expected_offset))
+                advanced = state_cache.advance(self, expected_offset)
+            if advanced is not None:
+                if advanced and state_cache.should_flush(self):
+                    self.flush_offset()
+                return advanced
+            # the cache is not keeping state; use the database
+
+        queryset = self._meta.model.objects.filter(
+            pk=self.pk,
+            offset=expected_offset,
+        )
+        if self._claim is not None:
+            # only the request holding the claim saves, releasing it
+            queryset = queryset.filter(claim=self._claim)
+            fields['claim'] = ''
+        updated = queryset.update(offset=self.offset, **fields)
+        if updated and self._claim is not None:
+            self._claim = None
+        return updated == 1
+
+    def lost_offset(self, expected_offset):
+        """
+        Rebuild the offset this request expects to be `expected_offset`,
+        after its cached state was lost. The record's offset may lag behind
+        it, so it is the greatest of that, `synced_offset` and the file
+        size; a file ending where this request's chunk ends was not written
+        past by another request, so its offset was `expected_offset`.
+        """
+        offset, synced_offset = self._meta.model.objects.filter(
+            pk=self.pk,
+        ).values_list('offset', 'synced_offset').get()
+        size = 0
+        if self.file and self.file.storage.exists(self.file.name):
+            size = self.file.size
+        if size == self.offset:
+            size = expected_offset
+        return max(offset, synced_offset, size)
+
+    def update_synced_offset(self, offset):
+        """
+        Persist `synced_offset` once the file is synced up to `offset`,
+        never moving it back.
+        """
+        self.synced_offset = max(self.synced_offset, offset)
+        self._meta.model.objects.filter(
+            pk=self.pk,
+            synced_offset__lt=offset,
+        ).update(synced_offset=offset)
+
+    def rewind(self, offset):
+        """
+        Move the offset back to `offset`, discarding the bytes after it,
+        for a client resuming from `synced_offset` after a crash. Raises
+        `OffsetConflictError` if another request moved the offset first.
+        """
+        expected_offset = self.offset
+        with self.claim_offset(expected_offset):
+            with self.open_for_write() as f:
+                f.truncate(offset)
+            hash_states.discard(self.id)
+            tap_states.discard(self.id)
+            sync_states.discard(self.id)
+            self.offset = offset
+            self._checksum = None
+            if not self.update_offset(expected_offset):
+                self.refresh_offset()
+                raise OffsetConflictError(self.offset, expected_offset)
+            if get_state_cache() is not None:
+                # the database may hold a flushed offset past the new one
+                self._meta.model.objects.filter(
+                    pk=self.pk,
+                    offset__gt=offset,
+                ).update(offset=offset)
+
+    def refresh_offset(self):
+        """
+        Reload `offset` from the state cache, if cached, or the database.
+        """
+        state_cache = get_state_cache()
+        offset = None
+        if state_cache is not None:
+            offset = state_cache.get_offset(self)
+        if offset is None:
+            self.refresh_from_db(fields=['offset'])
+        else:
+            self.offset = offset
+
+    def flush_offset(self):
+        """
+        Write a cached offset back to the database, never moving it back.
+        """
+        self._meta.model.objects.filter(
+            pk=self.pk,
+            offset__lt=self.offset,
+        ).update(offset=self.offset)
+
+    def recover_offset(self):
+        """
+        Rebuild the offset from the size of the file, for when the stored
+        offset may lag behind the bytes written (e.g. lost cached state).
+        """
+        if self.file and self.file.storage.exists(self.file.name):
+            self.offset = max(self.offset, self.file.size)
+
+    def write_chunk(self, chunk, start, chunk_size=None, checksum=None, stored=None):
+        """
+        Write `chunk` at byte `start` of the file, which may be past the end
+        of the bytes received so far, and record the received range. Used
+        for uploads accepting chunks in parallel and in any order. A
+        `stored` chunk is copied as in `append_chunk`.
+        """
+        if chunk_size is None:
+            chunk_size = chunk.size
+        end = start + chunk_size - 1
+        source = chunk
+        if stored:
+            chunk = stored_chunk = DigestingChunk(chunk, ChunkStore.checksum_type)
+        if checksum is not None:
+            chunk = DigestingChunk(chunk)
+        overlap = [(first, last) for first, last in self.get_received_ranges()
+                   if first <= end and last >= start]
+        if overlap:
+            # only a re-send of received bytes (e.g. a retry whose response
+            # was lost) is accepted, and the file is left alone: the hash
+            # and tap states have already seen those bytes
+            if overlap[0][0] > start or overlap[0][1] < end or not self.matches_file(chunk, start):
+                raise ChunkOverlapError()
+            if checksum is not None and chunk.hexdigest() != checksum:
+                raise ChunkChecksumError()
+            if stored and stored_chunk.hexdigest() != stored:
+                raise ChunkChecksumError()
+            return
+        spool = None
+        if checksum is not None and not stored:
+            # verified before it is written, so a corrupt chunk never
+            # replaces bytes in the file
+            spool = source = File(
+                SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE),
+            )
+            for subchunk in chunk.chunks():
+                spool.write(subchunk)
+            if chunk.hexdigest() != checksum:
+                spool.close()
+                raise ChunkChecksumError()
+        # the bytes up to the contiguous offset were written before these
+        if start <= self.offset:
+            contiguous = max(self.offset, start + chunk_size)
         else:
-            self.offset = self.file.size
+            contiguous = self.offset
+        with spool if spool is not None else nullcontext(), \
+                phase('write'), self.open_for_write() as f:
+            f.seek(start)
+            if stored:
+                # verified from the store side before it is copied
+                for _ in chunk.chunks():
+                    pass
+                if checksum is not None and chunk.hexdigest() != checksum:
+                    raise ChunkChecksumError()
+                if stored_chunk.hexdigest() != stored:
+                    raise ChunkChecksumError()
+                copy_range(source, f, 0, chunk_size)
+            else:
+                for subchunk in source.chunks():
+                    f.write(subchunk)
+            with phase('sync'):
+                synced = sync_states.written(self.id, f, f.tell() - start, contiguous)
+        if synced is not None:
+            self.update_synced_offset(synced)
+        self.add_received_range(start, start + chunk_size - 1)
+        if checksum is not None:
+            self.add_chunk_checksum(start, start + chunk_size - 1, checksum)
         # clear any cached checksum
         self._checksum = None
-        if save:
-            self.save()
+        # hash any newly contiguous bytes while they are likely still cached
+        with phase('checksum'):
+            self._get_hash_state()
+        self.feed_taps()
+
+    @transaction.atomic
+    def add_received_range(self, start, end):
+        """
+        Merge a received byte range into the record, under a row lock so
+        concurrent chunks for the same upload are not lost.
+        """
+        locked = type(self).objects.select_for_update().only(
+            'offset', 'received_ranges',
+        ).get(pk=self.pk)
+        ranges = locked.get_received_ranges()
+        ranges.append((start, end))
+        ranges = merge_ranges(ranges)
+        self.received_ranges = format_ranges(ranges)
+        self.offset = contiguous_end(ranges)
+        with phase('save'):
+            self.save(update_fields=['received_ranges', 'offset'])
+
+    def get_chunk_checksums_path(self):
+        """
+        Path of the file, beside the upload file, that chunk checksums are
+        appended to, or `None` if the storage has no local paths.
+        """
+        if not self.file:
+            return None
+        try:
+            return self.file.path + self.chunk_checksums_ext
+        except NotImplementedError:
+            return None
+
+    def add_chunk_checksum(self, start, end, checksum):
+        """
+        Record the verified checksum of a chunk. It is appended as a line to
+        the file at `get_chunk_checksums_path`, so recording a chunk costs
+        the same however many came before and no query; each line is a
+        single short append, so concurrent chunks are not lost. Storages
+        without local paths append to the list in the database instead.
+        """
+        entry = '{}-{}:{}'.format(start, end, checksum)
+        path = self.get_chunk_checksums_path()
+        if path is not None:
+            with open(path, 'a') as f:
+                f.write(entry + '\n')
+            return
+        entry = ',' + entry
+        self.chunk_checksums += entry
+        self._meta.model.objects.filter(pk=self.pk).update(
+            chunk_checksums=Concat(F('chunk_checksums'), Value(entry)),
+        )
+
+    def get_chunk_checksums(self):
+        """
+        Get the recorded chunk checksums in file order, or `None` if they do
+        not cover the file from the start to `offset` without gaps.
+        """
+        recorded = self.chunk_checksums
+        path = self.get_chunk_checksums_path()
+        if path is not None:
+            try:
+                with open(path) as f:
+                    recorded += ',' + ','.join(f.read().split())
+            except FileNotFoundError:
+                pass
+        checksums = []
+        position = 0
+        for (start, end), checksum in sorted(parse_chunk_checksums(recorded).items()):
+            if start < position:
+                continue
+            if start > position:
+                return None
+            checksums.append(checksum)
+            position = end + 1
+        if position != self.offset:
+            return None
+        return checksums
+
+    def matches_file(self, chunk, start):
+        """
+        Whether the data of `chunk` is what the file holds from byte `start`.
+        Reads the whole chunk if it matches.
+        """
         self.file.close()
+        self.file.open(mode='rb')
+        try:
+            self.file.seek(start)
+            for subchunk in chunk.chunks():
+                if self.file.read(len(subchunk)) != subchunk:
+                    return False
+            return True
+        finally:
+            self.file.close()
+
+    def get_received_ranges(self):
+        ranges = parse_ranges(self.received_ranges)
+        if self.offset:
+            ranges.append((0, self.offset - 1))
+        return merge_ranges(ranges)
+
+    def get_missing_ranges(self, total=None):
+        return missing_ranges(self.get_received_ranges(), total)
+
+    def link_file(self, source):
+        """
+        Give this upload a copy of the file of upload `source`: a hard link
+        where possible, otherwise a copy.
+        """
+        name = generate_filename(self, self.filename)
+        storage = self.file.storage
+        try:
+            source_path, path = source.file.path, storage.path(name)
+        except NotImplementedError:
+            with source.file.open(mode='rb') as f:
+                name = storage.save(name, f)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(source_path, path)
+            except OSError:
+                with open(source_path, 'rb') as src, open(path, 'wb') as dst:
+                    copy_range(src, dst, 0, os.fstat(src.fileno()).st_size)
+        self.file.name = name
+        self._meta.model.objects.filter(pk=self.pk).update(file=name)
 
     def get_uploaded_file(self):
         self.file.close()
@@ -122,25 +843,142 @@ class AbstractChunkedUpload(models.Model):
         return UploadedFile(file=self.file, name=self.filename,
                             size=self.file.size)
 
+    def finalizing(self):
+        """
+        Mark the upload as being completed in the background, persisting
+        the current offset. Returns `False` if it was no longer uploading,
+        or was finalizing but not yet stale.
+        """
+        finalizing_at = timezone.now()
+        updated = self._meta.model.objects.filter(
+            Q(status=self.UPLOADING) | self.stale_finalizing_filter(),
+            pk=self.pk,
+        ).update(
+            status=self.FINALIZING,
+            finalizing_at=finalizing_at,
+            offset=self.offset,
+            completion_error='',
+        )
+        if not updated:
+            return False
+        self.status = self.FINALIZING
+        self.finalizing_at = finalizing_at
+        self.completion_error = ''
+        state_cache = get_state_cache()
+        if state_cache is not None:
+            state_cache.delete(self)
+        return True
+
+    def start_finalizing(self):
+        """
+        Claim the background completion of an upload marked as finalizing,
+        restarting its `FINALIZING_TIMEOUT`. Returns `False` if it is no
+        longer finalizing, or was marked again since this instance was
+        loaded (e.g. for a duplicate or late task).
+        """
+        started_at = timezone.now()
+        updated = self._meta.model.objects.filter(
+            pk=self.pk,
+            status=self.FINALIZING,
+            finalizing_at=self.finalizing_at,
+        ).update(finalizing_at=started_at)
+        if updated:
+            self.finalizing_at = started_at
+        return bool(updated)
+
+    def completion_failed(self, error):
+        """
+        Return an upload that failed background completion to uploading,
+        recording why, unless it is no longer finalizing as claimed by
+        this instance. Returns `False` if so.
+        """
+        updated = self._meta.model.objects.filter(
+            pk=self.pk,
+            status=self.FINALIZING,
+            finalizing_at=self.finalizing_at,
+        ).update(
+            status=self.UPLOADING,
+            completion_error=str(error),
+        )
+        if not updated:
+            return False
+        self.status = self.UPLOADING
+        self.completion_error = str(error)
+        return True
+
     @transaction.atomic
     def completed(self, completed_at=None, ext=_settings.COMPLETE_EXT):
         if completed_at is None:
             completed_at = timezone.now()
 
+        file_handles.close(self.id)
+        durable = _settings.DURABILITY != durability.NONE
+        if durable:
+            with phase('sync'):
+                self.sync_file()
+        with phase('taps'):
+            # kept for on_completion, as the tap state is discarded; read
+            # before the file is renamed, in case the taps must catch up
+            self._tap_results = self.tap_results
+        self.delete_chunk_checksums()
         if ext != _settings.INCOMPLETE_EXT:
             original_path = self.file.path
             self.file.name = os.path.splitext(self.file.name)[0] + ext
         self.status = self.COMPLETE
         self.completed_at = completed_at
-        self.save()
+        self.tap_state = ''
+        if durable:
+            self.synced_offset = self.offset
+        if getattr(self, '_checksum', None) is not None:
+            # only stored if already computed, e.g. to verify the upload
+            self.digest = '{}:{}'.format(_settings.CHECKSUM_TYPE, self._checksum)
+        with phase('save'):
+            self.save()
+        metrics.uploads_completed.inc()
+        hash_states.discard(self.id)
+        tap_states.discard(self.id)
+        sync_states.discard(self.id)
+        state_cache = get_state_cache()
+        if state_cache is not None:
+            state_cache.delete(self)
         if ext != _settings.INCOMPLETE_EXT:
             os.rename(
                 original_path,
                 os.path.splitext(self.file.path)[0] + ext,
             )
+            if durable:
+                fsync_path(os.path.dirname(self.file.path))
+
+    def sync_file(self):
+        """
+        Flush the upload file to disk, if the storage has local paths.
+        """
+        if not self.file:
+            return
+        try:
+            path = self.file.path
+        except NotImplementedError:
+            return
+        fsync_path(path)
 
     class Meta:
         abstract = True
+        # `%(class)s` makes the names unique per model, for subclasses; the
+        # app label would take them past Django's 30 character limit
+        indexes = [
+            # finding expired uploads; only incomplete uploads can expire
+            models.Index(
+                fields=['created_at', 'id'],
+                condition=models.Q(status=1),  # UPLOADING
+                name='%(class)s_expiry',
+            ),
+            # finding complete uploads of a file, for instant completion
+            models.Index(
+                fields=['digest', 'offset'],
+                condition=models.Q(status=2),  # COMPLETE
+                name='%(class)s_digest',
+            ),
+        ]
 
 
 class ChunkedUpload(AbstractChunkedUpload):
@@ -150,5 +988,12 @@ class ChunkedUpload(AbstractChunkedUpload):
                              editable=False,
                              on_delete=models.CASCADE)
 
-    class Meta:
+    class Meta(AbstractChunkedUpload.Meta):
         abstract = _settings.ABSTRACT_MODEL
+        indexes = AbstractChunkedUpload.Meta.indexes + [
+            # listing a user's uploads by creation date
+            models.Index(
+                fields=['user', 'created_at'],
+                name='%(class)s_user_created',
+            ),
+        ]
@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+from rest_framework.settings import api_settings
+
+
+class ChunkedUploadCursorPagination(CursorPagination):
+    """
+    Paginates uploads with a cursor on their creation date, so each page
+    is read from the index without counting or skipping earlier rows.
+    """
+
+    ordering = ('-created_at', '-id')
+    page_size = api_settings.PAGE_SIZE or 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,152 @@
+import gzip
+import io
+import zlib
+
+from django.core.files.uploadedfile import UploadedFile
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, FileUploadParser
+
+from drf_chunked_upload.exceptions import ChunkDecodingError
+
+
+# Decompressing readers by Content-Encoding, and the errors they raise on
+# corrupt input. zstd needs Python 3.14 or the `zstandard` package.
+DECODERS = {
+    'gzip': lambda f: gzip.GzipFile(fileobj=f, mode='rb'),
+}
+DECODING_ERRORS = (OSError, EOFError, zlib.error)
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+        DECODERS['zstd'] = lambda f: zstandard.ZstdDecompressor().stream_reader(f)
+        DECODING_ERRORS += (zstandard.ZstdError,)
+else:
+    DECODERS['zstd'] = lambda f: zstd.ZstdFile(f)
+    DECODING_ERRORS += (zstd.ZstdError,)
+
+
+class StreamedChunk(UploadedFile):
+    """
+    A chunk whose `chunks()` read straight from the request stream.
+    It can only be read once.
+    """
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        remaining = self.size
+        while remaining > 0:
+            data = self.file.read(min(chunk_size, remaining))
+            if not data:
+                raise ParseError("Chunk body is shorter than Content-Length")
+            remaining -= len(data)
+            yield data
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    Raw file object reading the `chunks()` of a chunk.
+    """
+
+    def __init__(self, chunk):
+        self._chunks = chunk.chunks()
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self._buffer:
+            self._buffer = next(self._chunks, b'')
+        count = min(len(b), len(self._buffer))
+        b[:count] = self._buffer[:count]
+        self._buffer = self._buffer[count:]
+        return count
+
+
+class DecodedChunk(UploadedFile):
+    """
+    A chunk sent with a Content-Encoding, decompressed as it is read so
+    only one piece of it is held in memory at a time. `size` is the
+    expected decompressed size: reading fails as soon as the content
+    decompresses to more than that, or at the end if to less.
+    """
+
+    def __init__(self, chunk, encoding, size):
+        super().__init__(
+            file=chunk,
+            name=chunk.name,
+            content_type=chunk.content_type,
+            size=size,
+        )
+        self.content_encoding = encoding
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        remaining = self.size
+        reader = DECODERS[self.content_encoding](_ChunkReader(self.file))
+        try:
+            while True:
+                # read a byte past the expected end to detect longer content
+                data = reader.read(min(chunk_size, remaining) or 1)
+                if not data:
+                    break
+                if len(data) > remaining:
+                    raise ChunkDecodingError(
+                        detail='Decompressed chunk is larger than reported'
+                    )
+                remaining -= len(data)
+                yield data
+        except DECODING_ERRORS:
+            raise ChunkDecodingError()
+        finally:
+            reader.close()
+        if remaining:
+            raise ChunkDecodingError(detail='Decompressed chunk is smaller than reported')
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+
+class ChunkParser(FileUploadParser):
+    """
+    Parser for raw chunk bodies (`application/octet-stream`).
+
+    Rather than spooling the body into memory or a temporary file, the chunk
+    is returned as a `StreamedChunk` so it is written only once, into the
+    upload file. The file name for a new upload can be sent in a
+    `Content-Disposition` header.
+    """
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        meta = parser_context['request'].META
+        view = parser_context.get('view')
+        field_name = getattr(view, 'field_name', 'file')
+        filename = self.get_filename(stream, media_type, parser_context)
+
+        try:
+            content_length = int(meta.get('HTTP_CONTENT_LENGTH',
+                                          meta.get('CONTENT_LENGTH', 0)))
+        except (ValueError, TypeError):
+            raise ParseError('Content-Length is required')
+
+        data = {}
+        if filename:
+            data['filename'] = filename
+        chunk = StreamedChunk(
+            file=stream,
+            name=filename or field_name,
+            content_type=media_type,
+            size=content_length,
+        )
+        return DataAndFiles(data, {field_name: chunk})
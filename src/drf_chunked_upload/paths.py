@@ -0,0 +1,70 @@
+"""
+Layouts of upload files below `DRF_CHUNKED_UPLOAD_PATH`.
+
+`DRF_CHUNKED_UPLOAD_PATH_STRATEGY` picks how upload files are placed in the
+upload directory, once its date placeholders (e.g. `%Y/%m/%d`) are filled in:
+
+- `'date'`: directly in it, so a date directory holds every upload of
+  the day.
+- `'hash'`: fanned out into two levels of directories named by a hash of the
+  upload id, e.g. `ab/cd/<id>.part`, so no directory grows large.
+
+It can also be a path strategy instance or class, or a dotted path to one.
+Files keep the name they were created with, so changing the strategy only
+affects new uploads.
+"""
+import hashlib
+import os
+import time
+
+from django.utils.module_loading import import_string
+
+from drf_chunked_upload import settings as _settings
+
+
+class DatePathStrategy:
+    # levels of directories the strategy adds below the upload directory
+    depth = 0
+
+    def get_directory(self, instance, upload_dir):
+        """
+        Get the directory of the file of upload `instance`.
+        """
+        return time.strftime(upload_dir)
+
+
+class HashPathStrategy(DatePathStrategy):
+    depth = 2
+
+    def get_directory(self, instance, upload_dir):
+        digest = hashlib.md5(str(instance.id).encode()).hexdigest()
+        return os.path.join(
+            super().get_directory(instance, upload_dir),
+            *(digest[level * 2:level * 2 + 2] for level in range(self.depth))
+        )
+
+
+PATH_STRATEGIES = {
+    'date': DatePathStrategy,
+    'hash': HashPathStrategy,
+}
+
+# resolved strategies, keyed by the setting value
+_strategies = {}
+
+
+def get_path_strategy():
+    """
+    Get the strategy configured in `DRF_CHUNKED_UPLOAD_PATH_STRATEGY`.
+    Names and dotted paths are resolved once.
+    """
+    setting = _settings.PATH_STRATEGY
+    strategy = _strategies.get(setting)
+    if strategy is None:
+        strategy = PATH_STRATEGIES.get(setting, setting)
+        if isinstance(strategy, str):
+            strategy = import_string(strategy)
+        if isinstance(strategy, type):
+            strategy = strategy()
+        _strategies[setting] = strategy
+    return strategy
@@ -0,0 +1,69 @@
+"""
+Preallocation of upload files.
+
+Reserving the full size of an upload when it is created lets the filesystem
+lay the file out in few extents, instead of growing it a chunk at a time,
+and rejects an upload the volume has no room for before any more of it is
+sent. Space is reserved with `fallocate(FALLOC_FL_KEEP_SIZE)` on Linux, so
+the file size still counts only the bytes written and offsets, checksums and
+offset recovery are unaffected. Elsewhere, the free space of the volume is
+checked instead.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import sys
+
+
+FALLOC_FL_KEEP_SIZE = 0x01
+
+# errors meaning the platform or filesystem cannot preallocate
+UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL}
+
+
+def _load_fallocate():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+    # the 64-bit offset variant, where off_t is 32 bits
+    fallocate = getattr(libc, 'fallocate64', None) or getattr(libc, 'fallocate', None)
+    if fallocate is None:
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+_fallocate = _load_fallocate()
+
+
+def check_free_space(f, size):
+    """
+    Raise `OSError` (ENOSPC) if the volume of open file `f` cannot hold it
+    growing to `size` bytes.
+    """
+    needed = size - os.fstat(f.fileno()).st_size
+    stat = os.fstatvfs(f.fileno())
+    if needed > stat.f_bavail * stat.f_frsize:
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+
+def preallocate(f, size):
+    """
+    Reserve space for open file `f` to grow to `size` bytes, without
+    changing its size. Raises `OSError` (e.g. ENOSPC) if there is not
+    enough space.
+    """
+    if size <= 0:
+        return
+    if _fallocate is not None:
+        if _fallocate(f.fileno(), FALLOC_FL_KEEP_SIZE, 0, size) == 0:
+            return
+        error = ctypes.get_errno()
+        if error not in UNSUPPORTED_ERRNOS:
+            raise OSError(error, os.strerror(error))
+    check_free_space(f, size)
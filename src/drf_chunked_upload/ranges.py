@@ -0,0 +1,60 @@
+"""
+Helpers for tracking the byte ranges received for an upload.
+
+Ranges are inclusive `(start, end)` pairs, as in the HTTP Content-Range
+header, and are stored as text, e.g. `'0-999,2000-2999'`.
+"""
+
+
+def parse_ranges(value):
+    ranges = []
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, end = part.split('-')
+        ranges.append((int(start), int(end)))
+    return ranges
+
+
+def format_ranges(ranges):
+    return ','.join('{}-{}'.format(start, end) for start, end in ranges)
+
+
+def merge_ranges(ranges):
+    """
+    Sort `ranges` and merge any that overlap or touch.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def contiguous_end(ranges):
+    """
+    Number of contiguous bytes received from the start of the file.
+    """
+    ranges = merge_ranges(ranges)
+    if ranges and ranges[0][0] == 0:
+        return ranges[0][1] + 1
+    return 0
+
+
+def missing_ranges(ranges, total=None):
+    """
+    Gaps between the received `ranges`, and between the last one and
+    `total` if given.
+    """
+    missing = []
+    position = 0
+    for start, end in merge_ranges(ranges):
+        if start > position:
+            missing.append((position, start - 1))
+        position = end + 1
+    if total is not None and position < total:
+        missing.append((position, total - 1))
+    return missing
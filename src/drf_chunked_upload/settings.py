@@ -12,6 +12,12 @@ EXPIRATION_DELTA = getattr(settings, 'DRF_CHUNKED_UPLOAD_EXPIRATION_DELTA',
 DEFAULT_UPLOAD_PATH = 'chunked_uploads/%Y/%m/%d'
 UPLOAD_PATH = getattr(settings, 'DRF_CHUNKED_UPLOAD_PATH', DEFAULT_UPLOAD_PATH)
 
+# How upload files are laid out below `UPLOAD_PATH`: 'date' (directly in it),
+# 'hash' (in `ab/cd/` directories from a hash of the upload id), or a path
+# strategy, its class or a dotted path to either
+DEFAULT_PATH_STRATEGY = 'date'
+PATH_STRATEGY = getattr(settings, 'DRF_CHUNKED_UPLOAD_PATH_STRATEGY', DEFAULT_PATH_STRATEGY)
+
 # Checksum type to use when verifying files
 DEFAULT_CHECKSUM_TYPE = 'md5'
 CHECKSUM_TYPE = getattr(settings, 'DRF_CHUNKED_UPLOAD_CHECKSUM',
@@ -34,3 +40,131 @@ USER_RESTRICTED = getattr(settings, "DRF_CHUNKED_UPLOAD_USER_RESTRICTED", True)
 DEFAULT_MAX_BYTES = None
 MAX_BYTES = getattr(settings, 'DRF_CHUNKED_UPLOAD_MAX_BYTES', DEFAULT_MAX_BYTES)
 
+# Number of in-progress uploads for which each process keeps incremental
+# checksum state. `0` disables incremental checksums
+DEFAULT_CHECKSUM_STATE_CACHE_SIZE = 1000
+CHECKSUM_STATE_CACHE_SIZE = getattr(settings, 'DRF_CHUNKED_UPLOAD_CHECKSUM_STATE_CACHE_SIZE',
+                                    DEFAULT_CHECKSUM_STATE_CACHE_SIZE)
+
+# Boolean that defines if chunks can be uploaded in parallel and in any order
+ALLOW_OUT_OF_ORDER = getattr(settings, 'DRF_CHUNKED_UPLOAD_ALLOW_OUT_OF_ORDER', False)
+
+# Name of a cache (from `CACHES`) used to hold the state of in-progress
+# uploads. `None` disables the state cache
+STATE_CACHE = getattr(settings, 'DRF_CHUNKED_UPLOAD_STATE_CACHE', None)
+
+# How often the offset of a cached upload is written back to the database
+DEFAULT_STATE_FLUSH_INTERVAL = timedelta(seconds=30)
+STATE_FLUSH_INTERVAL = getattr(settings, 'DRF_CHUNKED_UPLOAD_STATE_FLUSH_INTERVAL',
+                               DEFAULT_STATE_FLUSH_INTERVAL)
+
+# Number of open upload file handles each process keeps between chunks.
+# `0` disables the pool
+DEFAULT_FILE_HANDLE_POOL_SIZE = 0
+FILE_HANDLE_POOL_SIZE = getattr(settings, 'DRF_CHUNKED_UPLOAD_FILE_HANDLE_POOL_SIZE',
+                                DEFAULT_FILE_HANDLE_POOL_SIZE)
+
+# How long a pooled file handle can stay unused before it is closed
+DEFAULT_FILE_HANDLE_IDLE_TIMEOUT = timedelta(minutes=1)
+FILE_HANDLE_IDLE_TIMEOUT = getattr(settings, 'DRF_CHUNKED_UPLOAD_FILE_HANDLE_IDLE_TIMEOUT',
+                                   DEFAULT_FILE_HANDLE_IDLE_TIMEOUT)
+
+# Boolean that defines if uploads are verified and completed in the background,
+# responding 202 to the completion request
+ASYNC_COMPLETION = getattr(settings, 'DRF_CHUNKED_UPLOAD_ASYNC_COMPLETION', False)
+
+# How long an upload can be finalizing before its background completion is
+# presumed lost, so the upload can be completed again or expire
+DEFAULT_FINALIZING_TIMEOUT = timedelta(hours=1)
+FINALIZING_TIMEOUT = getattr(settings, 'DRF_CHUNKED_UPLOAD_FINALIZING_TIMEOUT',
+                             DEFAULT_FINALIZING_TIMEOUT)
+
+# Executor used for background completion: an object with a `submit` method,
+# a callable returning one, or a dotted path to either. `None` uses a thread pool
+COMPLETION_EXECUTOR = getattr(settings, 'DRF_CHUNKED_UPLOAD_COMPLETION_EXECUTOR', None)
+
+# Boolean that defines if the phases of each request are timed and reported
+# in a `Server-Timing` header, the `upload_timed` signal and `TIMING_CALLBACK`
+TIMING = getattr(settings, 'DRF_CHUNKED_UPLOAD_TIMING', False)
+
+# Callable (or dotted path to one) called with the request and a dict of
+# seconds spent per phase after each timed request. `None` disables it
+TIMING_CALLBACK = getattr(settings, 'DRF_CHUNKED_UPLOAD_TIMING_CALLBACK', None)
+
+# Boolean that defines if views, models and commands report into the
+# in-process metrics registry
+METRICS = getattr(settings, 'DRF_CHUNKED_UPLOAD_METRICS', True)
+
+# Response to chunks of existing uploads: 'full' (the serializer output),
+# 'minimal' (id, offset and expiry) or 'headers' (the same as headers of a 204)
+DEFAULT_CHUNK_RESPONSE = 'full'
+CHUNK_RESPONSE = getattr(settings, 'DRF_CHUNKED_UPLOAD_CHUNK_RESPONSE',
+                         DEFAULT_CHUNK_RESPONSE)
+
+# Boolean that defines if the list of uploads is paginated with a cursor
+# instead of `DEFAULT_PAGINATION_CLASS`
+CURSOR_PAGINATION = getattr(settings, 'DRF_CHUNKED_UPLOAD_CURSOR_PAGINATION', False)
+
+# Directory of the content-addressed store of verified chunks, which clients
+# can reuse instead of uploading them again. `None` disables the chunk store
+CHUNK_STORE = getattr(settings, 'DRF_CHUNKED_UPLOAD_CHUNK_STORE', None)
+
+# How long a stored chunk is kept after it was last used
+DEFAULT_CHUNK_STORE_EXPIRATION_DELTA = timedelta(days=7)
+CHUNK_STORE_EXPIRATION_DELTA = getattr(settings, 'DRF_CHUNKED_UPLOAD_CHUNK_STORE_EXPIRATION_DELTA',
+                                       DEFAULT_CHUNK_STORE_EXPIRATION_DELTA)
+
+# Boolean that defines if new uploads sent with the checksum of the whole file
+# are completed right away from a complete upload of the same file
+INSTANT_COMPLETION = getattr(settings, 'DRF_CHUNKED_UPLOAD_INSTANT_COMPLETION', False)
+
+# Content-Encodings chunks can be sent with ('gzip', and 'zstd' where
+# available), decompressed as they are written
+DEFAULT_CONTENT_ENCODINGS = ['gzip', 'zstd']
+CONTENT_ENCODINGS = getattr(settings, 'DRF_CHUNKED_UPLOAD_CONTENT_ENCODINGS',
+                            DEFAULT_CONTENT_ENCODINGS)
+
+# Boolean that defines if the full size of an upload (the `Content-Range`
+# total) is reserved on disk when it is created
+PREALLOCATE = getattr(settings, 'DRF_CHUNKED_UPLOAD_PREALLOCATE', False)
+
+# When upload files are fsynced: 'none', 'completion' (before an upload is
+# marked complete) or 'interval' (also every `DURABILITY_INTERVAL_BYTES` or
+# `DURABILITY_INTERVAL`, whichever comes first, before the offset is saved)
+DEFAULT_DURABILITY = 'none'
+DURABILITY = getattr(settings, 'DRF_CHUNKED_UPLOAD_DURABILITY', DEFAULT_DURABILITY)
+
+# Bytes written to an upload file between syncs in the 'interval' mode
+DEFAULT_DURABILITY_INTERVAL_BYTES = 64 * 1024 * 1024
+DURABILITY_INTERVAL_BYTES = getattr(settings, 'DRF_CHUNKED_UPLOAD_DURABILITY_INTERVAL_BYTES',
+                                    DEFAULT_DURABILITY_INTERVAL_BYTES)
+
+# Longest time between syncs of an upload file in the 'interval' mode
+DEFAULT_DURABILITY_INTERVAL = timedelta(seconds=1)
+DURABILITY_INTERVAL = getattr(settings, 'DRF_CHUNKED_UPLOAD_DURABILITY_INTERVAL',
+                              DEFAULT_DURABILITY_INTERVAL)
+
+# Cache holding the admission control counters, shared by the workers that
+# use it
+DEFAULT_ADMISSION_CACHE = 'default'
+ADMISSION_CACHE = getattr(settings, 'DRF_CHUNKED_UPLOAD_ADMISSION_CACHE',
+                          DEFAULT_ADMISSION_CACHE)
+
+# How long an in-flight chunk is counted at most, so counts left by workers
+# that died mid-request expire
+DEFAULT_ADMISSION_TIMEOUT = timedelta(minutes=5)
+ADMISSION_TIMEOUT = getattr(settings, 'DRF_CHUNKED_UPLOAD_ADMISSION_TIMEOUT',
+                            DEFAULT_ADMISSION_TIMEOUT)
+
+# Max number of chunks a user can have in flight at once. `None` means no limit
+MAX_USER_CHUNKS = getattr(settings, 'DRF_CHUNKED_UPLOAD_MAX_USER_CHUNKS', None)
+
+# Max bytes per second of chunks admitted on a node (host). `None` means no limit
+MAX_NODE_BYTES_PER_SECOND = getattr(settings, 'DRF_CHUNKED_UPLOAD_MAX_NODE_BYTES_PER_SECOND', None)
+
+# Max number of incomplete, unexpired uploads. `None` means no limit
+MAX_ACTIVE_UPLOADS = getattr(settings, 'DRF_CHUNKED_UPLOAD_MAX_ACTIVE_UPLOADS', None)
+
+# Taps that see the data of uploads as it is written: instances of
+# `drf_chunked_upload.taps.Tap`, their classes or dotted paths to either
+TAPS = getattr(settings, 'DRF_CHUNKED_UPLOAD_TAPS', [])
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+
+# Sent after a timed request to a chunked upload view, with the `request`,
+# the `response` and `timings`, a dict of seconds spent per phase
+upload_timed = Signal()
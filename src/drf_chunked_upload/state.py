@@ -0,0 +1,194 @@
+"""
+Optional cache-backed state for in-progress uploads.
+
+When `DRF_CHUNKED_UPLOAD_STATE_CACHE` names a cache, the record of an
+in-progress upload is kept in that cache so chunk requests do not have to
+read it from, or write it to, the database. The offset is kept in its own
+key and advanced with `incr`, so concurrent chunks are still detected as
+long as the cache backend's `incr` is atomic (memcached, redis, locmem).
+The offset is written back to the database at most once every
+`DRF_CHUNKED_UPLOAD_STATE_FLUSH_INTERVAL`, and always on completion.
+"""
+from django.core.cache import caches
+from django.db.models.base import DEFERRED
+
+from drf_chunked_upload import settings as _settings
+
+
+class UploadStateCache:
+    key_prefix = 'drf_chunked_upload'
+    # seconds a claim on an upload outlives a request that died holding it
+    claim_timeout = 300
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def timeout(self):
+        return _settings.EXPIRATION_DELTA.total_seconds()
+
+    def _key(self, model, pk, suffix):
+        return '{}:{}:{}:{}'.format(
+            self.key_prefix,
+            model._meta.label_lower,
+            model._meta.pk.to_python(pk),
+            suffix,
+        )
+
+    def get(self, model, pk):
+        """
+        Build an upload instance from the cached state, or return `None` if
+        the upload is not cached.
+        """
+        record_key = self._key(model, pk, 'record')
+        offset_key = self._key(model, pk, 'offset')
+        state = self.cache.get_many([record_key, offset_key])
+        if record_key not in state or offset_key not in state:
+            return None
+        values, offset = state[record_key], state[offset_key]
+        fields = model._meta.concrete_fields
+        instance = model.from_db(
+            None,
+            [field.attname for field in fields],
+            [values.get(field.attname, DEFERRED) for field in fields],
+        )
+        instance.offset = offset
+        return instance
+
+    def get_offset(self, instance):
+        return self.cache.get(
+            self._key(instance._meta.model, instance.pk, 'offset'),
+        )
+
+    def _record(self, instance):
+        values = {
+            field.attname: getattr(instance, field.attname)
+            for field in instance._meta.concrete_fields
+            if field.attname != 'offset'
+        }
+        values['file'] = instance.file.name
+        return values
+
+    def set(self, instance):
+        model, pk = instance._meta.model, instance.pk
+        self.cache.set_many({
+            self._key(model, pk, 'record'): self._record(instance),
+            self._key(model, pk, 'offset'): instance.offset,
+        }, self.timeout)
+        self.cache.add(
+            self._key(model, pk, 'flush'),
+            True,
+            _settings.STATE_FLUSH_INTERVAL.total_seconds(),
+        )
+
+    def set_record(self, instance):
+        """
+        Update the cached record of an upload, leaving its offset alone.
+        """
+        self.cache.set(
+            self._key(instance._meta.model, instance.pk, 'record'),
+            self._record(instance),
+            self.timeout,
+        )
+
+    def seed(self, instance, offset):
+        """
+        Cache the state of an upload at `offset` unless another request
+        cached it first.
+        """
+        model, pk = instance._meta.model, instance.pk
+        self.cache.add(self._key(model, pk, 'record'), self._record(instance), self.timeout)
+        self.cache.add(self._key(model, pk, 'offset'), offset, self.timeout)
+
+    def advance(self, instance, expected_offset):
+        """
+        Move the cached offset from `expected_offset` to `instance.offset`.
+        Returns `False` if another request moved it first, or `None` if the
+        state is no longer cached.
+        """
+        key = self._key(instance._meta.model, instance.pk, 'offset')
+        delta = instance.offset - expected_offset
+        try:
+            offset = self.cache.incr(key, delta)
+        except ValueError:
+            return None
+        if offset != instance.offset:
+            self.cache.decr(key, delta)
+            return False
+        return True
+
+    def claim(self, instance):
+        """
+        Claim the right to write the next chunk of an upload, across all
+        processes sharing the cache. Returns `False` if another request
+        holds the claim.
+        """
+        return self.cache.add(
+            self._key(instance._meta.model, instance.pk, 'claim'),
+            True,
+            self.claim_timeout,
+        )
+
+    def release(self, instance):
+        self.cache.delete(self._key(instance._meta.model, instance.pk, 'claim'))
+
+    def get_tap_state(self, instance):
+        return self.cache.get(self._key(instance._meta.model, instance.pk, 'taps'))
+
+    def set_tap_state(self, instance, value):
+        self.cache.set(
+            self._key(instance._meta.model, instance.pk, 'taps'),
+            value,
+            self.timeout,
+        )
+
+    def has_access(self, instance, requester):
+        """
+        Whether `requester` was granted access to an upload.
+        """
+        access = self.cache.get(self._key(instance._meta.model, instance.pk, 'access'))
+        return access is not None and requester in access
+
+    def grant_access(self, instance, requester):
+        """
+        Remember that `requester` may access an upload. Concurrent grants
+        may overwrite each other, which only costs another check.
+        """
+        key = self._key(instance._meta.model, instance.pk, 'access')
+        access = self.cache.get(key) or frozenset()
+        if requester not in access:
+            self.cache.set(key, access | {requester}, self.timeout)
+
+    def should_flush(self, instance):
+        """
+        Returns `True` at most once per flush interval for each upload,
+        across all processes sharing the cache.
+        """
+        return self.cache.add(
+            self._key(instance._meta.model, instance.pk, 'flush'),
+            True,
+            _settings.STATE_FLUSH_INTERVAL.total_seconds(),
+        )
+
+    def delete(self, instance):
+        self.delete_many(instance._meta.model, [instance.pk])
+
+    def delete_many(self, model, pks):
+        self.cache.delete_many([
+            self._key(model, pk, suffix)
+            for pk in pks
+            for suffix in ('record', 'offset', 'flush', 'claim', 'taps', 'access')
+        ])
+
+
+def get_state_cache():
+    """
+    Get the configured `UploadStateCache`, or `None` if disabled.
+    """
+    if not _settings.STATE_CACHE:
+        return None
+    return UploadStateCache(_settings.STATE_CACHE)
@@ -0,0 +1,190 @@
+"""
+Streaming taps over the data of uploads.
+
+A tap sees the bytes of an upload in order as they are written, and computes
+a result from them (e.g. a secondary hash or the detected file type) or
+rejects the upload mid-transfer by raising `TapError`. Taps are configured
+with `DRF_CHUNKED_UPLOAD_TAPS` (or by overriding
+`AbstractChunkedUpload.get_taps`), and their results are available from
+`chunked_upload.tap_results`, e.g. in `on_completion`, without rereading the
+file.
+
+Like incremental checksums, tap state lives in a bounded per-process registry
+keyed by upload id, and is also saved with the upload's offset if every tap
+can serialize its state (`Tap.dump`). A worker without the state in its
+registry restores the saved one, then catches up by reading only the bytes
+the state has not seen from the file.
+"""
+import hashlib
+import json
+import threading
+
+from django.utils.module_loading import import_string
+
+from drf_chunked_upload import settings as _settings
+from drf_chunked_upload.checksums import HashStateRegistry
+
+
+class Tap:
+    """
+    Base class of taps. Taps hold no state of their own: `start` returns
+    the state of a new upload, which `update` is given back with each piece
+    of data in order and returns updated.
+    """
+
+    @property
+    def name(self):
+        return type(self).__name__
+
+    def start(self):
+        return None
+
+    def update(self, state, data):
+        """
+        Process the next `data` of the upload. Raise `TapError` to reject
+        the upload.
+        """
+        return state
+
+    def result(self, state):
+        return state
+
+    def dump(self, state):
+        """
+        Serialize `state` to a JSON value. Raise `TypeError` if it cannot
+        be, so the state of the upload is not saved.
+        """
+        return state
+
+    def load(self, value):
+        """
+        Restore a state serialized by `dump`. Raise `ValueError` if it is
+        not usable.
+        """
+        return value
+
+
+class HashTap(Tap):
+    """
+    Computes a secondary checksum of uploads, of `checksum_type`.
+    """
+    checksum_type = 'sha256'
+
+    def __init__(self, checksum_type=None):
+        if checksum_type is not None:
+            self.checksum_type = checksum_type
+
+    @property
+    def name(self):
+        return self.checksum_type
+
+    def start(self):
+        return hashlib.new(self.checksum_type)
+
+    def update(self, state, data):
+        state.update(data)
+        return state
+
+    def result(self, state):
+        return state.hexdigest()
+
+    def dump(self, state):
+        # hashlib objects cannot be serialized
+        raise TypeError('{} hash state cannot be serialized'.format(self.checksum_type))
+
+
+class TapState:
+    """
+    The state of each tap over the first `offset` bytes of an upload.
+    """
+
+    def __init__(self, taps, offset=0):
+        self.taps = taps
+        self.states = {tap.name: tap.start() for tap in taps}
+        self.offset = offset
+        self.lock = threading.RLock()
+
+    def update(self, data):
+        for tap in self.taps:
+            self.states[tap.name] = tap.update(self.states[tap.name], data)
+        self.offset += len(data)
+
+    def results(self):
+        return {tap.name: tap.result(self.states[tap.name]) for tap in self.taps}
+
+    def dump(self):
+        """
+        Serialize the state as JSON, or return `None` if a tap cannot
+        serialize its state.
+        """
+        try:
+            return json.dumps({
+                'offset': self.offset,
+                'states': {tap.name: tap.dump(self.states[tap.name]) for tap in self.taps},
+            })
+        except TypeError:
+            return None
+
+    @classmethod
+    def load(cls, value, taps):
+        """
+        Restore a state serialized by `dump`, or return `None` if there is
+        none or it is not usable for `taps`.
+        """
+        try:
+            value = json.loads(value)
+            states = value['states']
+            if sorted(states) != sorted(tap.name for tap in taps):
+                return None
+            state = cls(taps, int(value['offset']))
+            state.states = {tap.name: tap.load(states[tap.name]) for tap in taps}
+            return state
+        except (ValueError, KeyError, TypeError):
+            return None
+
+
+class TapStateRegistry(HashStateRegistry):
+    """
+    LRU-bounded mapping of upload id to `TapState`, of the same size as
+    the checksum state registry.
+    """
+
+    def get(self, key, taps):
+        max_entries = self.max_entries
+        if max_entries is None:
+            max_entries = _settings.CHECKSUM_STATE_CACHE_SIZE
+        if not max_entries:
+            return None
+        with self._lock:
+            state = self._states.pop(key, None)
+            if state is None or [tap.name for tap in state.taps] != [tap.name for tap in taps]:
+                state = TapState(taps)
+            self._states[key] = state
+            while len(self._states) > max_entries:
+                self._states.popitem(last=False)
+            return state
+
+
+tap_states = TapStateRegistry()
+
+# resolved taps, keyed by the setting value
+_taps = {}
+
+
+def get_taps():
+    """
+    Get instances of the taps in `DRF_CHUNKED_UPLOAD_TAPS`. Classes and
+    dotted paths are resolved once.
+    """
+    setting = tuple(_settings.TAPS)
+    taps = _taps.get(setting)
+    if taps is None:
+        taps = []
+        for tap in setting:
+            if isinstance(tap, str):
+                tap = import_string(tap)
+            if isinstance(tap, type):
+                tap = tap()
+            taps.append(tap)
+        _taps[setting] = taps
+    return taps
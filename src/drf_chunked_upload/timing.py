@@ -0,0 +1,78 @@
+"""
+Phase-level timing of upload requests.
+
+When a view has `timing` enabled, the time spent in each phase of a request
+(parsing the chunk, looking up the upload, writing, hashing, saving,
+serializing the response...) is collected by a `PhaseTimer` and reported in
+a `Server-Timing` response header, the `upload_timed` signal and the
+`DRF_CHUNKED_UPLOAD_TIMING_CALLBACK`. Code times a phase with `phase(name)`,
+which does nothing unless a timer is active for the current request.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.utils.module_loading import import_string
+
+from drf_chunked_upload import settings as _settings
+
+
+_timer = ContextVar('drf_chunked_upload_timer', default=None)
+
+
+class PhaseTimer:
+    """
+    Accumulates the seconds spent in each named phase, in the order the
+    phases first finished.
+    """
+
+    def __init__(self):
+        self.durations = {}
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0) + seconds
+
+    def server_timing(self):
+        return ', '.join(
+            '{};dur={:.3f}'.format(name, seconds * 1000)
+            for name, seconds in self.durations.items()
+        )
+
+
+@contextmanager
+def timing(timer):
+    """
+    Collect the phases timed within the block into `timer`.
+    """
+    token = _timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _timer.reset(token)
+
+
+@contextmanager
+def phase(name):
+    """
+    Time the block as phase `name` of the current request, if timed.
+    """
+    timer = _timer.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+def get_timing_callback():
+    """
+    Get the callable configured in `DRF_CHUNKED_UPLOAD_TIMING_CALLBACK`,
+    importing it if given as a dotted path.
+    """
+    callback = _settings.TIMING_CALLBACK
+    if isinstance(callback, str):
+        callback = import_string(callback)
+    return callback
@@ -1,18 +1,41 @@
+import errno
+import hashlib
 import re
+import time
+from contextlib import nullcontext
+from functools import partial
 
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
 from rest_framework import status
-
+from rest_framework.fields import DateTimeField
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 
+from drf_chunked_upload import durability
+from drf_chunked_upload import metrics
 from drf_chunked_upload import settings as _settings
+from drf_chunked_upload.admission import Admission, get_admission_controller, get_client_ident
+from drf_chunked_upload.completion import finalize_upload, get_completion_executor
 from drf_chunked_upload.models import ChunkedUpload
+from drf_chunked_upload.pagination import ChunkedUploadCursorPagination
 from drf_chunked_upload.serializers import ChunkedUploadSerializer
-from drf_chunked_upload.exceptions import ChunkedUploadError
+from drf_chunked_upload.checksums import DigestingChunk
+from drf_chunked_upload.chunkstore import get_chunk_store, get_owner
+from drf_chunked_upload.exceptions import ChunkChecksumError, ChunkedUploadError, TapError
+from drf_chunked_upload.parsers import DECODERS, ChunkParser, DecodedChunk
+from drf_chunked_upload.signals import upload_timed
+from drf_chunked_upload.state import get_state_cache
+from drf_chunked_upload.timing import PhaseTimer, get_timing_callback, phase, timing
 
 
 class ChunkedUploadBaseView(GenericAPIView):
@@ -24,6 +47,9 @@ class ChunkedUploadBaseView(GenericAPIView):
     model = ChunkedUpload
     user_field_name = 'user'  # the field name that point towards the AUTH_USER in ChunkedUpload class or its subclasses
     serializer_class = ChunkedUploadSerializer
+    # Time each phase of a request, reporting it in a Server-Timing header,
+    # the `upload_timed` signal and `DRF_CHUNKED_UPLOAD_TIMING_CALLBACK`
+    timing = _settings.TIMING
 
     @property
     def response_serializer_class(self):
@@ -44,6 +70,100 @@ class ChunkedUploadBaseView(GenericAPIView):
 
         return queryset
 
+    def get_state_cache(self):
+        return get_state_cache()
+
+    def get_requester(self):
+        """
+        Identify who makes the request, to remember which uploads
+        `get_queryset` gave them access to. Override along with
+        `get_queryset` if it filters on more than the user.
+        """
+        user = getattr(self.request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        return user.pk
+
+    def get_access_key(self):
+        """
+        Key access granted by this view's `get_queryset` to the requester.
+        """
+        view = type(self)
+        return '{}.{}:{}'.format(view.__module__, view.__qualname__, self.get_requester())
+
+    def has_upload_access(self, chunked_upload):
+        """
+        Check that the current requester may access an upload loaded from
+        the state cache: through `get_queryset` the first time, then from
+        the access remembered in the state cache.
+        """
+        state_cache = self.get_state_cache()
+        requester = self.get_access_key()
+        if state_cache.has_access(chunked_upload, requester):
+            return True
+        if not self.get_queryset().filter(pk=chunked_upload.pk).exists():
+            return False
+        state_cache.grant_access(chunked_upload, requester)
+        return True
+
+    def get_chunked_upload(self, pk):
+        """
+        Get an upload by id, from the state cache if enabled, otherwise
+        from the database.
+        """
+        with phase('lookup'):
+            return self._get_chunked_upload(pk)
+
+    def _get_chunked_upload(self, pk):
+        state_cache = self.get_state_cache()
+        if state_cache is None:
+            return get_object_or_404(self.get_queryset(), pk=pk)
+
+        chunked_upload = state_cache.get(self.model, pk)
+        if chunked_upload is not None:
+            if not self.has_upload_access(chunked_upload):
+                raise Http404
+            return chunked_upload
+
+        chunked_upload = get_object_or_404(self.get_queryset(), pk=pk)
+        if chunked_upload.status == chunked_upload.UPLOADING:
+            chunked_upload.recover_offset()
+            state_cache.set(chunked_upload)
+            state_cache.grant_access(chunked_upload, self.get_access_key())
+        return chunked_upload
+
+    def get_object(self):
+        if self.get_state_cache() is None:
+            return super().get_object()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        obj = self.get_chunked_upload(self.kwargs[lookup_url_kwarg])
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.timing:
+            return super().dispatch(request, *args, **kwargs)
+        timer = PhaseTimer()
+        with timing(timer), phase('total'):
+            response = super().dispatch(request, *args, **kwargs)
+        self.report_timings(self.request, response, timer)
+        return response
+
+    def report_timings(self, request, response, timer):
+        """
+        Report the phases timed during a request.
+        """
+        response['Server-Timing'] = timer.server_timing()
+        upload_timed.send(
+            sender=type(self),
+            request=request,
+            response=response,
+            timings=timer.durations,
+        )
+        callback = get_timing_callback()
+        if callback is not None:
+            callback(request, timer.durations)
+
     def _post(self, request, pk=None, *args, **kwargs):
         raise NotImplementedError
 
@@ -57,10 +177,13 @@ class ChunkedUploadBaseView(GenericAPIView):
         """
         Handle PUT requests.
         """
+        started = time.perf_counter()
         try:
             return self._put(request, pk=pk, *args, **kwargs)
         except ChunkedUploadError as error:
-            return Response(error.data, status=error.status_code)
+            return Response(error.data, status=error.status_code, headers=error.headers)
+        finally:
+            metrics.chunk_seconds.observe(time.perf_counter() - started)
 
     def post(self, request, pk=None, *args, **kwargs):
         """
@@ -69,7 +192,8 @@ class ChunkedUploadBaseView(GenericAPIView):
         try:
             return self._post(request, pk=pk, *args, **kwargs)
         except ChunkedUploadError as error:
-            return Response(error.data, status=error.status_code)
+            metrics.completion_failures.inc(reason=error.code)
+            return Response(error.data, status=error.status_code, headers=error.headers)
 
     def get(self, request, pk=None, *args, **kwargs):
         """
@@ -78,7 +202,7 @@ class ChunkedUploadBaseView(GenericAPIView):
         try:
             return self._get(request, pk=pk, *args, **kwargs)
         except ChunkedUploadError as error:
-            return Response(error.data, status=error.status_code)
+            return Response(error.data, status=error.status_code, headers=error.headers)
 
 
 class ChunkedUploadView(ListModelMixin, RetrieveModelMixin,
@@ -97,15 +221,57 @@ class ChunkedUploadView(ListModelMixin, RetrieveModelMixin,
     do_checksum_check = True
 
     field_name = 'file'
+    # Optional header with the checksum of each chunk, and the field used to
+    # complete an upload with the list of chunk checksums instead of the
+    # checksum of the whole file
+    chunk_checksum_header = 'HTTP_X_CHUNK_CHECKSUM'
+    chunk_checksums_field = 'chunk_checksums'
+    # Optional header with the sha256 digest of a chunk the user stored
+    # before, sent with no body to use it instead of uploading it again
+    stored_chunk_header = 'HTTP_X_CHUNK_STORED'
+    # Optional header with the checksum of the whole file, sent with the
+    # first chunk to complete the upload at once if the file is known
+    upload_checksum_header = 'HTTP_X_UPLOAD_CHECKSUM'
+    checksum_pattern = re.compile(r'^[0-9a-f]+$')
+    # ChunkParser accepts raw `application/octet-stream` chunk bodies
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [ChunkParser]
     content_range_pattern = re.compile(
         r'^bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+)$'
     )
     max_bytes = _settings.MAX_BYTES  # Max amount of data that can be uploaded
+    # Accept chunks in parallel and in any order, tracking received ranges
+    allow_out_of_order = _settings.ALLOW_OUT_OF_ORDER
+    # Verify and complete uploads in the background, responding 202. The
+    # view class must be importable and configured by class attributes.
+    async_completion = _settings.ASYNC_COMPLETION
+    # Paginate the list of uploads with a cursor instead of the default
+    # pagination, so deep pages cost the same as the first
+    pagination_class = (ChunkedUploadCursorPagination if _settings.CURSOR_PAGINATION
+                        else api_settings.DEFAULT_PAGINATION_CLASS)
+    # Complete new uploads sent with `upload_checksum_header` from a complete
+    # upload of the same file, if the user can access one
+    instant_completion = _settings.INSTANT_COMPLETION
+    # Response to chunks of existing uploads: 'full' (the serializer),
+    # 'minimal' (id, offset and expiry) or 'headers' (the same in a 204)
+    chunk_response = _settings.CHUNK_RESPONSE
+    # Content-Encodings accepted for raw chunk bodies. Offsets, sizes and
+    # checksums are those of the decompressed chunk
+    content_encodings = _settings.CONTENT_ENCODINGS
+    # Reserve the full size of new uploads on disk, rejecting them at once
+    # if the volume has no room
+    preallocate = _settings.PREALLOCATE
+
+    def get_state_cache(self):
+        # out of order uploads track received ranges in the database
+        if self.allow_out_of_order:
+            return None
+        return super().get_state_cache()
 
     def on_completion(self, chunked_upload, request) -> Response:
         """
         Validation or operations to run when upload is complete.
-        Returns an HTTP response.
+        Returns an HTTP response. When completing in the background,
+        `request` is `None` and the response is discarded.
         """
         return Response(
             self.response_serializer_class(
@@ -130,36 +296,43 @@ class ChunkedUploadView(ListModelMixin, RetrieveModelMixin,
         Check if chunked upload has already expired or is already complete.
         """
         if chunked_upload.expired:
-            raise ChunkedUploadError(status=status.HTTP_410_GONE,
+            raise ChunkedUploadError(status=status.HTTP_410_GONE, code='expired',
                                      detail='Upload has expired')
         error_msg = 'Upload has already been marked as "%s"'
         if chunked_upload.status == chunked_upload.COMPLETE:
-            raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
+            raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST, code='complete',
                                      detail=error_msg % 'complete')
+        # a stale finalizing upload can be completed again
+        if chunked_upload.status == chunked_upload.FINALIZING and not chunked_upload.finalizing_stale:
+            raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST, code='finalizing',
+                                     detail=error_msg % 'finalizing')
 
-    def _put_chunk(self, request, pk=None, whole=False, *args, **kwargs):
-        try:
-            chunk = request.data[self.field_name]
-        except KeyError:
+    def get_content_range(self, request):
+        """
+        Parse the Content-Range header into `(start, end, total)`.
+        """
+        content_range = request.META.get('HTTP_CONTENT_RANGE', '')
+        match = self.content_range_pattern.match(content_range)
+        if not match:
             raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
-                                     detail='No chunk file was submitted')
+                                     detail='Error in request headers')
 
-        if whole:
-            start = 0
-            total = chunk.size
-            end = total - 1
-        else:
-            content_range = request.META.get('HTTP_CONTENT_RANGE', '')
-            match = self.content_range_pattern.match(content_range)
-            if not match:
-                raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
-                                         detail='Error in request headers')
+        return (
+            int(match.group('start')),
+            int(match.group('end')),
+            int(match.group('total')),
+        )
 
-            start = int(match.group('start'))
-            end = int(match.group('end'))
-            total = int(match.group('total'))
+    def get_content_length(self, request):
+        try:
+            return int(request.META.get('CONTENT_LENGTH'))
+        except (TypeError, ValueError):
+            return None
 
-        chunk_size = end - start + 1
+    def range_check(self, request, end, total):
+        """
+        Verify the reported range is consistent and within `max_bytes`.
+        """
         max_bytes = self.get_max_bytes(request)
 
         if end > total:
@@ -174,69 +347,457 @@ class ChunkedUploadView(ListModelMixin, RetrieveModelMixin,
                 detail='Size of file exceeds the limit (%s bytes)' % max_bytes
             )
 
-        if chunk.size != chunk_size:
+    def content_length_check(self, request, chunk_size):
+        """
+        Verify the request body can hold the reported chunk. A raw chunk
+        body must be exactly the chunk; a multipart body must be at least
+        as large as it.
+        """
+        content_length = self.get_content_length(request)
+        if content_length is None:
+            return
+
+        if request.content_type.startswith(ChunkParser.media_type):
+            mismatch = content_length != chunk_size
+        else:
+            mismatch = content_length < chunk_size
+
+        if mismatch:
             raise ChunkedUploadError(
                 status=status.HTTP_400_BAD_REQUEST,
-                detail="File size doesn't match headers: file size is {} but {} reported".format(
-                    chunk.size,
+                detail="Request body doesn't match headers: body is {} bytes but chunk is {}".format(
+                    content_length,
                     chunk_size,
                 ),
             )
 
-        if pk:
-            upload_id = pk
-            chunked_upload = get_object_or_404(self.get_queryset(),
-                                               pk=upload_id)
-            self.is_valid_chunked_upload(chunked_upload)
-            if chunked_upload.offset != start:
+    def offset_check(self, chunked_upload, start):
+        """
+        Verify the chunk starts where the upload left off. When accepting
+        chunks out of order, only a new upload has to start at byte 0. In
+        the 'interval' durability mode, a chunk can also start anywhere from
+        `synced_offset`, for a client resuming after a crash.
+        """
+        if chunked_upload is None:
+            if not self.allow_out_of_order:
+                return
+            expected_offset = 0
+        elif self.allow_out_of_order:
+            return
+        else:
+            expected_offset = chunked_upload.offset
+            if (_settings.DURABILITY == durability.INTERVAL
+                    and chunked_upload.synced_offset <= start < expected_offset):
+                return
+
+        if expected_offset != start:
+            raise ChunkedUploadError(
+                 status=status.HTTP_400_BAD_REQUEST,
+                 detail='Offsets do not match',
+                 expected_offset=expected_offset,
+                 provided_offset=start,
+            )
+
+    def get_user_kwargs(self, request):
+        """
+        Get the user to assign to a new upload.
+        """
+        kwargs = {}
+        if hasattr(self.model, self.user_field_name):
+            if hasattr(request, 'user') and request.user.is_authenticated:
+                kwargs[self.user_field_name] = request.user
+            elif self.model._meta.get_field(self.user_field_name).null:
+                kwargs[self.user_field_name] = None
+            else:
                 raise ChunkedUploadError(
-                     status=status.HTTP_400_BAD_REQUEST,
-                     detail='Offsets do not match',
-                     expected_offset=chunked_upload.offset,
-                     provided_offset=start,
+                    status=status.HTTP_400_BAD_REQUEST,
+                    detail="Upload requires user authentication but user cannot be determined",
                 )
+        return kwargs
+
+    def _put_chunk(self, request, pk=None, whole=False, *args, **kwargs):
+        # Run every check possible from the headers and the database before
+        # the request body is read, so bad chunks are rejected cheaply.
+        start, chunk_size = self.chunk_headers_check(request, whole)
+        with self.admit_chunk(request, pk, chunk_size):
+            if not (pk or whole) and self.instant_completion:
+                response = self.complete_instantly(request)
+                if response is not None:
+                    return response
+            chunked_upload = None
+            if pk:
+                chunked_upload = self.get_chunked_upload(pk)
+            return self.save_chunk(request, chunked_upload, start, chunk_size)
+
+    def admit_chunk(self, request, pk, chunk_size):
+        """
+        Admit the chunk under the configured admission limits, raising
+        `AdmissionError` if over one. Returns an `Admission` to release
+        once the chunk is written.
+        """
+        controller = get_admission_controller()
+        if controller is None:
+            return Admission()
+        if chunk_size is None:
+            chunk_size = self.get_content_length(request)
+        return controller.admit(
+            get_client_ident(request),
+            chunk_size,
+            model=None if pk else self.model,
+        )
+
+    def chunk_headers_check(self, request, whole=False):
+        """
+        Verify the chunk headers, returning the start and size of the
+        chunk, or `(None, None)` when uploading a whole file.
+        """
+        encoding = self.get_content_encoding(request)
+        if whole:
+            if encoding is not None:
+                # the decompressed size must be known from Content-Range
+                raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
+                                         detail='Error in request headers')
+            return None, None
+        start, end, total = self.get_content_range(request)
+        chunk_size = end - start + 1
+        self.range_check(request, end, total)
+        if not (self.is_stored_chunk(request) or encoding is not None):
+            self.content_length_check(request, chunk_size)
+        return start, chunk_size
 
-            chunked_upload.append_chunk(chunk, chunk_size=chunk_size)
+    def get_content_encoding(self, request):
+        """
+        Get the Content-Encoding of the chunk, or `None` if not compressed.
+        Only raw chunk bodies can be compressed.
+        """
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding in ('', 'identity'):
+            return None
+        if (encoding not in self.content_encodings
+                or encoding not in DECODERS
+                or not request.content_type.startswith(ChunkParser.media_type)):
+            raise ChunkedUploadError(status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                     detail='Unsupported Content-Encoding')
+        return encoding
+
+    def save_chunk(self, request, chunked_upload, start, chunk_size):
+        """
+        Write the chunk in the request to `chunked_upload`, or create a new
+        upload with it if `None`. A `start` of `None` means a whole file.
+        """
+        whole = start is None
+        if chunked_upload is not None:
+            self.is_valid_chunked_upload(chunked_upload)
         else:
-            kwargs = {'offset': chunk.size}
+            kwargs = self.get_user_kwargs(request)
 
-            if hasattr(self.model, self.user_field_name):
-                if hasattr(request, 'user') and request.user.is_authenticated:
-                    kwargs[self.user_field_name] = request.user
-                elif self.model._meta.get_field(self.user_field_name).null:
-                    kwargs[self.user_field_name] = None
-                else:
-                    raise ChunkedUploadError(
-                        status=status.HTTP_400_BAD_REQUEST,
-                        detail="Upload requires user authentication but user cannot be determined",
-                    )
+        if not whole:
+            self.offset_check(chunked_upload, start)
+
+        chunk_checksum = self.get_chunk_checksum(request)
+        stored = self.get_stored_chunk_digest(request)
 
-            chunked_upload = self.serializer_class(data=request.data)
-            if not chunked_upload.is_valid():
+        if stored:
+            chunk = self.get_stored_chunk(request, stored)
+        else:
+            try:
+                with phase('parse'):
+                    chunk = request.data[self.field_name]
+            except KeyError:
                 raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
-                                         detail=chunked_upload.errors)
+                                         detail='No chunk file was submitted')
+            encoding = self.get_content_encoding(request)
+            if encoding is not None:
+                chunk = DecodedChunk(chunk, encoding, chunk_size)
 
-            # chunked_upload is currently a serializer;
-            # save returns model instance
-            chunked_upload = chunked_upload.save(**kwargs)
+        if whole:
+            start = 0
+            total = chunk.size
+            end = total - 1
+            chunk_size = end - start + 1
+            self.range_check(request, end, total)
 
+        if chunk.size != chunk_size:
+            raise ChunkedUploadError(
+                status=status.HTTP_400_BAD_REQUEST,
+                detail="File size doesn't match headers: file size is {} but {} reported".format(
+                    chunk.size,
+                    chunk_size,
+                ),
+            )
+
+        # a stored chunk is closed once written
+        with chunk if stored else nullcontext():
+            if chunked_upload is not None:
+                if self.allow_out_of_order:
+                    chunked_upload.write_chunk(chunk, start, chunk_size=chunk_size,
+                                               checksum=chunk_checksum, stored=stored)
+                else:
+                    if not whole and start < chunked_upload.offset:
+                        # resuming from synced_offset
+                        chunked_upload.rewind(start)
+                    chunked_upload.append_chunk(chunk, chunk_size=chunk_size,
+                                                checksum=chunk_checksum, stored=stored)
+            else:
+                if stored:
+                    # created empty; append_chunk copies the stored chunk in
+                    kwargs['offset'] = 0
+                    kwargs[self.field_name] = ContentFile(b'', name=chunk.name)
+                else:
+                    kwargs['offset'] = chunk.size
+                    # the decompressed chunk, not the request body
+                    kwargs[self.field_name] = chunk
+                    if chunk_checksum is not None:
+                        chunk = kwargs[self.field_name] = DigestingChunk(chunk)
+
+                chunked_upload = self.serializer_class(data=request.data)
+                if not chunked_upload.is_valid():
+                    raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
+                                             detail=chunked_upload.errors)
+
+                # chunked_upload is currently a serializer;
+                # save returns model instance
+                with phase('write'):
+                    chunked_upload = chunked_upload.save(**kwargs)
+
+                if stored:
+                    try:
+                        chunked_upload.append_chunk(chunk, chunk_size=chunk_size,
+                                                    checksum=chunk_checksum, stored=stored)
+                    except (ChunkChecksumError, TapError):
+                        chunked_upload.delete()
+                        raise
+                else:
+                    if chunk_checksum is not None:
+                        if chunk.hexdigest() != chunk_checksum:
+                            chunked_upload.delete()
+                            raise ChunkChecksumError()
+                        chunked_upload.add_chunk_checksum(0, chunk_size - 1, chunk_checksum)
+
+                    # the first chunk was written by the storage, not append_chunk
+                    try:
+                        chunked_upload.feed_taps()
+                    except TapError:
+                        chunked_upload.delete()
+                        raise
+
+                if self.preallocate and not whole:
+                    _, _, total = self.get_content_range(request)
+                    self.preallocate_upload(chunked_upload, total)
+
+        if chunk_checksum is not None and not stored:
+            self.store_chunk(request, chunked_upload, start, chunk_size, chunk_checksum)
+
+        metrics.bytes_received.inc(chunk_size)
+        metrics.chunks_received.inc()
         return chunked_upload
 
+    def preallocate_upload(self, chunked_upload, total):
+        """
+        Reserve space for a new upload to reach `total` bytes, deleting it
+        if there is not enough.
+        """
+        try:
+            with phase('preallocate'):
+                chunked_upload.preallocate(total)
+        except OSError as error:
+            if error.errno not in (errno.ENOSPC, errno.EDQUOT):
+                raise
+            chunked_upload.delete()
+            raise ChunkedUploadError(status=status.HTTP_507_INSUFFICIENT_STORAGE,
+                                     detail='Not enough storage space for upload')
+
+    def is_stored_chunk(self, request):
+        return bool(request.META.get(self.stored_chunk_header))
+
+    def get_stored_chunk_digest(self, request):
+        """
+        Get the sha256 digest of the stored chunk sent by reference in the
+        `stored_chunk_header`, if any.
+        """
+        if not self.is_stored_chunk(request):
+            return None
+        digest = request.META[self.stored_chunk_header].strip().lower()
+        if not self.checksum_pattern.match(digest) or len(digest) != 64:
+            raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
+                                     detail='Error in request headers')
+        return digest
+
+    def get_stored_chunk(self, request, digest):
+        """
+        Open the chunk with sha256 `digest` the user stored before.
+        """
+        chunk_store = get_chunk_store()
+        owner = get_owner(getattr(request, 'user', None))
+        if chunk_store is None or owner is None:
+            raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
+                                     detail='Error in request headers')
+        chunk = chunk_store.open(owner, digest)
+        if chunk is None:
+            raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
+                                     detail='Chunk is not stored')
+        return chunk
+
+    def store_chunk(self, request, chunked_upload, start, chunk_size, chunk_checksum):
+        """
+        Copy a verified chunk into the user's chunk store, if enabled and
+        the upload storage has local paths.
+        """
+        chunk_store = get_chunk_store()
+        owner = get_owner(getattr(request, 'user', None))
+        if chunk_store is None or owner is None:
+            return
+        try:
+            path = chunked_upload.file.path
+        except NotImplementedError:
+            return
+        # the verified checksum names the chunk if it is of the store's type
+        digest = chunk_checksum if _settings.CHECKSUM_TYPE == chunk_store.checksum_type else None
+        chunk_store.add(owner, path, start or 0, chunk_size, digest)
+
+    def get_chunk_checksum(self, request):
+        """
+        Get the checksum of the chunk (of type `CHECKSUM_TYPE`) sent in the
+        `chunk_checksum_header`, if any.
+        """
+        return self.get_checksum_header(request, self.chunk_checksum_header)
+
+    def get_checksum_header(self, request, header):
+        checksum = request.META.get(header)
+        if checksum is None:
+            return None
+        checksum = checksum.strip().lower()
+        digest_size = hashlib.new(_settings.CHECKSUM_TYPE).digest_size
+        if not self.checksum_pattern.match(checksum) or len(checksum) != digest_size * 2:
+            raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
+                                     detail='Error in request headers')
+        return checksum
+
+    def complete_instantly(self, request):
+        """
+        Complete a new upload sent with the checksum of the whole file in
+        `upload_checksum_header` from a complete upload of the same file
+        (checksum and size) that the user can access, without reading the
+        request body. Returns the completion response, or `None` if no such
+        upload exists or the file name is only sent in the body.
+        """
+        checksum = self.get_checksum_header(request, self.upload_checksum_header)
+        if checksum is None:
+            return None
+        filename = self.get_header_filename(request)
+        if filename is None:
+            return None
+        _, _, total = self.get_content_range(request)
+        source = self.get_queryset().filter(
+            status=self.model.COMPLETE,
+            digest='{}:{}'.format(_settings.CHECKSUM_TYPE, checksum),
+            offset=total,
+        ).exclude(file=None).exclude(file='').first()
+        if source is None or not source.file.storage.exists(source.file.name):
+            return None
+
+        kwargs = self.get_user_kwargs(request)
+        # the chunk sent with the request is not needed
+        kwargs[self.field_name] = None
+        kwargs['offset'] = total
+        chunked_upload = self.serializer_class(data={'filename': filename})
+        if not chunked_upload.is_valid():
+            raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
+                                     detail=chunked_upload.errors)
+        chunked_upload = chunked_upload.save(**kwargs)
+        with phase('write'):
+            chunked_upload.link_file(source)
+        chunked_upload._checksum = checksum
+        chunked_upload.completed()
+
+        with phase('on_completion'):
+            return self.on_completion(chunked_upload, request)
+
+    def get_header_filename(self, request):
+        """
+        Get the file name of a new upload from the `filename` query
+        parameter or a `Content-Disposition` header, without reading the
+        request body. Returns `None` if neither is sent.
+        """
+        filename = request.query_params.get('filename')
+        if filename:
+            return filename
+        return ChunkParser().get_filename(None, None, {'request': request, 'kwargs': {}})
+
     def _put(self, request, pk=None, *args, **kwargs):
         chunked_upload = self._put_chunk(request, pk=pk, *args, **kwargs)
-        return Response(
-            self.response_serializer_class(chunked_upload,
-                                           context={'request': request}).data,
-            status=status.HTTP_200_OK
-        )
+        if isinstance(chunked_upload, Response):
+            # completed instantly
+            return chunked_upload
+        return self.put_response(request, chunked_upload, created=not pk)
+
+    def put_response(self, request, chunked_upload, created=False) -> Response:
+        if not created and self.chunk_response != 'full':
+            return self.chunk_ack(chunked_upload)
+        with phase('serialize'):
+            data = self.response_serializer_class(chunked_upload,
+                                                  context={'request': request}).data
+        return Response(data, status=status.HTTP_200_OK)
+
+    def chunk_ack(self, chunked_upload) -> Response:
+        """
+        Acknowledge a chunk with only the upload's id, offset and expiry,
+        in the body or, for `chunk_response = 'headers'`, as headers of a
+        204 (No content) response.
+        """
+        with phase('serialize'):
+            ack = {
+                'id': str(chunked_upload.id),
+                'offset': chunked_upload.offset,
+                'expires_at': DateTimeField().to_representation(chunked_upload.expires_at),
+            }
+        if self.chunk_response == 'headers':
+            return Response(status=status.HTTP_204_NO_CONTENT, headers={
+                'Upload-Id': ack['id'],
+                'Upload-Offset': str(ack['offset']),
+                'Upload-Expires-At': ack['expires_at'],
+            })
+        return Response(ack, status=status.HTTP_200_OK)
 
     def checksum_check(self, chunked_upload, checksum):
         """
         Verify if checksum sent by client matches generated checksum.
         """
         if chunked_upload.checksum != checksum:
+            # hash the whole file before rejecting it, in case the
+            # incremental state is stale
+            if chunked_upload.rehash() != checksum:
+                raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
+                                         code='checksum_mismatch',
+                                         detail='checksum does not match')
+
+    def received_check(self, chunked_upload):
+        """
+        Verify there are no gaps in the byte ranges received so far.
+        """
+        missing = chunked_upload.get_missing_ranges()
+        if missing:
+            raise ChunkedUploadError(
+                status=status.HTTP_400_BAD_REQUEST,
+                code='missing_chunks',
+                detail='Upload is missing chunks',
+                missing_ranges=['{}-{}'.format(*r) for r in missing],
+            )
+
+    def chunk_checksums_check(self, chunked_upload, chunk_checksums):
+        """
+        Verify if the chunk checksums sent by client match the checksums
+        verified as each chunk was received.
+        """
+        # recorded in the database if the storage has no local paths
+        chunked_upload.refresh_from_db(fields=['chunk_checksums'])
+        if isinstance(chunk_checksums, str):
+            chunk_checksums = chunk_checksums.split(',')
+        chunk_checksums = [c.strip().lower() for c in chunk_checksums]
+        if chunked_upload.get_chunk_checksums() != chunk_checksums:
             raise ChunkedUploadError(status=status.HTTP_400_BAD_REQUEST,
-                                     detail='checksum does not match')
+                                     code='chunk_checksums_mismatch',
+                                     detail='chunk checksums do not match')
 
     def _post(self, request, pk=None, *args, **kwargs) -> Response:
         chunked_upload = None
@@ -247,25 +808,100 @@ class ChunkedUploadView(ListModelMixin, RetrieveModelMixin,
                                              whole=True, **kwargs)
             upload_id = chunked_upload.id
 
+        checksum, chunk_checksums = self.get_completion_checksums(request)
+
+        if not chunked_upload:
+            chunked_upload = self.get_chunked_upload(upload_id)
+
+        return self.complete(request, chunked_upload, checksum, chunk_checksums)
+
+    def get_completion_checksums(self, request):
+        """
+        Get the checksum of the whole file and the chunk checksums sent to
+        complete an upload, at least one of which is required.
+        """
         checksum = request.data.get(_settings.CHECKSUM_TYPE)
+        chunk_checksums = request.data.get(self.chunk_checksums_field)
 
-        if self.do_checksum_check and not checksum:
+        if self.do_checksum_check and not (checksum or chunk_checksums):
             raise ChunkedUploadError(
                 status=status.HTTP_400_BAD_REQUEST,
+                code='checksum_required',
                 detail="Checksum of type '{}' is required".format(_settings.CHECKSUM_TYPE),
             )
+        return checksum, chunk_checksums
 
-        if not chunked_upload:
-            chunked_upload = get_object_or_404(self.get_queryset(), pk=upload_id)
-
+    def complete(self, request, chunked_upload, checksum, chunk_checksums) -> Response:
+        """
+        Verify and complete an upload, or submit it to be completed in
+        the background.
+        """
         self.is_valid_chunked_upload(chunked_upload)
 
-        if self.do_checksum_check:
+        if self.allow_out_of_order:
+            self.received_check(chunked_upload)
+
+        if self.do_checksum_check and not checksum:
+            # every chunk was verified on arrival, no need to hash the file
+            self.chunk_checksums_check(chunked_upload, chunk_checksums)
+
+        if self.async_completion:
+            return self.finalize_async(chunked_upload, checksum, request)
+
+        if self.do_checksum_check and checksum:
             self.checksum_check(chunked_upload, checksum)
 
         chunked_upload.completed()
 
-        return self.on_completion(chunked_upload, request)
+        with phase('on_completion'):
+            return self.on_completion(chunked_upload, request)
+
+    def finalize_async(self, chunked_upload, checksum, request) -> Response:
+        """
+        Mark the upload as finalizing and submit its completion to the
+        completion executor. Clients poll the upload for the result.
+        """
+        if not chunked_upload.finalizing():
+            raise ChunkedUploadError(
+                status=status.HTTP_400_BAD_REQUEST,
+                code='finalizing',
+                detail='Upload has already been marked as "finalizing"',
+            )
+        data = self.response_serializer_class(
+            chunked_upload,
+            context={'request': request},
+        ).data
+        # the task must see the finalizing upload, e.g. with ATOMIC_REQUESTS
+        transaction.on_commit(partial(
+            get_completion_executor().submit,
+            finalize_upload,
+            '{}.{}'.format(type(self).__module__, type(self).__qualname__),
+            str(chunked_upload.id),
+            checksum,
+        ))
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    def finalize(self, chunked_upload, checksum):
+        """
+        Verify and complete an upload in the background. A failed check
+        returns the upload to uploading with the reason recorded in
+        `completion_error`. Does nothing if the upload is no longer
+        finalizing, or another task claimed it.
+        """
+        if not chunked_upload.start_finalizing():
+            return
+        try:
+            if self.do_checksum_check and checksum:
+                self.checksum_check(chunked_upload, checksum)
+            chunked_upload.completed()
+            self.on_completion(chunked_upload, None)
+        except ChunkedUploadError as error:
+            metrics.completion_failures.inc(reason=error.code)
+            chunked_upload.completion_failed(error.data.get('detail', ''))
+        except Exception as error:
+            metrics.completion_failures.inc(reason=type(error).__name__)
+            chunked_upload.completion_failed(error)
+            raise
 
     @method_decorator(cache_page(0))
     def _get(self, request, pk=None, *args, **kwargs):
@@ -273,3 +909,59 @@ class ChunkedUploadView(ListModelMixin, RetrieveModelMixin,
             return self.retrieve(request, pk=pk, *args, **kwargs)
         else:
             return self.list(request, *args, **kwargs)
+
+
+class ChunkedUploadMetricsView(APIView):
+    """
+    Exports the upload metrics of the current process in the Prometheus
+    text exposition format. Only admin users can read them by default.
+    """
+
+    # Has to be a ChunkedUpload subclass, used to count active uploads
+    model = ChunkedUpload
+    permission_classes = [IsAdminUser]
+    renderer_classes = [metrics.MetricsRenderer]
+
+    def get(self, request, *args, **kwargs):
+        if not self.model._meta.abstract:
+            metrics.active_uploads.set(
+                self.model.objects.filter(status=self.model.UPLOADING).count()
+            )
+        return Response(metrics.registry.expose())
+
+
+class ChunkStoreView(APIView):
+    """
+    Tells users which of their chunks are in the chunk store, so they only
+    upload the others. POST the sha256 digests of chunks in `checksums`;
+    the response lists the `stored` ones. Only chunks the user uploaded
+    are listed.
+    """
+
+    permission_classes = [IsAuthenticated]
+    checksums_field = 'checksums'
+    max_checksums = 10000
+    checksum_pattern = ChunkedUploadView.checksum_pattern
+
+    def post(self, request, *args, **kwargs):
+        if hasattr(request.data, 'getlist'):
+            checksums = request.data.getlist(self.checksums_field)
+            if len(checksums) == 1:
+                checksums = checksums[0].split(',')
+        else:
+            checksums = request.data.get(self.checksums_field, [])
+        checksums = [str(checksum).strip().lower() for checksum in checksums]
+
+        if len(checksums) > self.max_checksums or not all(
+            self.checksum_pattern.match(checksum) and len(checksum) == 64
+            for checksum in checksums
+        ):
+            return Response({'detail': 'Invalid checksums'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        chunk_store = get_chunk_store()
+        owner = get_owner(request.user)
+        stored = []
+        if chunk_store is not None and owner is not None:
+            stored = [checksum for checksum in checksums if chunk_store.exists(owner, checksum)]
+        return Response({'stored': stored}, status=status.HTTP_200_OK)
@@ -1,16 +1,22 @@
 import io
+import os
 import pytest
 import importlib
 import time
+import uuid
 
+from collections import Counter
 from pathlib import Path
 from datetime import timedelta
 
 from django.core import management
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import UploadedFile
+from django.utils import timezone
 
 from drf_chunked_upload import settings as _settings
+from drf_chunked_upload.checksums import HashState, hash_states
+from drf_chunked_upload.management.commands import delete_expired_uploads, reconcile_uploads
 from drf_chunked_upload.models import ChunkedUpload
 
 
@@ -97,6 +103,27 @@ def test_delete_expired_uploads(settings, user1_uploads, short_expirations):
                 assert False, f"Missing chunked upload records per exception '{e}'"
 
 
+@pytest.mark.django_db
+def test_delete_expired_stale_finalizing(settings, user1_uploads, short_expirations):
+    time.sleep(0.01)
+    fresh, stale = user1_uploads[:2]
+    ChunkedUpload.objects.filter(pk=fresh.pk).update(
+        status=ChunkedUpload.FINALIZING,
+        finalizing_at=timezone.now(),
+    )
+    # its background completion was lost
+    ChunkedUpload.objects.filter(pk=stale.pk).update(
+        status=ChunkedUpload.FINALIZING,
+        finalizing_at=timezone.now() - _settings.FINALIZING_TIMEOUT,
+    )
+    assert ChunkedUpload.objects.get(pk=stale.pk).expired
+    assert not ChunkedUpload.objects.get(pk=fresh.pk).expired
+    management.call_command('delete_expired_uploads', 'drf_chunked_upload.ChunkedUpload')
+    assert not ChunkedUpload.objects.filter(pk=stale.pk).exists()
+    assert ChunkedUpload.objects.filter(pk=fresh.pk).exists()
+    assert not os.path.exists(stale.file.path)
+
+
 @pytest.mark.django_db
 def test_delete_expired_uploads_two_stage(settings, user1_uploads, short_expirations):
     # sleep to make sure uploads expire
@@ -141,3 +168,181 @@ def test_delete_expired_uploads_two_stage(settings, user1_uploads, short_expirat
                 ChunkedUpload.objects.get(pk=ul.id)
             except ChunkedUpload.DoesNotExist as e:
                 assert False, f"Missing chunked upload records per exception '{e}'"
+
+
+@pytest.mark.django_db
+def test_delete_expired_uploads_batches(settings, user1_uploads, short_expirations, capsys):
+    time.sleep(0.01)
+    path = Path(settings.MEDIA_ROOT)
+    complete = [ul.file.name for ul in user1_uploads if ul.status == ChunkedUpload.COMPLETE]
+
+    management.call_command('delete_expired_uploads', '--batch-size', '2', '--workers', '2')
+
+    assert sorted([f.name for f in path.iterdir()]) == complete
+    assert ChunkedUpload.objects.count() == 1
+    output = capsys.readouterr().out
+    assert '3 incomplete uploads were deleted.' in output
+    assert '300 bytes reclaimed' in output
+
+
+@pytest.mark.django_db
+def test_delete_expired_uploads_batches_resumed(settings, user1_uploads, short_expirations):
+    time.sleep(0.01)
+    resumed, expired = user1_uploads[0], user1_uploads[1]
+    hash_states.put(expired.id, HashState('md5', offset=100))
+    command = delete_expired_uploads.Command()
+    get_expired_uploads = command.get_expired_uploads
+    calls = []
+
+    def resume_after_listing(model, delete_record=True):
+        calls.append(model)
+        if len(calls) == 2:
+            # completed after the batch was listed
+            model.objects.filter(pk=resumed.pk).update(status=ChunkedUpload.COMPLETE)
+        return get_expired_uploads(model, delete_record)
+
+    command.get_expired_uploads = resume_after_listing
+    count, reclaimed = command.process_batches(ChunkedUpload, batch_size=10)
+
+    assert count[ChunkedUpload.UPLOADING] == 2
+    assert reclaimed == 200
+    assert ChunkedUpload.objects.filter(pk=resumed.pk).exists()
+    assert os.path.exists(resumed.file.path)
+    assert not ChunkedUpload.objects.filter(pk=expired.pk).exists()
+    assert hash_states.get(expired.id, 'md5').offset == 0
+
+
+@pytest.mark.django_db
+def test_delete_expired_uploads_max_runtime(settings, user1_uploads, short_expirations):
+    time.sleep(0.01)
+    path = Path(settings.MEDIA_ROOT)
+
+    management.call_command('delete_expired_uploads', '--max-runtime', '0')
+
+    assert len(list(path.iterdir())) == len(user1_uploads)
+    assert ChunkedUpload.objects.count() == len(user1_uploads)
+
+
+@pytest.mark.django_db
+def test_reconcile_uploads(settings, user1_uploads, capsys):
+    path = Path(settings.MEDIA_ROOT)
+    orphan = path / '{}.part'.format(uuid.uuid4())
+    orphan.write_bytes(b'orphan')
+    (path / 'notes.txt').write_bytes(b'not an upload')
+
+    # offset disagrees with the file on disk
+    mismatched = user1_uploads[0]
+    ChunkedUpload.objects.filter(pk=mismatched.pk).update(offset=10)
+
+    # crashed between save() and the rename in completed()
+    misnamed = user1_uploads[1]
+    done_name = Path(misnamed.file.name).with_suffix('.done').name
+    ChunkedUpload.objects.filter(pk=misnamed.pk).update(
+        file=done_name,
+        status=ChunkedUpload.COMPLETE,
+    )
+
+    # record whose file is gone
+    missing = user1_uploads[2]
+    (path / missing.file.name).unlink()
+
+    management.call_command('reconcile_uploads', '--min-age', '0', '--check-records')
+    output = capsys.readouterr().out
+    assert 'Orphaned files: 1' in output
+    assert 'Misnamed files: 1' in output
+    assert 'Offset mismatches: 1' in output
+    assert 'Records missing their file: 2' in output
+    assert 'Unrecognized files: 1' in output
+    assert orphan.exists()
+
+    management.call_command('reconcile_uploads', '--min-age', '0', '--delete', '--fix')
+    assert not orphan.exists()
+    assert (path / done_name).exists()
+    assert ChunkedUpload.objects.get(pk=mismatched.pk).offset == 100
+
+    management.call_command('reconcile_uploads', '--min-age', '0')
+    output = capsys.readouterr().out
+    assert 'Orphaned files: 0' in output
+    assert 'Misnamed files: 0' in output
+    assert 'Offset mismatches: 0' in output
+
+
+@pytest.mark.django_db
+def test_reconcile_uploads_other_models(settings, user1_uploads):
+    # a file of a model sharing the location but left out is not orphaned
+    command = reconcile_uploads.Command()
+    command.delete, command.fix, command.count = True, True, Counter()
+    upload = user1_uploads[0]
+    ChunkedUpload.objects.filter(pk=upload.pk).update(offset=10)
+    path = Path(settings.MEDIA_ROOT) / upload.file.name
+    command.process_batch([(upload.id, upload.file.name, str(path), 100)], [ChunkedUpload], [])
+    assert path.exists()
+    assert not command.count
+    assert ChunkedUpload.objects.get(pk=upload.pk).offset == 10
+
+
+@pytest.mark.django_db
+def test_reconcile_uploads_shards(settings, user1_uploads, capsys):
+    path = Path(settings.MEDIA_ROOT)
+    for _ in range(10):
+        (path / '{}.part'.format(uuid.uuid4())).write_bytes(b'orphan')
+
+    orphaned = 0
+    for index in range(3):
+        management.call_command('reconcile_uploads', '--min-age', '0', '--shard', '{}/3'.format(index))
+        output = capsys.readouterr().out
+        orphaned += int(output.split('Orphaned files: ')[1].split()[0])
+    assert orphaned == 10
+
+
+@pytest.mark.django_db
+def test_hash_path_strategy(settings, user1_uploads, short_expirations, capsys):
+    # uploads created before the change keep their place
+    date_upload = user1_uploads[0]
+    settings.DRF_CHUNKED_UPLOAD_PATH_STRATEGY = 'hash'
+    importlib.reload(_settings)
+    path = Path(settings.MEDIA_ROOT)
+    f = UploadedFile(file=io.BytesIO(randbytes(100)), name='file')
+    hash_upload = ChunkedUpload(user=date_upload.user, file=f, filename='fakefile')
+    hash_upload.save()
+    parts = Path(hash_upload.file.name).parts
+    assert len(parts) == 3 and all(len(part) == 2 for part in parts[:2])
+    assert (path / hash_upload.file.name).exists()
+    for index in range(10):
+        orphan = path / '{:02x}'.format(index) / 'ff' / '{}.part'.format(uuid.uuid4())
+        orphan.parent.mkdir(parents=True, exist_ok=True)
+        orphan.write_bytes(b'orphan')
+
+    orphaned = mismatched = 0
+    for index in range(3):
+        management.call_command('reconcile_uploads', '--min-age', '0', '--shard', '{}/3'.format(index))
+        output = capsys.readouterr().out
+        orphaned += int(output.split('Orphaned files: ')[1].split()[0])
+        mismatched += int(output.split('Offset mismatches: ')[1].split()[0])
+    assert orphaned == 10
+    # the fixture uploads and the new one have offset 0 but 100 bytes
+    assert mismatched == 4
+
+    management.call_command('delete_expired_uploads')
+    assert not (path / date_upload.file.name).exists()
+    assert not (path / hash_upload.file.name).exists()
+
+
+@pytest.mark.django_db
+def test_delete_expired_uploads_prunes_chunk_store(settings, tmp_path, capsys):
+    store = tmp_path / 'chunks'
+    settings.DRF_CHUNKED_UPLOAD_CHUNK_STORE = str(store)
+    settings.DRF_CHUNKED_UPLOAD_CHUNK_STORE_EXPIRATION_DELTA = timedelta(hours=1)
+    importlib.reload(_settings)
+    (store / 'ab' / 'cd').mkdir(parents=True)
+    old = store / 'ab' / 'cd' / 'abcd0'
+    old.write_bytes(b'x' * 10)
+    os.utime(old, (time.time() - 7200,) * 2)
+    new = store / 'ab' / 'cd' / 'abcd1'
+    new.write_bytes(b'x' * 10)
+
+    management.call_command('delete_expired_uploads')
+
+    assert not old.exists()
+    assert new.exists()
+    assert '1 stored chunks were deleted (10 bytes).' in capsys.readouterr().out
@@ -1,20 +1,46 @@
+import asyncio
+import errno
+import gzip
 import io
 import hashlib
 import pytest
 import importlib
+import os
 import time
 
 from datetime import timedelta
 from random import shuffle
 
+import django
+import pytest_django
+from asgiref.sync import async_to_sync
 from django.core import management
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import isolate_apps
 from rest_framework import status
+from rest_framework.fields import DateTimeField
+from rest_framework.response import Response
 from rest_framework.test import APIRequestFactory
 from django.contrib.auth.models import User, AnonymousUser
+from django.core.files.uploadedfile import UploadedFile
+from django.utils import timezone
 
+from drf_chunked_upload import chunkstore
+from drf_chunked_upload import metrics
+from drf_chunked_upload import models
 from drf_chunked_upload import settings as _settings
-from drf_chunked_upload.views import ChunkedUploadView
+from drf_chunked_upload.admission import AdmissionController
+from drf_chunked_upload.checksums import hash_states
+from drf_chunked_upload.exceptions import OffsetConflictError, TapError
+from drf_chunked_upload.handles import FileHandlePool, file_handles
+from drf_chunked_upload.views import ChunkStoreView, ChunkedUploadMetricsView, ChunkedUploadView
 from drf_chunked_upload.models import ChunkedUpload
+from drf_chunked_upload.pagination import ChunkedUploadCursorPagination
+from drf_chunked_upload.parsers import ChunkParser
+from drf_chunked_upload.signals import upload_timed
+from drf_chunked_upload.state import get_state_cache
+from drf_chunked_upload.taps import HashTap, Tap, TapState, tap_states
 
 
 try:
@@ -345,3 +371,1357 @@ def test_list_uploads_no_user_not_restricted(view, user1_uploads, user2_uploads,
     upload_pks = sorted([str(ul.pk) for ul in uploads])
     resp_upload_pks = sorted([ul['id'] for ul in response.data])
     assert upload_pks == resp_upload_pks
+
+
+@pytest.mark.django_db
+def test_incremental_checksum(view, user1):
+    chunks = Chunks(chunk_size=1000, count=5)
+    pk = None
+    for index in range(chunks.count):
+        request = build_request(chunks, index)
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    state = hash_states.get(chunked_upload.id, _settings.CHECKSUM_TYPE)
+    assert state.offset == chunks.total_size
+    assert chunked_upload.checksum == chunks.md5
+
+
+@pytest.mark.django_db
+def test_incremental_checksum_lost_state(view, user1, monkeypatch):
+    rereads = []
+    original = ChunkedUpload._update_hash_state
+    monkeypatch.setattr(ChunkedUpload, '_update_hash_state',
+                        lambda self, state: rereads.append(state.offset) or original(self, state))
+    chunks = Chunks(chunk_size=1000, count=5)
+    pk = None
+    for index in range(chunks.count):
+        if index == 3:
+            # simulate a worker restart between chunks
+            hash_states.clear()
+        request = build_request(chunks, index)
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+    hash_states.clear()
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    # the first chunk, written by the storage, is read back, and after each
+    # restart only the bytes the new state has not seen
+    assert rereads == [0, 0, 0]
+
+
+@pytest.mark.django_db
+def test_incremental_checksum_stale_state(view, user1):
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = upload_chunks(view, user1, chunks)
+    # e.g. the file was changed behind the state's back
+    upload_id = ChunkedUpload.objects.get(pk=pk).id
+    hash_states.get(upload_id, _settings.CHECKSUM_TYPE).hasher.update(b'x')
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    # the whole file is hashed again before the upload is rejected
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.fixture
+def out_of_order_view():
+    return ChunkedUploadView.as_view(allow_out_of_order=True)
+
+
+@pytest.mark.django_db
+def test_out_of_order_upload(out_of_order_view, user1):
+    chunks = Chunks(chunk_size=1000, count=8)
+    request = build_request(chunks, 0)
+    request.user = user1
+    response = out_of_order_view(request)
+    assert response.status_code == status.HTTP_200_OK
+    pk = response.data['id']
+    indexes = list(range(1, chunks.count))
+    shuffle(indexes)
+    for index in indexes:
+        request = build_request(chunks, index)
+        request.user = user1
+        response = out_of_order_view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+    assert response.data['offset'] == chunks.total_size
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = out_of_order_view(request, pk=pk)
+    print(response.data)
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_out_of_order_upload_missing_chunk(out_of_order_view, user1):
+    chunks = Chunks(chunk_size=10, count=5)
+    pk = None
+    for index in (0, 3, 1):
+        request = build_request(chunks, index)
+        request.user = user1
+        response = out_of_order_view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+    assert response.data['offset'] == 20
+    assert response.data['received_ranges'] == '0-19,30-39'
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = out_of_order_view(request, pk=pk)
+    print(response.data)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Upload is missing chunks'
+    assert response.data['missing_ranges'] == ['20-29']
+
+
+@pytest.mark.django_db
+def test_out_of_order_upload_resent_chunk(out_of_order_view, user1):
+    chunks = Chunks(chunk_size=100, count=5)
+    # same layout, other bytes
+    corrupt = Chunks(chunk_size=100, count=5)
+    pk = None
+    for index in range(3):
+        request = build_raw_request(chunks, index)
+        request.user = user1
+        response = out_of_order_view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+
+    # a retry of a received chunk is accepted, other bytes are not
+    request = build_raw_request(chunks, 1)
+    request.user = user1
+    response = out_of_order_view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    request = build_raw_request(corrupt, 1)
+    request.user = user1
+    response = out_of_order_view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Chunk does not match the bytes already received'
+
+    # a corrupt chunk is rejected before it is written
+    request = build_raw_request(corrupt, 4)
+    request.META['HTTP_X_CHUNK_CHECKSUM'] = get_md5(chunks.data[400:])
+    request.user = user1
+    response = out_of_order_view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Chunk checksum does not match'
+    assert ChunkedUpload.objects.get(pk=pk).file.size == 300
+
+    for index in (3, 4):
+        request = build_raw_request(chunks, index)
+        request.user = user1
+        response = out_of_order_view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = out_of_order_view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    with ChunkedUpload.objects.get(pk=pk).file.open('rb') as f:
+        assert f.read() == chunks.data
+
+
+def build_raw_request(chunks, chunk_index):
+    chunk = chunks.data[chunk_index*chunks.chunk_size:(chunk_index+1)*chunks.chunk_size]
+    content_range = 'bytes {}-{}/{}'.format(
+        chunk_index*chunks.chunk_size,
+        ((chunk_index+1)*chunks.chunk_size)-1,
+        chunks.total_size,
+    )
+    return factory.put(
+        '/',
+        chunk,
+        content_type='application/octet-stream',
+        HTTP_CONTENT_RANGE=content_range,
+        HTTP_CONTENT_DISPOSITION='attachment; filename="afile"',
+    )
+
+
+@pytest.mark.django_db
+def test_raw_chunked_upload(view, user1):
+    chunks = Chunks(chunk_size=1000, count=5)
+    pk = None
+    for index in range(chunks.count):
+        request = build_raw_request(chunks, index)
+        request.user = user1
+        response = view(request, pk=pk)
+        print(response.data)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+    assert response.data['filename'] == 'afile'
+    assert response.data['offset'] == chunks.total_size
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    with chunked_upload.file.open('rb') as f:
+        assert f.read() == chunks.data
+
+
+@pytest.mark.django_db
+def test_compressed_chunked_upload(view, user1):
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = None
+    for index in range(chunks.count):
+        request = build_raw_request(chunks, index)
+        body = gzip.compress(request.read())
+        request = factory.put(
+            '/',
+            body,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=request.META['HTTP_CONTENT_RANGE'],
+            HTTP_CONTENT_DISPOSITION=request.META['HTTP_CONTENT_DISPOSITION'],
+            HTTP_CONTENT_ENCODING='gzip',
+        )
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+    assert response.data['offset'] == chunks.total_size
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    assert chunked_upload.checksum == chunks.md5
+
+    # content decompressing to more than the reported chunk is rejected,
+    # and leaves the upload as it was
+    chunks = Chunks(chunk_size=1000, count=2)
+    request = build_raw_request(chunks, 0)
+    request.user = user1
+    pk = view(request).data['id']
+    for body, detail in [
+        (gzip.compress(chunks.data), 'Decompressed chunk is larger than reported'),
+        (gzip.compress(chunks.data[1000:1500]), 'Decompressed chunk is smaller than reported'),
+        (chunks.data[1000:], 'Chunk could not be decompressed'),
+    ]:
+        request = factory.put(
+            '/',
+            body,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes 1000-1999/2000',
+            HTTP_CONTENT_ENCODING='gzip',
+        )
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['detail'] == detail
+        chunked_upload = ChunkedUpload.objects.get(pk=pk)
+        assert chunked_upload.offset == 1000
+        assert chunked_upload.file.size == 1000
+
+    request = factory.put(
+        '/',
+        chunks.data[1000:],
+        content_type='application/octet-stream',
+        HTTP_CONTENT_RANGE='bytes 1000-1999/2000',
+        HTTP_CONTENT_ENCODING='br',
+    )
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+@pytest.mark.django_db
+def test_preallocate(user1, monkeypatch):
+    view = ChunkedUploadView.as_view(preallocate=True)
+    chunks = Chunks(chunk_size=10000, count=10)
+    request = build_raw_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    pk = response.data['id']
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    # space is reserved without changing the size of the file
+    assert os.stat(chunked_upload.file.path).st_size == chunks.chunk_size
+    for index in range(1, chunks.count):
+        request = build_raw_request(chunks, index)
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+
+    def no_space(f, size):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr('drf_chunked_upload.models.preallocate', no_space)
+    request = build_raw_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_507_INSUFFICIENT_STORAGE
+    assert response.data['detail'] == 'Not enough storage space for upload'
+    assert ChunkedUpload.objects.count() == 1
+
+
+class UnreadableBodyParser(ChunkParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        raise AssertionError('request body should not have been read')
+
+
+@pytest.mark.django_db
+def test_reject_before_reading_body(user1):
+    view = ChunkedUploadView.as_view(parser_classes=[UnreadableBodyParser])
+    chunks = Chunks(chunk_size=10, count=5)
+    chunked_upload = ChunkedUpload(user=user1, filename='afile', offset=10)
+    chunked_upload.save()
+    request = build_raw_request(chunks, 2)
+    request.user = user1
+    response = view(request, pk=chunked_upload.id)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Offsets do not match'
+
+    request = build_raw_request(chunks, 1)
+    request.META['CONTENT_LENGTH'] = '5'
+    request.user = user1
+    response = view(request, pk=chunked_upload.id)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == "Request body doesn't match headers: body is 5 bytes but chunk is 10"
+
+
+@pytest.fixture
+def admission():
+    cache.clear()
+    yield AdmissionController('default')
+    cache.clear()
+
+
+@pytest.mark.django_db
+def test_admission_control(user1, user2, settings, admission, monkeypatch):
+    view = ChunkedUploadView.as_view(parser_classes=[UnreadableBodyParser])
+    settings.DRF_CHUNKED_UPLOAD_MAX_USER_CHUNKS = 1
+    importlib.reload(_settings)
+    chunks = Chunks(chunk_size=10, count=3)
+
+    # rejected before the body is read while the user has a chunk in flight
+    with admission.admit('user-{}'.format(user1.pk), 10):
+        request = build_raw_request(chunks, 0)
+        request.user = user1
+        response = view(request)
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert response.data['detail'] == 'Too many chunks in flight'
+        assert response['Retry-After'] == '1'
+    view = ChunkedUploadView.as_view()
+    request = build_raw_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    pk = response.data['id']
+
+    settings.DRF_CHUNKED_UPLOAD_MAX_USER_CHUNKS = None
+    settings.DRF_CHUNKED_UPLOAD_MAX_NODE_BYTES_PER_SECOND = 15
+    importlib.reload(_settings)
+    monkeypatch.setattr('drf_chunked_upload.admission.time.time', lambda: 1000.5)
+    request = build_raw_request(chunks, 1)
+    request.user = user1
+    assert view(request, pk=pk).status_code == status.HTTP_200_OK
+    request = build_raw_request(chunks, 2)
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.data['detail'] == 'Upload bandwidth exceeded'
+    # the budget is refilled the next second
+    monkeypatch.setattr('drf_chunked_upload.admission.time.time', lambda: 1001.5)
+    request = build_raw_request(chunks, 2)
+    request.user = user1
+    assert view(request, pk=pk).status_code == status.HTTP_200_OK
+
+    settings.DRF_CHUNKED_UPLOAD_MAX_NODE_BYTES_PER_SECOND = None
+    settings.DRF_CHUNKED_UPLOAD_MAX_ACTIVE_UPLOADS = 1
+    importlib.reload(_settings)
+    request = build_raw_request(chunks, 0)
+    request.user = user2
+    response = view(request)
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.data['detail'] == 'Too many active uploads'
+    assert response['Retry-After'] == '30'
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    assert view(request, pk=pk).status_code == status.HTTP_200_OK
+    request = build_raw_request(chunks, 0)
+    request.user = user2
+    assert view(request).status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_concurrent_append_rejected(view, user1):
+    chunks = Chunks(chunk_size=10, count=3)
+    request = build_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    pk = response.data['id']
+    first = ChunkedUpload.objects.get(pk=pk)
+    second = ChunkedUpload.objects.get(pk=pk)
+    chunk = UploadedFile(file=io.BytesIO(b'B' * 10), name='afile', size=10)
+    first.append_chunk(chunk)
+    # the losing request must not touch the bytes written by the winner
+    chunk = UploadedFile(file=io.BytesIO(b'C' * 15), name='afile', size=15)
+    with pytest.raises(OffsetConflictError):
+        second.append_chunk(chunk)
+    assert second.offset == 20
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    assert chunked_upload.offset == 20
+    data = chunks.data[:10] + b'B' * 10
+    with open(chunked_upload.file.path, 'rb') as f:
+        assert f.read() == data
+    assert chunked_upload.checksum == get_md5(data)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_claim_offset(view, user1):
+    chunks = Chunks(chunk_size=10, count=3)
+    request = build_request(chunks, 0)
+    request.user = user1
+    pk = view(request).data['id']
+    first = ChunkedUpload.objects.get(pk=pk)
+    second = ChunkedUpload.objects.get(pk=pk)
+    with first.claim_offset(10):
+        # nothing is locked while the chunk body is received
+        assert not connection.in_atomic_block
+        with pytest.raises(OffsetConflictError):
+            with second.claim_offset(10):
+                pass
+    # released when the claim ends without a new offset
+    with second.claim_offset(10):
+        pass
+    assert ChunkedUpload.objects.get(pk=pk).claim == ''
+
+    # a claim of a request that died is presumed abandoned once stale
+    ChunkedUpload.objects.filter(pk=pk).update(claim='x', claimed_at=timezone.now())
+    with pytest.raises(OffsetConflictError):
+        second.append_chunk(UploadedFile(file=io.BytesIO(b'B' * 10), name='afile', size=10))
+    ChunkedUpload.objects.filter(pk=pk).update(
+        claimed_at=timezone.now() - ChunkedUpload.claim_timeout,
+    )
+    second.append_chunk(UploadedFile(file=io.BytesIO(b'B' * 10), name='afile', size=10))
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    assert (chunked_upload.offset, chunked_upload.claim) == (20, '')
+
+
+@pytest.fixture
+def state_cache(settings):
+    settings.DRF_CHUNKED_UPLOAD_STATE_CACHE = 'default'
+    importlib.reload(_settings)
+    yield
+    cache.clear()
+
+
+@pytest.mark.django_db
+def test_state_cache_upload(view, user1, state_cache, django_assert_num_queries):
+    chunks = Chunks(chunk_size=1000, count=5)
+    request = build_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    pk = response.data['id']
+    for index in range(1, chunks.count):
+        request = build_request(chunks, index)
+        request.user = user1
+        if index == 1:
+            response = view(request, pk=pk)
+        else:
+            with django_assert_num_queries(0):
+                response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['offset'] == (index + 1) * chunks.chunk_size
+
+    # write-behind: the database has not caught up yet
+    assert ChunkedUpload.objects.get(pk=pk).offset < chunks.total_size
+    request = factory.get('/')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.data['offset'] == chunks.total_size
+
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    assert chunked_upload.offset == chunks.total_size
+    assert chunked_upload.status == ChunkedUpload.COMPLETE
+
+
+@pytest.mark.django_db
+def test_state_cache_lost(view, user1, user2, state_cache):
+    chunks = Chunks(chunk_size=1000, count=5)
+    pk = None
+    for index in range(chunks.count):
+        if index == 3:
+            cache.clear()
+        request = build_request(chunks, index)
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+
+    request = build_request(chunks, 4)
+    request.user = user2
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    cache.clear()
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_state_cache_queryset_access(view, user1, state_cache):
+    class NoSecretsView(ChunkedUploadView):
+        def get_queryset(self):
+            return super().get_queryset().exclude(filename='secret')
+
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = None
+    for index in range(2):
+        request = build_request(chunks, index)
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+    ChunkedUpload.objects.filter(pk=pk).update(filename='secret')
+
+    # cached by the requests to `view`, but not in NoSecretsView's queryset
+    request = build_request(chunks, 2)
+    request.user = user1
+    response = NoSecretsView.as_view()(request, pk=pk)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_state_cache_lost_update_offset(view, user1, state_cache):
+    chunks = Chunks(chunk_size=1000, count=5)
+    request = build_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    chunked_upload = ChunkedUpload.objects.get(pk=response.data['id'])
+    state = get_state_cache()
+
+    # lost between reading and updating the offset: re-seeded from the
+    # file, so a stale expected offset is still rejected
+    cache.clear()
+    chunked_upload.offset = 3000
+    assert chunked_upload.update_offset(2000) is False
+    assert state.get_offset(chunked_upload) == 1000
+
+    cache.clear()
+    chunked_upload.offset = 2000
+    assert chunked_upload.update_offset(1000) is True
+    assert state.get_offset(chunked_upload) == 2000
+
+    request = build_request(chunks, 2)
+    request.user = user1
+    response = view(request, pk=chunked_upload.pk)
+    assert response.status_code == status.HTTP_200_OK
+    # the record lags behind the lost offset, but the file does not
+    assert ChunkedUpload.objects.get(pk=chunked_upload.pk).offset < 3000
+    cache.clear()
+    chunked_upload.offset = 2000
+    assert chunked_upload.update_offset(1000) is False
+    assert state.get_offset(chunked_upload) == 3000
+
+
+@pytest.fixture
+def handle_pool(settings):
+    settings.DRF_CHUNKED_UPLOAD_FILE_HANDLE_POOL_SIZE = 2
+    importlib.reload(_settings)
+    yield
+    file_handles.clear()
+
+
+@pytest.mark.django_db
+def test_file_handle_pool(view, user1, handle_pool):
+    chunks = Chunks(chunk_size=1000, count=5)
+    pk = None
+    for index in range(chunks.count):
+        request = build_request(chunks, index)
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+        if index:
+            assert len(file_handles) == 1
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    assert len(file_handles) == 0
+
+
+def test_file_handle_pool_eviction(tmp_path):
+    pool = FileHandlePool(max_handles=2, idle_timeout=60)
+    handles = []
+    for key in range(3):
+        path = str(tmp_path / str(key))
+        f = pool.acquire(key, path)
+        f.write(b'data')
+        pool.release(key, path, f)
+        handles.append(f)
+    assert len(pool) == 2
+    assert handles[0].closed
+    assert not handles[2].closed
+
+    pool.idle_timeout = 0
+    pool.acquire(3, str(tmp_path / '3')).close()
+    assert len(pool) == 0
+    assert all(f.closed for f in handles)
+
+
+class ImmediateExecutor:
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+class AsyncCompletionView(ChunkedUploadView):
+    async_completion = True
+
+
+# django_capture_on_commit_callbacks needs Django 3.2 and pytest-django 4.4
+requires_on_commit_capture = pytest.mark.skipif(
+    django.VERSION < (3, 2)
+    or not hasattr(pytest_django.fixtures, 'django_capture_on_commit_callbacks'),
+    reason='django_capture_on_commit_callbacks is not available',
+)
+
+
+@pytest.fixture
+def immediate_executor(settings):
+    settings.DRF_CHUNKED_UPLOAD_COMPLETION_EXECUTOR = ImmediateExecutor()
+    importlib.reload(_settings)
+
+
+def upload_chunks(view, user, chunks):
+    pk = None
+    for index in range(chunks.count):
+        request = build_request(chunks, index)
+        request.user = user
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+    return pk
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('mode,syncs', [
+    ('none', 0),
+    ('completion', 2),
+    ('interval', 5),
+])
+def test_durability(view, user1, settings, monkeypatch, mode, syncs):
+    settings.DRF_CHUNKED_UPLOAD_DURABILITY = mode
+    settings.DRF_CHUNKED_UPLOAD_DURABILITY_INTERVAL_BYTES = 25
+    settings.DRF_CHUNKED_UPLOAD_DURABILITY_INTERVAL = timedelta(hours=1)
+    importlib.reload(_settings)
+    synced = []
+    monkeypatch.setattr('drf_chunked_upload.durability.os.fsync', synced.append)
+    chunks = Chunks(chunk_size=10, count=10)
+    pk = upload_chunks(view, user1, chunks)
+    # the first chunk is written with the new upload, so 9 chunks are
+    # appended: 90 bytes, synced every 30
+    assert len(synced) == (3 if mode == 'interval' else 0)
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    # the file and its directory are synced on completion
+    assert len(synced) == syncs
+
+
+@pytest.mark.django_db
+def test_durability_resume(view, user1, settings, monkeypatch):
+    settings.DRF_CHUNKED_UPLOAD_DURABILITY = 'interval'
+    settings.DRF_CHUNKED_UPLOAD_DURABILITY_INTERVAL_BYTES = 25
+    settings.DRF_CHUNKED_UPLOAD_DURABILITY_INTERVAL = timedelta(hours=1)
+    importlib.reload(_settings)
+    monkeypatch.setattr('drf_chunked_upload.durability.os.fsync', lambda fd: None)
+    chunks = Chunks(chunk_size=10, count=6)
+    pk = None
+    for index in range(5):
+        request = build_request(chunks, index)
+        request.user = user1
+        pk = view(request, pk=pk).data['id']
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    # synced after 30 bytes were appended, never ahead of the disk
+    assert chunked_upload.synced_offset == 40
+    assert chunked_upload.offset == 50
+    request = factory.get('/')
+    request.user = user1
+    assert view(request, pk=pk).data['synced_offset'] == 40
+
+    # a chunk can start from synced_offset, but not before it
+    request = build_request(chunks, 3)
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['expected_offset'] == 50
+    request = build_request(chunks, 4)
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['offset'] == 50
+    request = build_request(chunks, 5)
+    request.user = user1
+    assert view(request, pk=pk).status_code == status.HTTP_200_OK
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    assert ChunkedUpload.objects.get(pk=pk).synced_offset == 60
+
+
+@requires_on_commit_capture
+@pytest.mark.django_db
+@pytest.mark.parametrize('checksum,final_status,error', [
+    (None, ChunkedUpload.COMPLETE, ''),
+    ('12345', ChunkedUpload.UPLOADING, 'checksum does not match'),
+])
+def test_async_completion(user1, immediate_executor, django_capture_on_commit_callbacks,
+                          checksum, final_status, error):
+    view = AsyncCompletionView.as_view()
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = upload_chunks(view, user1, chunks)
+    request = factory.post('/', {'md5': checksum or chunks.md5}, format='multipart')
+    request.user = user1
+    # completion is only submitted once the request's transaction commits
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        response = view(request, pk=pk)
+        assert ChunkedUpload.objects.get(pk=pk).status == ChunkedUpload.FINALIZING
+    assert len(callbacks) == 1
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.data['status'] == ChunkedUpload.FINALIZING
+
+    request = factory.get('/')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.data['status'] == final_status
+    assert response.data['completion_error'] == error
+
+
+@requires_on_commit_capture
+@pytest.mark.django_db
+def test_stale_finalizing(user1, immediate_executor, django_capture_on_commit_callbacks):
+    view = AsyncCompletionView.as_view()
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = upload_chunks(view, user1, chunks)
+    # the background completion is lost
+    with django_capture_on_commit_callbacks(execute=False):
+        request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+        request.user = user1
+        assert view(request, pk=pk).status_code == status.HTTP_202_ACCEPTED
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Upload has already been marked as "finalizing"'
+
+    ChunkedUpload.objects.filter(pk=pk).update(
+        finalizing_at=timezone.now() - _settings.FINALIZING_TIMEOUT,
+    )
+    with django_capture_on_commit_callbacks(execute=True):
+        request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+        request.user = user1
+        assert view(request, pk=pk).status_code == status.HTTP_202_ACCEPTED
+    assert ChunkedUpload.objects.get(pk=pk).status == ChunkedUpload.COMPLETE
+
+
+@pytest.mark.django_db
+def test_late_finalize(user1):
+    view = AsyncCompletionView.as_view()
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = upload_chunks(view, user1, chunks)
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    assert chunked_upload.finalizing()
+    duplicate = ChunkedUpload.objects.get(pk=pk)
+    AsyncCompletionView().finalize(ChunkedUpload.objects.get(pk=pk), chunks.md5)
+    assert ChunkedUpload.objects.get(pk=pk).status == ChunkedUpload.COMPLETE
+
+    # a duplicate or late task does not fail the completed upload
+    AsyncCompletionView().finalize(duplicate, '12345')
+    assert not duplicate.completion_failed('checksum does not match')
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    assert chunked_upload.status == ChunkedUpload.COMPLETE
+    assert chunked_upload.completion_error == ''
+
+
+@pytest.mark.django_db
+def test_chunk_checksums(view, user1):
+    chunks = Chunks(chunk_size=1000, count=4)
+    pk = None
+    checksums = []
+    for index in range(chunks.count):
+        request = build_raw_request(chunks, index)
+        checksum = get_md5(chunks.data[index*chunks.chunk_size:(index+1)*chunks.chunk_size])
+        checksums.append(checksum)
+        request.META['HTTP_X_CHUNK_CHECKSUM'] = checksum
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+
+    # recorded beside the upload file, not in the record
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    assert chunked_upload.chunk_checksums == ''
+    checksums_path = chunked_upload.get_chunk_checksums_path()
+    with open(checksums_path) as f:
+        assert len(f.read().splitlines()) == chunks.count
+
+    request = factory.post('/', {'chunk_checksums': ','.join(checksums[:-1])}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'chunk checksums do not match'
+
+    request = factory.post('/', {'chunk_checksums': ','.join(checksums)}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    assert not os.path.exists(checksums_path)
+
+
+@pytest.mark.django_db
+def test_chunk_checksum_mismatch(view, user1):
+    chunks = Chunks(chunk_size=1000, count=3)
+    request = build_raw_request(chunks, 0)
+    request.META['HTTP_X_CHUNK_CHECKSUM'] = get_md5(b'corrupt')
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Chunk checksum does not match'
+    assert not ChunkedUpload.objects.exists()
+
+    request = build_raw_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    pk = response.data['id']
+    request = build_raw_request(chunks, 1)
+    request.META['HTTP_X_CHUNK_CHECKSUM'] = get_md5(b'corrupt')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Chunk checksum does not match'
+    chunked_upload = ChunkedUpload.objects.get(pk=pk)
+    assert chunked_upload.offset == chunks.chunk_size
+    assert chunked_upload.file.size == chunks.chunk_size
+
+    request = build_raw_request(chunks, 1)
+    request.META['HTTP_X_CHUNK_CHECKSUM'] = 'not hex'
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Error in request headers'
+
+
+@pytest.mark.django_db
+def test_phase_timing(user1, settings):
+    callbacks = []
+    settings.DRF_CHUNKED_UPLOAD_TIMING_CALLBACK = lambda request, timings: callbacks.append(timings)
+    importlib.reload(_settings)
+    signals = []
+
+    def receiver(sender, request, response, timings, **kwargs):
+        signals.append((sender, timings))
+
+    upload_timed.connect(receiver)
+    try:
+        view = ChunkedUploadView.as_view(timing=True)
+        chunks = Chunks(chunk_size=1000, count=2)
+        pk = upload_chunks(view, user1, chunks)
+        request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+        request.user = user1
+        response = view(request, pk=pk)
+    finally:
+        upload_timed.disconnect(receiver)
+
+    assert response.status_code == status.HTTP_200_OK
+    phases = [p.split(';')[0] for p in response['Server-Timing'].split(', ')]
+    assert {'total', 'lookup', 'checksum', 'save', 'on_completion'} <= set(phases)
+    assert len(signals) == 3
+    assert signals[0][0] is ChunkedUploadView
+    assert {'parse', 'write', 'serialize'} <= set(signals[0][1])
+    assert {'lookup', 'parse', 'checksum', 'write', 'save'} <= set(signals[1][1])
+    assert [timings for _, timings in signals] == callbacks
+
+
+@pytest.mark.django_db
+def test_phase_timing_disabled(view, user1):
+    chunks = Chunks(chunk_size=1000, count=1)
+    request = build_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    assert not response.has_header('Server-Timing')
+
+
+@pytest.fixture
+def clear_metrics():
+    metrics.registry.clear()
+    yield
+    metrics.registry.clear()
+
+
+@pytest.mark.django_db
+def test_metrics(view, user1, clear_metrics):
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = upload_chunks(view, user1, chunks)
+    request = factory.post('/', {'md5': '12345'}, format='multipart')
+    request.user = user1
+    view(request, pk=pk)
+
+    assert metrics.bytes_received.get() == chunks.total_size
+    assert metrics.chunks_received.get() == chunks.count
+    assert metrics.chunk_seconds.get()[0] == chunks.count
+    assert metrics.checksum_seconds.get()[0] == 1
+    assert metrics.completion_failures.get(reason='checksum_mismatch') == 1
+
+    metrics_view = ChunkedUploadMetricsView.as_view()
+    request = factory.get('/metrics')
+    request.user = user1
+    response = metrics_view(request)
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    user1.is_staff = True
+    request = factory.get('/metrics')
+    request.user = user1
+    response = metrics_view(request)
+    assert response.status_code == status.HTTP_200_OK
+    text = response.rendered_content.decode()
+    assert response['Content-Type'].startswith('text/plain')
+    assert 'drf_chunked_upload_bytes_received_total 3000\n' in text
+    assert 'drf_chunked_upload_active_uploads 1\n' in text
+    assert 'drf_chunked_upload_chunk_request_seconds_bucket{le="+Inf"} 3\n' in text
+    assert 'drf_chunked_upload_completion_failures_total{reason="checksum_mismatch"} 1\n' in text
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('chunk_response', ['minimal', 'headers'])
+def test_chunk_ack(user1, chunk_response):
+    view = ChunkedUploadView.as_view(chunk_response=chunk_response)
+    chunks = Chunks(chunk_size=1000, count=3)
+    request = build_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    assert 'url' in response.data
+    pk = response.data['id']
+    expires_at = DateTimeField().to_representation(ChunkedUpload.objects.get(pk=pk).expires_at)
+
+    for index in range(1, chunks.count):
+        request = build_request(chunks, index)
+        request.user = user1
+        response = view(request, pk=pk)
+        if chunk_response == 'headers':
+            assert response.status_code == status.HTTP_204_NO_CONTENT
+            assert response.data is None
+            ack = {
+                'id': response['Upload-Id'],
+                'offset': int(response['Upload-Offset']),
+                'expires_at': response['Upload-Expires-At'],
+            }
+        else:
+            assert response.status_code == status.HTTP_200_OK
+            ack = response.data
+        assert ack == {
+            'id': pk,
+            'offset': (index + 1) * chunks.chunk_size,
+            'expires_at': expires_at,
+        }
+
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['status'] == ChunkedUpload.COMPLETE
+
+
+@pytest.mark.django_db
+def test_list_uploads_cursor_pagination(user1):
+    view = ChunkedUploadView.as_view(pagination_class=ChunkedUploadCursorPagination)
+    uploads = [
+        ChunkedUpload.objects.create(user=user1, filename='upload{}'.format(i))
+        for i in range(5)
+    ]
+    pks = []
+    url = '/?page_size=2'
+    while url:
+        request = factory.get(url)
+        request.user = user1
+        response = view(request)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) <= 2
+        pks.extend(upload['id'] for upload in response.data['results'])
+        url = response.data['next']
+    assert pks == [str(upload.pk) for upload in sorted(
+        uploads, key=lambda upload: (upload.created_at, upload.pk), reverse=True,
+    )]
+
+
+@isolate_apps('drf_chunked_upload')
+def test_abstract_model_indexes():
+    class CustomUpload(models.AbstractChunkedUpload):
+        class Meta(models.AbstractChunkedUpload.Meta):
+            app_label = 'drf_chunked_upload'
+
+    assert {index.name for index in CustomUpload._meta.indexes} == {
+        'customupload_expiry', 'customupload_digest',
+    }
+    assert not CustomUpload.check()
+    assert {index.name for index in ChunkedUpload._meta.indexes} == {
+        'chunkedupload_expiry', 'chunkedupload_digest', 'chunkedupload_user_created',
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(django.VERSION < (4, 1), reason='async views require Django 4.1')
+def test_async_view(user1, user2):
+    from drf_chunked_upload.async_views import AsyncChunkedUploadView
+
+    view = AsyncChunkedUploadView.as_view()
+    assert asyncio.iscoroutinefunction(view)
+    view = async_to_sync(view)
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = upload_chunks(view, user1, chunks)
+
+    request = build_request(chunks, 0)
+    request.user = user2
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    request = factory.post('/', {'md5': '12345'}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'checksum does not match'
+
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['status'] == ChunkedUpload.COMPLETE
+
+    request = factory.get('/')
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    assert [upload['id'] for upload in response.data] == [pk]
+
+
+@pytest.fixture
+def chunk_store(tmp_path, settings):
+    settings.DRF_CHUNKED_UPLOAD_CHUNK_STORE = str(tmp_path / 'chunks')
+    importlib.reload(_settings)
+
+
+@pytest.mark.django_db
+def test_chunk_store(view, user1, user2, chunk_store, monkeypatch):
+    copies = []
+
+    def copy_range(src, dst, offset, size):
+        copies.append(size)
+        return chunkstore.copy_range(src, dst, offset, size)
+
+    monkeypatch.setattr(models, 'copy_range', copy_range)
+    chunks = Chunks(chunk_size=1000, count=3)
+    checksums = [
+        get_md5(chunks.data[index*chunks.chunk_size:(index+1)*chunks.chunk_size])
+        for index in range(chunks.count)
+    ]
+    # stored chunks are named by sha256, whatever the checksum type
+    digests = [
+        hashlib.sha256(chunks.data[index*chunks.chunk_size:(index+1)*chunks.chunk_size]).hexdigest()
+        for index in range(chunks.count)
+    ]
+    pk = None
+    for index in (0, 2):
+        request = build_raw_request(chunks, index)
+        request.META['HTTP_X_CHUNK_CHECKSUM'] = checksums[index]
+        request.user = user1
+        response = view(request, pk=pk)
+        if pk is None:
+            pk = response.data['id']
+        else:
+            # out of order; only the checksum of the first chunk is stored
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    store_view = ChunkStoreView.as_view()
+    request = factory.post('/', {'checksums': digests}, format='json')
+    request.user = user1
+    response = store_view(request)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {'stored': digests[:1]}
+
+    request = factory.post('/', {'checksums': ['../../etc/passwd']}, format='json')
+    request.user = user1
+    response = store_view(request)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # chunks are only visible to, and usable by, the user who stored them
+    request = factory.post('/', {'checksums': digests}, format='json')
+    request.user = AnonymousUser()
+    response = store_view(request)
+    assert response.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+    request = factory.post('/', {'checksums': digests}, format='json')
+    request.user = user2
+    response = store_view(request)
+    assert response.data == {'stored': []}
+
+    def stored_request(index):
+        return factory.put(
+            '/',
+            {'filename': 'afile'},
+            format='json',
+            HTTP_CONTENT_RANGE='bytes {}-{}/3000'.format(
+                index * chunks.chunk_size, (index + 1) * chunks.chunk_size - 1,
+            ),
+            HTTP_X_CHUNK_CHECKSUM=checksums[index],
+            HTTP_X_CHUNK_STORED=digests[index],
+        )
+
+    request = stored_request(0)
+    request.user = user2
+    response = view(request)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Chunk is not stored'
+
+    # a second upload of the same file reuses the stored chunk
+    request = stored_request(0)
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    pk = response.data['id']
+    assert response.data['offset'] == chunks.chunk_size
+    # copied from the store, not written through Python
+    assert copies == [chunks.chunk_size]
+
+    request = stored_request(1)
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Chunk is not stored'
+
+    for index in (1, 2):
+        request = build_raw_request(chunks, index)
+        request.META['HTTP_X_CHUNK_CHECKSUM'] = checksums[index]
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    with ChunkedUpload.objects.get(pk=pk).file.open('rb') as f:
+        assert f.read() == chunks.data
+
+    request = factory.post('/', {'checksums': ','.join(digests)}, format='multipart')
+    request.user = user1
+    response = store_view(request)
+    assert response.data == {'stored': digests}
+
+
+@pytest.mark.django_db
+def test_instant_completion(user1, user2, tmp_path):
+    view = ChunkedUploadView.as_view(instant_completion=True)
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = upload_chunks(view, user1, chunks)
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    source = ChunkedUpload.objects.get(pk=pk)
+    assert source.digest == 'md5:{}'.format(chunks.md5)
+
+    request = build_raw_request(chunks, 0)
+    request.META['HTTP_X_UPLOAD_CHECKSUM'] = chunks.md5
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['status'] == ChunkedUpload.COMPLETE
+    assert response.data['offset'] == chunks.total_size
+    assert response.data['filename'] == 'afile'
+    chunked_upload = ChunkedUpload.objects.get(pk=response.data['id'])
+    assert chunked_upload.file.name != source.file.name
+    with chunked_upload.file.open('rb') as f:
+        assert f.read() == chunks.data
+    source.delete()
+    assert chunked_upload.file.storage.exists(chunked_upload.file.name)
+
+    # the body is not read: a multipart body is not parsed, so the file name
+    # comes from the query string
+    request = factory.put('/?filename=bfile', b'x' * 1000,
+                          content_type='multipart/form-data; boundary=none')
+    request.META['HTTP_CONTENT_RANGE'] = 'bytes 0-999/3000'
+    request.META['HTTP_X_UPLOAD_CHECKSUM'] = chunks.md5
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['status'] == ChunkedUpload.COMPLETE
+    assert response.data['filename'] == 'bfile'
+
+    # but the headers are checked first
+    request = build_raw_request(chunks, 0)
+    request.META['HTTP_X_UPLOAD_CHECKSUM'] = chunks.md5
+    request.user = user1
+    response = ChunkedUploadView.as_view(instant_completion=True, max_bytes=2000)(request)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Size of file exceeds the limit (2000 bytes)'
+
+    # other users' uploads and other sizes are not matched
+    for user, total in ((user2, 3000), (user1, 4000)):
+        request = build_raw_request(chunks, 0)
+        request.META['HTTP_X_UPLOAD_CHECKSUM'] = chunks.md5
+        request.META['HTTP_CONTENT_RANGE'] = 'bytes 0-999/{}'.format(total)
+        request.user = user
+        response = view(request)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['status'] == ChunkedUpload.UPLOADING
+
+
+MAGIC = b'\x89UPL'
+
+
+class MagicTap(Tap):
+    """
+    Rejects uploads that do not start with `MAGIC`.
+    """
+
+    def start(self):
+        return b''
+
+    def update(self, state, data):
+        if len(state) < len(MAGIC):
+            state += data[:len(MAGIC) - len(state)]
+            if not MAGIC.startswith(state):
+                raise TapError('Not an UPL file')
+        return state
+
+
+class TapResultsView(ChunkedUploadView):
+    def on_completion(self, chunked_upload, request):
+        return Response(chunked_upload.tap_results)
+
+
+@pytest.mark.django_db
+def test_taps(user1, settings, monkeypatch):
+    settings.DRF_CHUNKED_UPLOAD_TAPS = [HashTap, MagicTap]
+    importlib.reload(_settings)
+    view = TapResultsView.as_view()
+    chunks = Chunks(chunk_size=10, count=5)
+    chunks.data = MAGIC + chunks.data[len(MAGIC):]
+    chunks.md5 = get_md5(chunks.data)
+    request = build_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    pk = response.data['id']
+
+    # after the first chunk, taps see the data as it is written
+    # without reading it back from the file
+    rereads = []
+    original = ChunkedUpload._update_hash_state
+    monkeypatch.setattr(ChunkedUpload, '_update_hash_state',
+                        lambda self, state: rereads.append(state) or original(self, state))
+    for index in range(1, chunks.count):
+        request = build_request(chunks, index)
+        request.user = user1
+        assert view(request, pk=pk).status_code == status.HTTP_200_OK
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {
+        'sha256': hashlib.sha256(chunks.data).hexdigest(),
+        'MagicTap': MAGIC,
+    }
+    assert not [state for state in rereads if isinstance(state, TapState)]
+
+    # invalid files are rejected on the chunk that shows it
+    chunks = Chunks(chunk_size=2, count=5)
+    chunks.data = MAGIC[:2] + b'no' + chunks.data[4:]
+    request = build_request(chunks, 0)
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_200_OK
+    pk = response.data['id']
+    request = build_request(chunks, 1)
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Not an UPL file'
+    assert ChunkedUpload.objects.get(pk=pk).offset == 2
+
+    request = factory.post('/', {'filename': 'afile', 'file': io.BytesIO(b'nope')},
+                           format='multipart')
+    request.user = user1
+    response = view(request)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['detail'] == 'Not an UPL file'
+    assert ChunkedUpload.objects.count() == 2
+
+
+class SizeTap(Tap):
+    name = 'size'
+
+    def start(self):
+        return 0
+
+    def update(self, state, data):
+        return state + len(data)
+
+
+@pytest.mark.django_db
+def test_taps_lost_state(user1, settings, monkeypatch):
+    settings.DRF_CHUNKED_UPLOAD_TAPS = [SizeTap]
+    importlib.reload(_settings)
+    view = TapResultsView.as_view()
+    rereads = []
+    original = ChunkedUpload._update_hash_state
+    monkeypatch.setattr(ChunkedUpload, '_update_hash_state',
+                        lambda self, state: rereads.append((type(state), state.offset))
+                        or original(self, state))
+    chunks = Chunks(chunk_size=1000, count=5)
+    pk = None
+    for index in range(chunks.count):
+        if index == 3:
+            # simulate a worker restart between chunks
+            tap_states.clear()
+        request = build_request(chunks, index)
+        request.user = user1
+        response = view(request, pk=pk)
+        assert response.status_code == status.HTTP_200_OK
+        pk = response.data['id']
+    saved = TapState.load(ChunkedUpload.objects.get(pk=pk).tap_state, [SizeTap()])
+    assert saved.offset == chunks.total_size
+
+    tap_states.clear()
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {'size': chunks.total_size}
+    # only the first chunk, written by the storage, is read back: the state
+    # saved with the upload is restored after each restart
+    assert [offset for kind, offset in rereads if kind is TapState] == [0]
+    assert ChunkedUpload.objects.get(pk=pk).tap_state == ''
+
+
+@pytest.mark.django_db
+def test_taps_unserializable_state(user1, settings):
+    # hashlib objects cannot be serialized, so the state is not saved
+    settings.DRF_CHUNKED_UPLOAD_TAPS = [HashTap, SizeTap]
+    importlib.reload(_settings)
+    view = TapResultsView.as_view()
+    chunks = Chunks(chunk_size=1000, count=3)
+    pk = upload_chunks(view, user1, chunks)
+    assert ChunkedUpload.objects.get(pk=pk).tap_state == ''
+    tap_states.clear()
+    request = factory.post('/', {'md5': chunks.md5}, format='multipart')
+    request.user = user1
+    response = view(request, pk=pk)
+    assert response.data == {
+        'sha256': hashlib.sha256(chunks.data).hexdigest(),
+        'size': chunks.total_size,
+    }